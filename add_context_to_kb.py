@@ -1,23 +1,13 @@
 import json
 
+import vocabulary
+
 # === НАСТРОЙКА ===
 # Пути к вашим файлам
 INPUT_FILE = './data/knowledge_base.json'
 OUTPUT_FILE = './data/knowledge_base_with_context.json'
 
-# Словарь синонимов, по которому мы будем искать ключевые слова в ответах.
-SYNONYM_MAP = {
-    'бутылки': ['бутылк', 'пэт', 'пластик'],
-    'пластик': ['пластик', 'пэт', 'бутылк', 'hdpe', 'пнд'],
-    'батарейки': ['батарейк', 'аккумулятор'],
-    'бумага': ['бумаг', 'макулатур', 'картон', 'книг'],
-    'стекло': ['стекл', 'банк'],
-    'одежда': ['одежд', 'вещи', 'текстиль'],
-    'металл': ['металл', 'жестян', 'алюмин'],
-    'крышки': ['крышк'],
-    'техника': ['техник', 'электроника', 'бытовая техника'],
-    'опасные отходы': ['опасные отходы', 'ртуть', 'градусник', 'лампочк', 'лампа']
-}
+# Словарь синонимов общий с ботом: vocabulary.MATERIAL_SYNONYMS
 
 print("Начинаем обработку базы знаний...")
 
@@ -33,19 +23,8 @@ new_knowledge_base = []
 
 # Проходим по каждой записи (вопрос-ответ) в базе
 for item in knowledge_base:
-    question = item.get('question', '').lower()
-    answer = item.get('answer', '').lower()
-    
-    found_context = None
-    
-    # Ищем ключевое слово в ответе
-    for context_key, search_terms in SYNONYM_MAP.items():
-        for term in search_terms:
-            if term in answer:
-                found_context = context_key # Нашли! Запоминаем главный синоним
-                break
-        if found_context:
-            break
+    # Ищем ключевое слово в ответе одним проходом общего словаря (по основам слов)
+    found_context = vocabulary.scan(item.get('answer', '')).material_category()
             
     # Если контекст был найден, добавляем его в запись
     if found_context:
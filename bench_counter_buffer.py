@@ -0,0 +1,77 @@
+# bench_counter_buffer.py
+# Пропускная способность записи при всплеске начислений (рассылка совета дня, реферальная акция):
+# потоки-обработчики одновременно применяют события gamification.apply_event - сначала с прямой записью
+# (транзакция SQLite на каждое событие), затем с отложенной записью (counter_buffer.py, пачки executemany).
+# После каждого прогона сумма очков в базе сверяется с числом начислений - ничего не потеряно.
+# Запуск: python bench_counter_buffer.py [событий] [потоков] [пользователей]
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import fakes
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def burst(db, gamification, events: int, threads: int, users: int, seed: int) -> float:
+    """События в секунду: events событий по 1 очку, поровну между threads потоками."""
+    def worker(index):
+        rng = random.Random(seed + index)
+        for _ in range(events // threads):
+            user_id = rng.randint(1, users)
+            gamification.apply_event(user_id, [gamification.Award(1, "За проявленный интерес к экологии")],
+                                     update=lambda profile: {'last_tip_date': '2024-01-01'})
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (events // threads * threads) / (time.perf_counter() - started)
+
+
+def quarterly_total(db) -> int:
+    return db.get_connection().execute("SELECT COALESCE(SUM(quarterly_points), 0) FROM user_profiles").fetchone()[0]
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    users = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    work_dir = tempfile.mkdtemp(prefix='eco_bench_buffer_')
+    fakes.install_config(DATA_DIR, work_dir)
+    import db_manager as db
+    import gamification
+    db.init_db()
+    # Профили создаются заранее: замеряем начисления, а не регистрацию. Достижение first_steps
+    # выдано всем сразу - его 20 очков не смешиваются с начислениями замера
+    with db.transaction() as conn:
+        conn.executemany("INSERT OR IGNORE INTO user_profiles (user_id) VALUES (?)", [(i,) for i in range(1, users + 1)])
+        conn.executemany("INSERT OR IGNORE INTO user_achievements (user_id, achievement_id) VALUES (?, 'first_steps')",
+                         [(i,) for i in range(1, users + 1)])
+
+    print(f"Событий: {events}, потоков: {threads}, пользователей: {users}")
+    before = quarterly_total(db)
+    direct = burst(db, gamification, events, threads, users, seed=1)
+    print(f"  прямая запись:      {direct:8.0f} событий/с, очков записано {quarterly_total(db) - before} из {events}")
+
+    before = quarterly_total(db)
+    buffer = db.enable_write_behind(flush_interval=0.5, max_events=500)
+    buffered = burst(db, gamification, events, threads, users, seed=1)
+    db.stop_write_behind()
+    stats = buffer.stats()
+    print(f"  отложенная запись:  {buffered:8.0f} событий/с, очков записано {quarterly_total(db) - before} из {events} "
+          f"(x{buffered / direct:.1f})")
+    print(f"  буфер: {stats['flushes']} записей пачкой, {stats['rows']} строк, последняя пачка {stats['last_flush_ms']} мс, "
+          f"в среднем {events / stats['flushes']:.0f} событий на коммит (при прямой записи - одно)")
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# bench_data_load.py
+# Сравнение загрузки данных: прежний путь через pandas (read_csv -> fillna -> to_dict) и data_store.
+# Каждый вариант запускается в отдельном процессе: меряются время импорта+загрузки и пиковый RSS.
+# pandas нужен только для этого сравнения; если его нет, вариант пропускается.
+# Запуск: python bench_data_load.py [число_повторов]
+
+import json
+import os
+import subprocess
+import sys
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+POINTS_PATH = os.path.join(DATA_DIR, 'recycling_points.csv')
+JSON_PATHS = [os.path.join(DATA_DIR, name) for name in ('knowledge_base.json', 'interesting_facts.json', 'eco_tips.json')]
+
+MODES = {
+    'baseline': "import csv, json",
+    'pandas': (
+        "import json\n"
+        "import pandas as pd\n"
+        "points = pd.read_csv(POINTS_PATH, header=0, names=['name', 'city', 'address', 'accepts', 'work_hours', 'phone_number', 'website'])\n"
+        "points = points.fillna('').to_dict('records')\n"
+        "texts = [json.load(open(path, encoding='utf-8')) for path in JSON_PATHS]\n"
+    ),
+    'data_store': (
+        "import data_store\n"
+        "points = data_store.load_points(POINTS_PATH)\n"
+        "knowledge = data_store.load_knowledge(JSON_PATHS[0])\n"
+        "texts = [data_store.load_texts(path) for path in JSON_PATHS[1:]]\n"
+    ),
+}
+
+
+def run_mode(mode: str) -> dict:
+    """Выполняется в дочернем процессе: загрузка и замер."""
+    import resource
+    import time
+    started = time.perf_counter()
+    exec(MODES[mode], {'POINTS_PATH': POINTS_PATH, 'JSON_PATHS': JSON_PATHS})
+    elapsed = time.perf_counter() - started
+    return {'seconds': elapsed, 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def measure(mode: str, repeats: int) -> dict | None:
+    samples = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, __file__, '--child', mode], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode != 0:
+            print(f"{mode}: пропущен ({result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'ошибка'})")
+            return None
+        samples.append(json.loads(result.stdout))
+    samples.sort(key=lambda sample: sample['seconds'])
+    median = samples[len(samples) // 2]
+    return {'seconds': median['seconds'], 'max_rss_kb': max(sample['max_rss_kb'] for sample in samples)}
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        print(json.dumps(run_mode(sys.argv[2])))
+        return
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = {mode: measure(mode, repeats) for mode in MODES}
+    baseline_rss = results['baseline']['max_rss_kb'] if results['baseline'] else 0
+    for mode, result in results.items():
+        if result:
+            print(f"{mode:>10}: импорт+загрузка {result['seconds'] * 1000:7.1f} мс (медиана из {repeats}), "
+                  f"пиковый RSS {result['max_rss_kb'] / 1024:6.1f} МБ (+{(result['max_rss_kb'] - baseline_rss) / 1024:.1f} МБ к голому Python)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# bench_db.py
+# Замер db_manager: прежний доступ (connect/commit/close на каждый запрос, журнал отката)
+# против db_connection (соединение на поток, WAL, synchronous=NORMAL, кэш подготовленных выражений).
+# Нагрузка - те же запросы, что делает нажатие "я сдал вторсырье": профиль, статистика, очки, достижения.
+# Считаются операции (вызовы функций db_manager) в секунду в одном потоке и в нескольких потоках сразу.
+# Запуск: python bench_db.py [число_нажатий] [число_потоков]
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+import fakes
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+USERS = 1000
+
+
+class LegacyDb:
+    """Прежние функции db_manager: новое соединение и commit на каждый вызов."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def init(self, schema_from: str):
+        # Схема - из базы db_manager, журнал - по умолчанию (DELETE)
+        source = sqlite3.connect(schema_from)
+        statements = [row[0] for row in source.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND sql IS NOT NULL "
+                                                       "AND name NOT LIKE 'sqlite_%'")]
+        source.close()
+        conn = self._connect()
+        for sql in statements:
+            conn.execute(sql)
+        conn.commit()
+        conn.close()
+
+    def get_or_create_user_profile(self, user_id: int, referred_by: int = None):
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM user_profiles WHERE user_id = ?", (user_id,))
+        profile = cursor.fetchone()
+        if not profile:
+            cursor.execute("INSERT INTO user_profiles (user_id) VALUES (?)", (user_id,))
+            conn.commit()
+            cursor.execute("SELECT * FROM user_profiles WHERE user_id = ?", (user_id,))
+            profile = cursor.fetchone()
+        conn.close()
+        return dict(profile)
+
+    def update_profile_stats(self, user_id: int, fields_to_update: dict):
+        conn = self._connect()
+        set_clause = ", ".join([f"{key} = ?" for key in fields_to_update.keys()])
+        conn.execute(f"UPDATE user_profiles SET {set_clause} WHERE user_id = ?", (*fields_to_update.values(), user_id))
+        conn.commit()
+        conn.close()
+
+    def add_points(self, user_id: int, points_to_add: int):
+        conn = self._connect()
+        conn.execute("UPDATE user_profiles SET total_points = total_points + ?, quarterly_points = quarterly_points + ? "
+                     "WHERE user_id = ?", (points_to_add, points_to_add, user_id))
+        conn.commit()
+        conn.close()
+
+    def get_user_achievements(self, user_id: int):
+        conn = self._connect()
+        achievements = [row[0] for row in conn.execute("SELECT achievement_id FROM user_achievements WHERE user_id = ?",
+                                                       (user_id,))]
+        conn.close()
+        return achievements
+
+    def grant_achievement(self, user_id: int, achievement_id: str):
+        conn = self._connect()
+        conn.execute("INSERT OR IGNORE INTO user_achievements (user_id, achievement_id) VALUES (?, ?)", (user_id, achievement_id))
+        conn.commit()
+        conn.close()
+
+
+def recycle_press(db, user_id: int) -> int:
+    """Запросы одного нажатия "я сдал вторсырье"; возвращает число вызовов."""
+    profile = db.get_or_create_user_profile(user_id)
+    db.update_profile_stats(user_id, {'recycle_report_count': profile['recycle_report_count'] + 1,
+                                      'last_recycle_report_date': date.today().isoformat(),
+                                      'recycle_streak_count': profile['recycle_streak_count'] + 1})
+    db.add_points(user_id, 15)
+    profile = db.get_or_create_user_profile(user_id)
+    db.get_user_achievements(user_id)
+    db.grant_achievement(user_id, 'first_recycle')
+    db.get_or_create_user_profile(user_id)
+    return 7
+
+
+def run(db, presses: int, threads: int, seed: int) -> float:
+    """Операций в секунду: presses нажатий, поровну разделенных между threads потоками."""
+    ops = [0] * threads
+    errors = []
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        try:
+            for _ in range(presses // threads):
+                ops[index] += recycle_press(db, rng.randint(1, USERS))
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        print(f"  ошибок: {len(errors)} (первая: {errors[0]})")
+    return sum(ops) / elapsed
+
+
+def main():
+    presses = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    work_dir = tempfile.mkdtemp(prefix='eco_bench_db_')
+    fakes.install_config(DATA_DIR, work_dir)
+    import db_manager
+    db_manager.init_db()
+    legacy = LegacyDb(os.path.join(work_dir, 'legacy.db'))
+    legacy.init(db_manager.DB_PATH)
+
+    print(f"Нажатий: {presses}, по 7 вызовов db_manager, пользователей: {USERS}")
+    for label, count in (('1 поток', 1), (f'{threads} потока', threads)):
+        before = run(legacy, presses, count, seed=1)
+        after = run(db_manager, presses, count, seed=1)
+        print(f"{label:>10}: прежний доступ {before:8.0f} оп/с, db_connection {after:8.0f} оп/с (x{after / before:.1f})")
+    db_manager._connections.close_all()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
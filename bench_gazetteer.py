@@ -0,0 +1,151 @@
+# bench_gazetteer.py
+# Замер поиска города в сообщении на синтетическом справочнике (1 000 и 10 000 вариантов написания):
+# прежний способ - process.extractOne по всему сообщению против всех вариантов, и gazetteer с триграммным индексом.
+# Результат gazetteer сверяется с полным перебором тех же окон слов (fuzz.ratio, порог 80).
+# Перед замером - проверка на настоящих данных (data/): сообщения без города не должны находить город
+# (прежние ошибки: "кг" засчитывалось как сокращение "кгн" -> Курган).
+# Запуск: python bench_gazetteer.py [число_вариантов ...]
+
+import os
+import random
+import sys
+import time
+
+from thefuzz import fuzz, process
+
+import vocabulary
+from data_store import load_points
+from gazetteer import MAX_EXACT_ONLY_LENGTH, SCORE_CUTOFF, UNIT_WORDS, Gazetteer
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+SYLLABLES = ['ка', 'ме', 'нск', 'ур', 'аль', 'сур', 'гут', 'ки', 'ров', 'тю', 'мень', 'то', 'боль', 'ск', 'ир',
+             'бит', 'шад', 'ринск', 'ла', 'да', 'нов', 'го', 'род', 'пер', 'ми', 'чел', 'яб', 'ин', 'за', 'ре', 'чный']
+MESSAGES = ['батарейки в {}', 'куда сдать пластик {}', 'где принимают макулатуру в городе {}', 'шины {}', '{} стекло']
+NO_CITY_MESSAGES = ['куда сдать батарейки', 'где принимают крышки', 'пункты приема одежды рядом', 'что такое экология']
+# Сообщение -> город (None - города нет) на справочнике из data/
+REGRESSIONS = [
+    ('куда сдать 5 кг макулатуры', None),
+    ('сколько кг пластика выбрасывает человек', None),
+    ('сдать 10 л масла', None),
+    ('батарейки кгн', 'курган'),
+    ('куда сдать пластик в кургане', 'курган'),
+    ('макулатура курган', 'курган'),
+]
+
+
+def generate_aliases(count: int, seed: int = 1):
+    """Города с вариантами написания: название, иногда из двух слов, плюс сокращение."""
+    rng = random.Random(seed)
+    aliases, seen = {}, set()
+    while sum(len(v) for v in aliases.values()) < count:
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if rng.random() < 0.15:
+            name = f"{rng.choice(['нижний', 'новый', 'верхний', 'старый'])} {name}"
+        if name in seen:
+            continue
+        seen.add(name)
+        variants = [name]
+        short = ''.join(ch for ch in name if ch not in 'аеиоуыэюя ')[:3]
+        if len(short) == 3 and short not in seen:
+            seen.add(short)
+            variants.append(short)
+        aliases[name] = variants
+    return aliases
+
+
+def typo(word: str, rng: random.Random) -> str:
+    """Одна опечатка: пропуск, замена или перестановка букв."""
+    if len(word) < 5:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.randrange(3)
+    if kind == 0:
+        return word[:i] + word[i + 1:]
+    if kind == 1:
+        return word[:i] + rng.choice('абвгдеклмнопрст') + word[i + 1:]
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def generate_messages(aliases, count: int, seed: int = 2):
+    rng = random.Random(seed)
+    cities = list(aliases)
+    messages = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            messages.append(rng.choice(NO_CITY_MESSAGES))
+            continue
+        city = rng.choice(cities)
+        messages.append(rng.choice(MESSAGES).format(typo(city, rng) if rng.random() < 0.7 else city))
+    return messages
+
+
+def brute_force(gazetteer: Gazetteer, words):
+    """Те же окна слов, что и в Gazetteer.match, но сравнение со всеми вариантами подряд."""
+    best = None
+    for size in range(1, min(gazetteer.max_words, len(words)) + 1):
+        for start in range(len(words) - size + 1):
+            window = ' '.join(words[start:start + size])
+            if len(window) <= MAX_EXACT_ONLY_LENGTH or UNIT_WORDS.intersection(words[start:start + size]):
+                continue
+            for alias_id, alias in enumerate(gazetteer.aliases):
+                if len(alias) <= MAX_EXACT_ONLY_LENGTH:
+                    continue
+                score = fuzz.ratio(window, alias)
+                if score >= SCORE_CUTOFF and (best is None or score > best[1]):
+                    best = (gazetteer.alias_city[alias_id], score)
+    return best
+
+
+def check_regressions():
+    points = load_points(os.path.join(DATA_DIR, 'recycling_points.csv'))
+    gazetteer = Gazetteer.from_sources({point.city for point in points}, os.path.join(DATA_DIR, 'city_aliases.json'))
+    for message, expected in REGRESSIONS:
+        scan = vocabulary.scan(message)
+        result = gazetteer.match(scan.words, scan.stems)
+        assert (result.city if result else None) == expected, f"'{message}': {result}, ожидался {expected}"
+    print(f"Проверка на data/: {len(REGRESSIONS)} сообщений разобраны верно")
+
+
+def run(count: int):
+    aliases = generate_aliases(count)
+    started = time.perf_counter()
+    gazetteer = Gazetteer(aliases)
+    print(f"\n{len(gazetteer)} вариантов ({len(aliases)} городов), построение {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    messages = generate_messages(aliases, 300)
+    scans = [vocabulary.scan(message) for message in messages]
+    all_aliases = gazetteer.aliases
+
+    started = time.perf_counter()
+    for scan in scans:
+        process.extractOne(' '.join(scan.words), all_aliases, score_cutoff=SCORE_CUTOFF)
+    old_ms = (time.perf_counter() - started) / len(scans) * 1000
+
+    started = time.perf_counter()
+    results = [gazetteer.match(scan.words, scan.stems) for scan in scans]
+    new_ms = (time.perf_counter() - started) / len(scans) * 1000
+    print(f"  extractOne по всем вариантам: {old_ms:8.3f} мс на сообщение")
+    print(f"  gazetteer (триграммы):        {new_ms:8.3f} мс на сообщение ({old_ms / new_ms:.0f}x)")
+
+    # Сверка: нечеткий результат должен совпадать с полным перебором по оценке (город может отличаться при равных оценках)
+    checked = mismatched = 0
+    for scan, result in list(zip(scans, results))[:100]:
+        if result is not None and result.score == 100:
+            continue
+        expected = brute_force(gazetteer, scan.words)
+        checked += 1
+        if (expected[1] if expected else None) != (result.score if result else None):
+            mismatched += 1
+    print(f"  сверка с полным перебором: {checked - mismatched} из {checked} совпали")
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+    check_regressions()
+    for count in counts:
+        run(count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench_leaderboard.py
+# Таблица лидеров и место пользователя на синтетической базе (по умолчанию 1 000 000 профилей):
+#   - без индекса: ORDER BY quarterly_points сортирует всю таблицу, место - COUNT(*) полным просмотром;
+#   - с индексом (quarterly_points DESC, user_id): первые строки читаются из индекса, место - COUNT(*) по индексу
+#     (время растет с местом: просматриваются все строки индекса выше пользователя);
+#   - место по гистограмме очков (db_manager.get_user_rank): сумма по разным значениям очков выше пользователя;
+#   - кэш первых строк (leaderboard.py): повторное нажатие "лидеры 🏆" без запроса к базе.
+# Место замеряется для пользователей из начала, середины и конца таблицы; в конце - цена начисления
+# очков (UPDATE с триггерами гистограммы).
+# Запуск: python bench_leaderboard.py [число_профилей]
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import fakes
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_user_profiles_quarterly ON user_profiles (quarterly_points DESC, user_id)'
+TOP_SQL = "SELECT user_id, quarterly_points FROM user_profiles ORDER BY quarterly_points DESC, user_id LIMIT 5"
+
+
+def timed(func, repeat: int) -> float:
+    """Среднее время вызова, мс."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def fill(db, count: int, seed: int = 1):
+    """Очки за квартал: у большинства немного, у единиц - тысячи (логнормальное распределение)."""
+    rng = random.Random(seed)
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO user_profiles (user_id, quarterly_points, total_points) VALUES (?, ?, ?)",
+                         ((user_id, points, points) for user_id, points in
+                          ((i, int(rng.lognormvariate(3, 1.2))) for i in range(1, count + 1))))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    work_dir = tempfile.mkdtemp(prefix='eco_bench_leaderboard_')
+    fakes.install_config(DATA_DIR, work_dir)
+    import db_manager as db
+    db.init_db()
+    conn = db.get_connection()
+    conn.execute('DROP INDEX idx_user_profiles_quarterly')
+
+    started = time.perf_counter()
+    fill(db, count)
+    print(f"Профилей: {count} (заполнение {time.perf_counter() - started:.1f} с)")
+    order = [row[0] for row in conn.execute("SELECT user_id FROM user_profiles ORDER BY quarterly_points DESC, user_id")]
+    probes = {'1-е место': order[0], 'середина': order[len(order) // 2], 'последнее': order[-1]}
+
+    def count_rank(user_id):
+        points = conn.execute("SELECT quarterly_points FROM user_profiles WHERE user_id = ?", (user_id,)).fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM user_profiles WHERE quarterly_points > ?", (points,)).fetchone()[0] + 1
+
+    def report(label, rank, repeat):
+        top = timed(lambda: conn.execute(TOP_SQL).fetchall(), repeat)
+        ranks = ', '.join(f"{name} {timed(lambda user_id=user_id: rank(user_id), repeat):.3f}" for name, user_id in probes.items())
+        print(f"  {label}: лидеры {top:.3f} мс; место, мс: {ranks}")
+
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {TOP_SQL}").fetchall()
+    report(f"без индекса ({plan[-1][-1]})", count_rank, 3)
+
+    started = time.perf_counter()
+    conn.execute(INDEX_SQL)
+    conn.execute('ANALYZE')
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {TOP_SQL}").fetchall()
+    print(f"  построение индекса: {time.perf_counter() - started:.1f} с")
+    report(f"с индексом ({plan[-1][-1]})", count_rank, 20)
+    histogram_rows = conn.execute("SELECT COUNT(*) FROM quarterly_points_histogram").fetchone()[0]
+    report(f"гистограмма ({histogram_rows} разных значений очков)", db.get_user_rank, 200)
+    assert all(db.get_user_rank(user_id)[0] == count_rank(user_id) for user_id in probes.values())
+
+    rng = random.Random(2)
+    update = timed(lambda: db.add_points(rng.randint(1, count), 5), 2000)
+    print(f"  начисление очков (UPDATE + триггеры + сброс кэша): {update * 1000:.0f} мкс")
+
+    cached = timed(lambda: db.get_leaderboard(5), 10000)
+    print(f"  лидеры из кэша: {cached * 1000:.1f} мкс; {db.leaderboard_stats()}")
+    for name, user_id in probes.items():
+        print(f"  {name}: user_id={user_id}, {db.get_user_rank(user_id)}")
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# bench_semantic_cache.py
+# Семантический кэш ответов GigaChat на временной базе:
+#   - сверка: перефразированный вопрос получает сохраненный ответ, а соседний вопрос (другой материал,
+#     "можно" вместо "нельзя") - нет; при ошибке скрипт завершается с AssertionError;
+#   - замер поиска и сохранения: соединение потока (semantic_cache.py) против connect на каждый вызов.
+# Запуск: python bench_semantic_cache.py [число_записей]
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from semantic_cache import SemanticCache
+
+# (сохраненный вопрос, вопрос пользователя)
+SAME = [
+    ("почему опасны батарейки", "Почему опасны батарейки?"),
+    ("куда сдать батарейки", "где сдать батарейки"),
+    ("сколько лет разлагается пластиковая бутылка", "сколько лет разлагаются пластиковые бутылки?"),
+]
+DIFFERENT = [
+    ("почему опасны батарейки", "почему опасны лампочки"),
+    ("можно ли выбрасывать батарейки", "нельзя выбрасывать батарейки"),
+    ("можно ли выбрасывать батарейки", "не выбрасывать батарейки"),
+    ("сколько разлагается стекло", "сколько разлагается пластик"),
+    ("почему нельзя выбрасывать старые батарейки в мусор", "почему выбрасывать старые батарейки в мусор"),
+    ("сколько лет разлагается пластиковая бутылка в земле", "сколько лет разлагается стеклянная бутылка в земле"),
+]
+MATERIALS = ['батарейки', 'пластик', 'стекло', 'макулатуру', 'одежду', 'шины', 'лампочки', 'крышки', 'металл', 'технику']
+TEMPLATES = ['куда сдать {} в {}', 'как сортировать {} в районе {}', 'почему важно перерабатывать {} номер {}']
+
+
+def check(work_dir: str):
+    for pairs, expected in ((SAME, True), (DIFFERENT, False)):
+        for stored, asked in pairs:
+            cache = SemanticCache(os.path.join(work_dir, f'check_{time.perf_counter_ns()}.db'))
+            cache.store(stored, 'ответ')
+            hit = cache.lookup(asked) is not None
+            assert hit == expected, f"'{asked}' после '{stored}': {'попадание' if hit else 'промах'}"
+    print(f"Сверка: {len(SAME)} перефразировок находят ответ, {len(DIFFERENT)} других вопросов - нет")
+
+
+def run(work_dir: str, count: int):
+    questions = [TEMPLATES[i % len(TEMPLATES)].format(MATERIALS[i % len(MATERIALS)], i) for i in range(count)]
+    cache = SemanticCache(os.path.join(work_dir, 'bench.db'))
+    started = time.perf_counter()
+    for question in questions:
+        cache.store(question, 'ответ')
+    store_ms = (time.perf_counter() - started) / count * 1000
+    started = time.perf_counter()
+    for question in questions:
+        cache.lookup(question)
+    lookup_ms = (time.perf_counter() - started) / count * 1000
+
+    # Прежний способ: новое соединение на каждый вызов (тот же запрос кандидатов)
+    path = os.path.join(work_dir, 'bench.db')
+    started = time.perf_counter()
+    for question in questions:
+        conn = sqlite3.connect(path, timeout=10)
+        conn.execute('SELECT COUNT(*) FROM semantic_answers WHERE question = ?', (question,)).fetchone()
+        conn.close()
+    connect_ms = (time.perf_counter() - started) / count * 1000
+    started = time.perf_counter()
+    conn = sqlite3.connect(path, timeout=10)
+    for question in questions:
+        conn.execute('SELECT COUNT(*) FROM semantic_answers WHERE question = ?', (question,)).fetchone()
+    conn.close()
+    reuse_ms = (time.perf_counter() - started) / count * 1000
+
+    print(f"Записей: {count}; {cache.stats()}")
+    print(f"  сохранение: {store_ms:.3f} мс, поиск: {lookup_ms:.3f} мс")
+    print(f"  запрос с connect на каждый вызов: {connect_ms:.3f} мс, в соединении потока: {reuse_ms:.3f} мс")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    work_dir = tempfile.mkdtemp(prefix='eco_bench_semantic_')
+    try:
+        check(work_dir)
+        run(work_dir, count)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# bench_spatial_index.py
+# Замер поиска ближайших пунктов (k-d дерево) на синтетических данных: много городов, десятки тысяч пунктов.
+# Результат дерева сверяется с полным перебором.
+# Запуск: python bench_spatial_index.py [число_пунктов] [k]
+
+import random
+import sys
+import time
+
+from spatial_index import KDTree, haversine_km
+
+# Центры нескольких городов Урала и Сибири: пункты разбрасываются вокруг них
+CITY_CENTERS = [(55.44, 65.34), (56.84, 60.61), (55.16, 61.40), (57.15, 65.53), (54.99, 73.37),
+                (58.01, 56.25), (54.73, 55.97), (61.25, 73.40), (56.48, 84.95), (55.03, 82.92)]
+
+
+def generate_points(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    for n in range(count):
+        lat, lon = rng.choice(CITY_CENTERS)
+        yield lat + rng.gauss(0, 0.08), lon + rng.gauss(0, 0.12), n
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    points = list(generate_points(count))
+
+    started = time.perf_counter()
+    tree = KDTree(points)
+    print(f"Построение дерева: {count} пунктов, {len(tree.axis)} узлов, {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    rng = random.Random(2)
+    queries = [(lat + rng.gauss(0, 0.05), lon + rng.gauss(0, 0.05)) for lat, lon in (rng.choice(CITY_CENTERS) for _ in range(1000))]
+    started = time.perf_counter()
+    results = [tree.nearest(lat, lon, k) for lat, lon in queries]
+    per_query = (time.perf_counter() - started) / len(queries) * 1000
+    print(f"Ближайшие {k}: {per_query:.3f} мс на запрос ({len(queries)} запросов)")
+
+    for (lat, lon), result in list(zip(queries, results))[:50]:
+        expected = sorted(haversine_km(lat, lon, p_lat, p_lon) for p_lat, p_lon, _ in points)[:k]
+        assert [round(d, 9) for d, _ in result] == [round(d, 9) for d in expected], (lat, lon)
+    print("Сверка с полным перебором: OK")
+
+    started = time.perf_counter()
+    far = tree.nearest(40.0, 30.0, k)
+    print(f"Запрос вдали от всех пунктов: {(time.perf_counter() - started) * 1000:.3f} мс, ближайший в {far[0][0]:.0f} км")
+
+
+if __name__ == "__main__":
+    main()
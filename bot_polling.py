@@ -4,21 +4,48 @@
 
 import telebot
 from telebot import types 
-import pandas as pd
 import json
 import re
-from typing import List, Tuple
+from typing import List, Set, Tuple
 from gigachat.client import GigaChatSyncClient
 from gigachat.models import Chat, Messages, MessagesRole
 import random
 from datetime import datetime, date, timedelta
 import logging
-from collections import deque
-from thefuzz import process
+from collections import Counter
+from typing import NamedTuple
+import functools
 import os
+import signal
+import sys
+import time
+from contextlib import nullcontext
+from zoneinfo import ZoneInfo
 
 import db_manager as db
 import challenges_data as challenges
+import data_store
+from data_store import KnowledgeEntry, RecyclingPoint
+from conversation import Conversation
+from data_snapshot import DataSnapshot, SnapshotManager
+import dispatcher
+from dispatcher import Dispatcher, Lane
+import gamification
+from gamification import ACHIEVEMENTS, LEVELS, POINTS_FOR_INVITE, Award
+from gazetteer import Gazetteer
+from intent_model import INTENTS, IntentLog, IntentModel
+from knowledge_index import KnowledgeIndex
+from knowledge_ranker import KnowledgeRanker
+from llm_client import CircuitBreaker, LLMClient
+from metrics import LatencySamples
+from points_index import PointsIndex, load_geocode_cache
+from response_cache import ResponseCache
+from semantic_cache import SemanticCache
+from stream_reply import StreamingReply
+from text_normalizer import STOP_WORDS
+from user_names import UserNames
+import vocabulary
+import work_hours
 from apscheduler.schedulers.background import BackgroundScheduler
 
 
@@ -34,31 +61,18 @@ logging.basicConfig(
 
 # --- ГЛОБАЛЬНЫЕ НАСТРОЙКИ ---
 user_context = {}
-MAX_HISTORY_LENGTH = 5
+MAX_HISTORY_LENGTH = 6  # реплик целиком; более старые - в сводке (conversation.py)
 
 # ### НАСТРОЙКИ ГЕЙМИФИКАЦИИ ###
 POINTS_FOR_RECYCLE = 10; POINTS_FOR_STREAK = 50; POINTS_FOR_CHALLENGE = 75;
-POINTS_FOR_QUIZ = 5; POINTS_FOR_TIP = 1; POINTS_FOR_INVITE = 30; POINTS_FOR_ACHIEVEMENT = 20;
-
-LEVELS = {
-    1: {"name": "Новичок", "min_points": 0}, 2: {"name": "Осознанный житель", "min_points": 100},
-    3: {"name": "Эко-активист", "min_points": 250}, 4: {"name": "Страж Природы", "min_points": 500},
-    5: {"name": "Эко-Воин", "min_points": 1000},
-}
-ACHIEVEMENTS = {
-    'first_steps': 'Первые шаги', 'recycler_adept': 'Сортировщик-любитель',
-    'paper_master': 'Магистр макулатуры', 'plastic_lord': 'Повелитель пластика',
-    'eco_erudite': 'Эко-Эрудит', 'marathoner': 'Марафонец',
-    'mentor': 'Наставник', 'perfectionist': 'Перфекционист',
-}
+POINTS_FOR_QUIZ = 5; POINTS_FOR_TIP = 1;
+
 BTN_RECYCLED = 'я сдал вторсырье! ✅'; BTN_FIND_POINT = 'найти пункт ♻️'; BTN_PROFILE = 'мой профиль 👤';
 BTN_QUIZ = 'эко-викторина 🧠'; BTN_CHALLENGE = 'эко-челлендж 💪'; BTN_LEADERBOARD = 'лидеры 🏆';
 BTN_TIP = 'совет дня 💡'; BTN_INVITE = 'пригласить друга 🤝'; BTN_QUESTION = 'задать вопрос 🧠';
+BTN_NEAREST = 'пункты рядом 📍';
 
 # ... (остальные глобальные переменные без изменений) ...
-STOP_WORDS = set(['и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она', 'так', 'его', 'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'только', 'ее', 'мне', 'было', 'вот', 'от', 'меня', 'еще', 'нет', 'о', 'из', 'ему', 'теперь', 'когда', 'даже', 'ну', 'вдруг', 'ли', 'если', 'уже', 'или', 'ни', 'быть', 'был', 'него', 'до', 'вас', 'нибудь', 'опять', 'уж', 'вам', 'ведь', 'там', 'потом', 'себя', 'ничего', 'ей', 'может', 'они', 'тут', 'где', 'есть', 'надо', 'ней', 'для', 'мы', 'тебя', 'их', 'чем', 'была', 'сам', 'чтоб', 'без', 'будто', 'чего', 'раз', 'тоже', 'себе', 'под', 'будет', 'ж', 'тогда', 'кто', 'этот', 'того', 'потому', 'этого', 'какой', 'совсем', 'ним', 'здесь', 'этом', 'один', 'почти', 'мой', 'тем', 'чтобы', 'нее', 'сейчас', 'были', 'куда', 'зачем', 'всех', 'никогда', 'можно', 'при', 'наконец', 'два', 'об', 'другой', 'хоть', 'после', 'над', 'больше', 'тот', 'через', 'эти', 'нас', 'про', 'всего', 'них', 'какая', 'много', 'разве', 'три', 'эту', 'моя', 'впрочем', 'хорошо', 'свою', 'этой', 'перед', 'иногда', 'лучше', 'чуть', 'том', 'нельзя', 'такой', 'им', 'более', 'всегда', 'конечно', 'всю', 'между', 'такое', 'это'])
-SEARCH_TRIGGERS = ['куда сдать', 'где принимают', 'пункты приема', 'пункты приёма', 'адреса', 'адрес', 'найди', 'найти', 'где', 'куда']
-JUNK_WORDS = ['а', 'в', 'и', 'с', 'к', 'по']
 VAGUE_REPLIES = {'да', 'нет', 'ок', 'хорошо', 'привет', 'спасибо', 'понятно', 'экология', 'пункты сдачи'}
 
 # --- КОНФИГУРАЦИЯ ---
@@ -70,41 +84,163 @@ except ImportError:
     logging.critical("Ошибка: не удалось найти файл config.py.")
     exit()
 
+# Необязательные настройки: в старых config.py их может не быть
+import config
+KB_RANK_ANSWERS = getattr(config, 'KB_RANK_ANSWERS', False)
+RESPONSE_CACHE_MAX_BYTES = getattr(config, 'RESPONSE_CACHE_MAX_BYTES', 4 * 1024 * 1024)
+RESPONSE_CACHE_TTL = getattr(config, 'RESPONSE_CACHE_TTL', 6 * 3600)
+SEMANTIC_CACHE_PATH = getattr(config, 'SEMANTIC_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(config.DB_PATH)), 'semantic_cache.db'))
+SEMANTIC_CACHE_THRESHOLD = getattr(config, 'SEMANTIC_CACHE_THRESHOLD', 0.8)
+GEOCODE_CACHE_PATH = getattr(config, 'GEOCODE_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(RECYCLING_POINTS_PATH)), 'geocode_cache.json'))
+CITY_ALIASES_PATH = getattr(config, 'CITY_ALIASES_PATH', os.path.join(os.path.dirname(os.path.abspath(RECYCLING_POINTS_PATH)), 'city_aliases.json'))
+USER_LOCATION_TTL = getattr(config, 'USER_LOCATION_TTL', 3600)
+LOCAL_TIMEZONE = ZoneInfo(getattr(config, 'TIMEZONE', 'Asia/Yekaterinburg'))
+DATA_RELOAD_INTERVAL = getattr(config, 'DATA_RELOAD_INTERVAL', 10)
+INTENT_MODEL_PATH = getattr(config, 'INTENT_MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(RECYCLING_POINTS_PATH)), 'intent_model.json'))
+INTENT_CONFIDENCE = getattr(config, 'INTENT_CONFIDENCE', 0.8)
+FAST_LANE_WORKERS = getattr(config, 'FAST_LANE_WORKERS', 4)
+FAST_LANE_MAX_QUEUE = getattr(config, 'FAST_LANE_MAX_QUEUE', 200)
+LLM_LANE_WORKERS = getattr(config, 'LLM_LANE_WORKERS', 4)
+LLM_LANE_MAX_QUEUE = getattr(config, 'LLM_LANE_MAX_QUEUE', 20)
+QUIZ_POOL_SIZE = getattr(config, 'QUIZ_POOL_SIZE', 30)
+QUIZ_POOL_REFILL_HOUR = getattr(config, 'QUIZ_POOL_REFILL_HOUR', 3)
+QUIZ_POOL_MAX_FAILURES = getattr(config, 'QUIZ_POOL_MAX_FAILURES', 10)
+LLM_MODE = getattr(config, 'LLM_MODE', 'legacy')
+LLM_TIMEOUT = getattr(config, 'LLM_TIMEOUT', 20)
+LLM_INTENT_TIMEOUT = getattr(config, 'LLM_INTENT_TIMEOUT', 5)
+LLM_HANDLER_BUDGET = getattr(config, 'LLM_HANDLER_BUDGET', 25)
+LLM_MAX_RETRIES = getattr(config, 'LLM_MAX_RETRIES', 2)
+LLM_BREAKER_FAILURES = getattr(config, 'LLM_BREAKER_FAILURES', 5)
+LLM_BREAKER_RESET = getattr(config, 'LLM_BREAKER_RESET', 30)
+GIGACHAT_STREAMING = getattr(config, 'GIGACHAT_STREAMING', False)
+STREAM_EDIT_INTERVAL = getattr(config, 'STREAM_EDIT_INTERVAL', 1.5)
+HISTORY_TOKEN_BUDGET = getattr(config, 'HISTORY_TOKEN_BUDGET', 800)
+USER_NAME_TTL = getattr(config, 'USER_NAME_TTL', 24 * 3600)
+WRITE_BEHIND = getattr(config, 'WRITE_BEHIND', False)
+WRITE_BEHIND_INTERVAL = getattr(config, 'WRITE_BEHIND_INTERVAL', 0.5)
+WRITE_BEHIND_MAX_EVENTS = getattr(config, 'WRITE_BEHIND_MAX_EVENTS', 500)
+INTENT_LOG_PATH = getattr(config, 'INTENT_LOG_PATH', os.path.join(os.path.dirname(os.path.abspath(config.DB_PATH)), 'intent_log.jsonl'))
+INTENT_LOG_MAX_BYTES = getattr(config, 'INTENT_LOG_MAX_BYTES', 5 * 1024 * 1024)
+INTENT_LOG_BACKUPS = getattr(config, 'INTENT_LOG_BACKUPS', 3)
+
 MAX_POINTS_TO_SHOW = 3
+NEAREST_POINTS_LIMIT = 30
+GIGACHAT_UNAVAILABLE = "Извините, модуль GigaChat не был загружен."
+GIGACHAT_ERROR = "Извините, произошла ошибка."
+DEGRADED_NOTE = "GigaChat сейчас не отвечает, поэтому отвечаю из базы знаний."
+DEGRADED_NO_ANSWER = ("Сейчас я не могу ответить на этот вопрос: GigaChat временно недоступен. "
+                      "Попробуйте через пару минут или воспользуйтесь кнопками меню.")
 
 # --- ИНИЦИАЛИЗАЦИЯ ---
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
+# Обработчики выполняются в потоках полос update_dispatcher (см. ЗАПУСК БОТА), а не в пуле TeleBot
+bot = telebot.TeleBot(TELEGRAM_TOKEN, threaded=False)
 bot.current_polls = {}
+def wrap_giga(client) -> LLMClient:
+    return LLMClient(client, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                     breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET),
+                     workers=2 * (LLM_LANE_WORKERS + 1))
+
 try:
-    giga = GigaChatSyncClient(credentials=GIGACHAT_API_KEY, scope='GIGACHAT_API_B2B', verify_ssl_certs=False)
+    # timeout клиента ограничивает и брошенные по сроку вызовы, которые дорабатывают в фоне
+    giga = wrap_giga(GigaChatSyncClient(credentials=GIGACHAT_API_KEY, scope='GIGACHAT_API_B2B', verify_ssl_certs=False,
+                                        timeout=LLM_TIMEOUT))
     logging.info("GigaChat успешно инициализирован.")
 except Exception as e: 
     logging.error(f"Не удалось инициализировать GigaChat: {e}")
     giga = None
 
 db.init_db()
+if WRITE_BEHIND:
+    # Изменения профилей копятся в памяти и пишутся пачками (counter_buffer.py); остаток - при остановке
+    db.enable_write_behind(WRITE_BEHIND_INTERVAL, WRITE_BEHIND_MAX_EVENTS)
+response_cache = ResponseCache(max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl_seconds=RESPONSE_CACHE_TTL)
+semantic_cache = SemanticCache(SEMANTIC_CACHE_PATH, threshold=SEMANTIC_CACHE_THRESHOLD)
+intent_log = IntentLog(INTENT_LOG_PATH, INTENT_LOG_MAX_BYTES, INTENT_LOG_BACKUPS)
+intent_stats = Counter()  # local / llm / agree - сколько намерений определила модель и сколько раз она совпала с GigaChat
+llm_latency = {name: LatencySamples() for name in ('full', 'ttft', 'stream_total', 'router')}
+
+def fetch_user_name(user_id: int):
+    user_info = bot.get_chat(user_id)
+    return user_info.first_name, user_info.username
+
+# Имена для таблицы лидеров и уведомлений: из обновлений, get_chat - только в фоне для устаревших
+user_names = UserNames(fetch_user_name, ttl=USER_NAME_TTL)
+_process_new_updates = bot.process_new_updates
+
+def process_new_updates(updates):
+    # update_dispatcher.install оборачивает эту функцию, поэтому имя сохраняется в потоке полосы, а не polling
+    for update in updates:
+        user_names.remember_update(update)
+    _process_new_updates(updates)
+
+bot.process_new_updates = process_new_updates
+
+def load_points():
+    """Индекс город -> категория -> пункты и справочник городов (города из CSV плюс city_aliases.json)."""
+    points = PointsIndex(data_store.load_points(RECYCLING_POINTS_PATH), load_geocode_cache(GEOCODE_CACHE_PATH))
+    return points, Gazetteer.from_sources(points.cities(), CITY_ALIASES_PATH)
+
+def load_intent_model():
+    """Модель намерений из train_intent_model.py; без нее намерение определяет GigaChat."""
+    if not os.path.exists(INTENT_MODEL_PATH):
+        logging.info("Модель намерений не найдена, намерения определяет GigaChat.")
+        return None
+    return IntentModel.load(INTENT_MODEL_PATH)
 
-def load_data():
-    points, knowledge, facts, tips = pd.DataFrame(), [], [], []
-    try: 
-        column_names = ['name', 'city', 'address', 'accepts', 'work_hours', 'phone_number', 'website']
-        points = pd.read_csv(RECYCLING_POINTS_PATH, header=0, names=column_names)
-        points = points.fillna('') 
-        logging.info("✅ recycling_points.csv загружен.")
-    except Exception as e: logging.error(f"❌ Ошибка загрузки recycling_points.csv: {e}")
-    try:
-        with open(KNOLEDGE_BASE_PATH, 'r', encoding='utf-8') as f: knowledge = json.load(f)
-        logging.info("✅ knowledge_base.json загружен.")
-    except Exception as e: logging.error(f"❌ Ошибка загрузки knowledge_base.json: {e}")
-    try:
-        with open(INTERESTING_FACTS_PATH, 'r', encoding='utf-8') as f: facts = json.load(f)
-        logging.info("✅ interesting_facts.json загружен.")
-    except Exception as e: logging.error(f"❌ Ошибка загрузки interesting_facts.json: {e}")
-    try:
-        with open(ECO_TIPS_PATH, 'r', encoding='utf-8') as f: tips = json.load(f)
-        logging.info("✅ eco_tips.json загружен.")
-    except Exception as e: logging.error(f"❌ Ошибка загрузки eco_tips.json: {e}")
-    return points, knowledge, facts, tips
+def load_knowledge_base():
+    """Читает knowledge_base.json и строит по нему инвертированный индекс и BM25-ранжировщик."""
+    knowledge = data_store.load_knowledge(KNOLEDGE_BASE_PATH)
+    return knowledge, KnowledgeIndex(knowledge, STOP_WORDS), KnowledgeRanker(knowledge, STOP_WORDS, include_answers=KB_RANK_ANSWERS)
+
+def build_snapshot(previous: DataSnapshot | None, changed: Set[str]) -> DataSnapshot:
+    """
+    Собирает снимок данных: части из changed читаются заново, остальные берутся из previous.
+    При первой загрузке сломанный файл дает пустые данные (бот все равно стартует),
+    при перезагрузке ошибка пробрасывается, и SnapshotManager оставляет прежний снимок.
+    """
+    loaders = {
+        # Индексы пунктов и городов строятся один раз по неизменяемым записям
+        'points': ('recycling_points.csv', load_points, (PointsIndex([]), Gazetteer({}))),
+        'knowledge': ('knowledge_base.json', load_knowledge_base, ([], KnowledgeIndex([]), KnowledgeRanker([]))),
+        'facts': ('interesting_facts.json', lambda: data_store.load_texts(INTERESTING_FACTS_PATH), ()),
+        'tips': ('eco_tips.json', lambda: data_store.load_texts(ECO_TIPS_PATH), ()),
+        'intent': ('intent_model.json', load_intent_model, None),
+    }
+    if previous is not None:
+        previous_parts = {'points': (previous.points, previous.gazetteer), 'knowledge': (previous.knowledge, previous.kb_index, previous.kb_ranker),
+                          'facts': previous.facts, 'tips': previous.tips, 'intent': previous.intent_model}
+    parts = {}
+    for name, (file_name, loader, empty) in loaders.items():
+        if previous is not None and name not in changed:
+            parts[name] = previous_parts[name]
+            continue
+        try:
+            parts[name] = loader()
+            logging.info(f"✅ {file_name} загружен.")
+        except Exception as e:
+            if previous is not None: raise
+            logging.error(f"❌ Ошибка загрузки {file_name}: {e}")
+            parts[name] = empty
+    points, gazetteer = parts['points']
+    knowledge, kb_index, kb_ranker = parts['knowledge']
+    return DataSnapshot(points, gazetteer, knowledge, kb_index, kb_ranker, parts['facts'], parts['tips'], parts['intent'])
+
+def on_snapshot_swap(snapshot: DataSnapshot, changed: Set[str]):
+    # Закэшированные ответы базы знаний могли устареть
+    if 'knowledge' in changed:
+        response_cache.clear()
+
+snapshots = SnapshotManager({
+    'points': [RECYCLING_POINTS_PATH, GEOCODE_CACHE_PATH, CITY_ALIASES_PATH],
+    'knowledge': [KNOLEDGE_BASE_PATH],
+    'facts': [INTERESTING_FACTS_PATH],
+    'tips': [ECO_TIPS_PATH],
+    'intent': [INTENT_MODEL_PATH],
+}, build_snapshot, on_swap=on_snapshot_swap)
+
+def reload_knowledge_base():
+    """Перечитывает базу знаний и пересобирает индексы (например, после convert_kb.py)."""
+    snapshots.reload({'knowledge'}, wait=True)
 
 
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
@@ -142,197 +278,360 @@ def create_main_keyboard():
     markup.add(types.KeyboardButton(BTN_PROFILE), types.KeyboardButton(BTN_QUIZ))
     markup.add(types.KeyboardButton(BTN_CHALLENGE), types.KeyboardButton(BTN_LEADERBOARD))
     markup.add(types.KeyboardButton(BTN_TIP), types.KeyboardButton(BTN_INVITE))
-    markup.add(types.KeyboardButton(BTN_QUESTION))
+    markup.add(types.KeyboardButton(BTN_QUESTION), types.KeyboardButton(BTN_NEAREST, request_location=True))
     return markup
     
 # --- ФУНКЦИИ ГЕЙМИФИКАЦИИ ---
-def add_points_and_notify(user_id: int, points: int, reason_message: str, check_referral=False):
-    profile_before = db.get_or_create_user_profile(user_id)
-    db.add_points(user_id, points)
-    
-    notification_text = f"{escape_markdown(reason_message)}\n\nВы получили *{points} Эко-Очков*\\!"
+def send_notification(user_id: int, text: str):
     try:
-        bot.send_message(user_id, notification_text, parse_mode='MarkdownV2')
+        bot.send_message(user_id, text, parse_mode='MarkdownV2')
     except telebot.apihelper.ApiTelegramException as e:
         if "can't parse entities" in str(e):
             logging.warning(f"MarkdownV2 parsing failed for notification to {user_id}. Sending as plain text.")
-            bot.send_message(user_id, notification_text.replace("*", "").replace("\\", ""))
+            bot.send_message(user_id, text.replace("*", "").replace("\\", ""))
         else:
-            logging.error(f"Не удалось отправить уведомление о начислении очков пользователю {user_id}: {e}")
-
-    profile_after = db.get_or_create_user_profile(user_id)
-    check_for_level_up(user_id, profile_after['total_points'], profile_after['level'])
-    check_for_achievements(user_id)
-
-    if check_referral:
-        check_referral_bonus(user_id, profile_before, profile_after)
-
-def check_referral_bonus(user_id, profile_before, profile_after):
-    referrer_id = profile_after.get('referred_by')
-    bonus_was_given = profile_after.get('referrer_bonus_given', 0) == 1
-
-    if referrer_id and not bonus_was_given and profile_before['total_points'] < 50 and profile_after['total_points'] >= 50:
-        logging.info(f"User {user_id} crossed 50 points. Awarding bonus to referrer {referrer_id}.")
-        user_name = "Ваш друг"
-        try:
-            user_info = bot.get_chat(user_id)
-            user_name = user_info.first_name or user_info.username
-        except Exception as e:
-            logging.error(f"Could not get user info for {user_id}: {e}")
-        
-        add_points_and_notify(referrer_id, POINTS_FOR_INVITE, f"Ваш друг {user_name} набрал первые 50 очков!", check_referral=False)
-        
-        referrer_profile = db.get_or_create_user_profile(referrer_id)
-        new_referrals_count = referrer_profile.get('referrals_count', 0) + 1
-        db.update_profile_stats(referrer_id, {'referrals_count': new_referrals_count})
-        db.update_profile_stats(user_id, {'referrer_bonus_given': 1})
-
-def check_for_level_up(user_id, user_points, user_level):
-    new_level_num = user_level
-    for level_num, level_info in sorted(LEVELS.items(), reverse=True):
-        if user_points >= level_info["min_points"]:
-            new_level_num = level_num
-            break
-    
-    if new_level_num > user_level:
-        db.update_profile_stats(user_id, {'level': new_level_num})
-        level_name = LEVELS[new_level_num]["name"]
-        bot.send_message(user_id, f"🎉 *НОВЫЙ УРОВЕНЬ* 🎉\n\nВы стали *{escape_markdown(level_name)}*\\! Так держать\\!", parse_mode='MarkdownV2')
-
-def check_for_achievements(user_id):
-    profile = db.get_or_create_user_profile(user_id)
-    user_achievements = db.get_user_achievements(user_id)
-    def grant_if_new(ach_id):
-        if ach_id not in user_achievements:
-            db.grant_achievement(user_id, ach_id)
-            add_points_and_notify(user_id, POINTS_FOR_ACHIEVEMENT, f"Новое достижение: {ACHIEVEMENTS[ach_id]}!", check_referral=False)
-    if profile['total_points'] >= 10: grant_if_new('first_steps')
-    if profile['recycle_report_count'] >= 10: grant_if_new('recycler_adept')
-    if profile['quiz_correct_streak'] >= 10: grant_if_new('eco_erudite')
-    if profile['challenges_completed_count'] >= 3: grant_if_new('marathoner')
-    if profile['referrals_count'] >= 1: grant_if_new('mentor')
-    if profile['recycle_streak_count'] >= 7: grant_if_new('perfectionist')
-    
-def extract_entities(text: str) -> Tuple[str | None, str | None, str | None]:
-    clean_text = re.sub(r'[^\w\s]', '', text).lower()
+            logging.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+
+def send_notifications(result: gamification.EventResult):
+    """Уведомления события - после того, как его транзакция зафиксирована."""
+    for note in result.notifications:
+        if note.kind == gamification.LEVEL_UP:
+            level_name = LEVELS[note.level]["name"]
+            text = f"🎉 *НОВЫЙ УРОВЕНЬ* 🎉\n\nВы стали *{escape_markdown(level_name)}*\\! Так держать\\!"
+        else:
+            reason = note.reason
+            if note.kind == gamification.REFERRAL:
+                friend_name = user_names.name(note.friend_id)
+                reason = f"Ваш друг {friend_name} набрал первые {gamification.REFERRAL_THRESHOLD} очков!" if friend_name \
+                    else f"Ваш друг набрал первые {gamification.REFERRAL_THRESHOLD} очков!"
+            text = f"{escape_markdown(reason)}\n\nВы получили *{note.points} Эко\\-Очков*\\!"
+        send_notification(note.user_id, text)
+
+class ParsedMessage(NamedTuple):
+    material: str | None
+    city: str | None
+    district: str | None
+    category: str | None   # категория сырья из vocabulary.MATERIAL_SYNONYMS
+    is_help: bool
+    open_now: bool         # просили только работающие сейчас пункты
+
+def parse_message(text: str, gazetteer: Gazetteer) -> ParsedMessage:
+    """
+    Один проход общего словаря (vocabulary) по сообщению: материал и его категория, триггер помощи;
+    город - по справочнику городов (названия с опечатками ищутся нечетко, с порогом 80% схожести).
+    """
+    scan = vocabulary.scan(text)
+    keep = [True] * len(scan.words)
     city, material, district = None, None, None
-    
-    # Обновленная логика поиска города с fuzzy matching
-    city_map = {'курган': ['курган', 'кгн']}
-    all_city_aliases = [alias for sublist in city_map.values() for alias in sublist]
-    
-    # Находим наиболее похожее название города в тексте
-    best_match = process.extractOne(clean_text, all_city_aliases, score_cutoff=80) # Порог 80% схожести
-    
-    if best_match:
-        matched_alias = best_match[0]
-        # Находим полное имя города по найденному алиасу
-        for full_city_name, aliases in city_map.items():
-            if matched_alias in aliases:
-                city = full_city_name
-                # Удаляем все варианты названия города из текста, чтобы не мешали поиску материала
-                for alias_to_remove in aliases:
-                    clean_text = clean_text.replace(alias_to_remove, '')
-                break
-
-    temp_material = clean_text
-    for trigger in SEARCH_TRIGGERS: temp_material = temp_material.replace(trigger, '')
-    words = temp_material.strip().split()
-    while words and words[0] in JUNK_WORDS: words.pop(0)
-    while words and words[-1] in JUNK_WORDS: words.pop(-1)
+
+    city_match = gazetteer.match(scan.words, scan.stems)
+    if city_match:
+        city = city_match.city
+
+    # Удаляем название города и поисковые триггеры, чтобы не мешали поиску материала
+    open_now_matches = scan.of_kind(vocabulary.OPEN_NOW)
+    for match in ([city_match] if city_match else []) + scan.of_kind(vocabulary.SEARCH_TRIGGER) + open_now_matches:
+        for i in range(match.start, match.end): keep[i] = False
+    words = [word for word, kept in zip(scan.words, keep) if kept]
+    while words and words[0] in vocabulary.JUNK_WORDS: words.pop(0)
+    while words and words[-1] in vocabulary.JUNK_WORDS: words.pop(-1)
     material = ' '.join(words)
     
     # Добавим проверку, чтобы не возвращать пустой материал, если был найден только город
     if not material.strip():
         material = None
         
-    return material, city, district
+    return ParsedMessage(material, city, district, scan.material_category(keep) if material else None,
+                         scan.is_help_request(), bool(open_now_matches))
 
-def find_recycling_points(material: str, city: str) -> Tuple[List[dict], List[str]]:
-    if points_df.empty or not material or not city: return [], []
+def extract_entities(text: str) -> Tuple[str | None, str | None, str | None]:
+    parsed = parse_message(text, snapshots.current.gazetteer)
+    return parsed.material, parsed.city, parsed.district
+
+def find_recycling_points(snapshot: DataSnapshot, material: str, city: str, category: str | None = None) -> Tuple[List[RecyclingPoint], List[str]]:
+    if not snapshot.points or not material or not city: return [], []
     try:
-        synonym_map = {'шины': ['шин', 'покрышк', 'колес'], 'футболки': ['футболк', 'одежд', 'вещи', 'текстиль'],'бутылки': ['бутылк', 'пэт', 'пластик'], 'пластик': ['пластик', 'пэт', 'бутылк', 'hdpe', 'пнд'], 'батарейки': ['батарейк', 'аккумулятор'], 'бумага': ['бумаг', 'макулатур', 'картон', 'книг'], 'стекло': ['стекл', 'банк', 'стеклотар'], 'одежда': ['одежд', 'вещи', 'текстиль', 'футболк'], 'металл': ['металл', 'жестян', 'алюмин', 'чермет', 'цветмет'], 'крышки': ['крышк'], 'техника': ['техник', 'электроника'], 'опасные отходы': ['опасные отходы', 'ртуть', 'градусник', 'лампочк', 'лампа'], 'зубные щетки': ['зубная щетка', 'зубные щетки']}
-        for key, values in synonym_map.items():
-            if any(val in material for val in values): search_terms = values; break
-        if not search_terms: search_terms = [material]
-        city_points = points_df[points_df['city'].str.lower() == city.lower()]
-        valid_points = city_points.dropna(subset=['accepts'])
-        pattern = '|'.join(search_terms)
-        found_points = valid_points[valid_points['accepts'].str.lower().str.contains(pattern, case=False, na=False)]
-        return found_points.to_dict('records'), search_terms
+        return snapshot.points.search(material, city, category)
     except Exception as e: print(f"Ошибка поиска: {e}"); return [], []
 
-def format_points_response(points: List[dict], header: str) -> str:
+def current_week_minute() -> int:
+    return work_hours.week_minute(datetime.now(LOCAL_TIMEZONE))
+
+def format_opening_status(snapshot: DataSnapshot, point: RecyclingPoint, minute: int) -> str:
+    schedule = snapshot.points.schedule(point)
+    if schedule is None:
+        return ""
+    wait = schedule.minutes_until_open(minute)
+    if wait == 0:
+        return "🟢 Сейчас открыто"
+    if wait is not None and wait <= work_hours.OPENS_SOON_MINUTES:
+        return f"🟡 Откроется через {wait} мин"
+    return "🔴 Сейчас закрыто"
+
+def format_points_response(snapshot: DataSnapshot, points: List[RecyclingPoint], header: str) -> str:
     response_parts = [header]
+    minute = current_week_minute()
     for idx, point in enumerate(points, 1):
-        name = escape_markdown(str(point.get('name', 'Без названия')))
-        address = escape_markdown(str(point.get('address', 'Адрес не указан')))
+        name = escape_markdown(point.name or 'Без названия')
+        address = escape_markdown(point.address or 'Адрес не указан')
         
-        work_hours_value = str(point.get('work_hours', ''))
-        work_hours_text = work_hours_value if work_hours_value else 'Время работы не указано'
+        work_hours_text = point.work_hours if point.work_hours else 'Время работы не указано'
         work_hours = escape_markdown(work_hours_text)
         
-        response_parts.append(f"📍 *{idx}\\. {name}*\n   *Адрес:* {address}\n   *Время работы:* {work_hours}")
+        point_text = f"📍 *{idx}\\. {name}*\n   *Адрес:* {address}\n   *Время работы:* {work_hours}"
+        if point.distance_km is not None:
+            distance = escape_markdown(f"{point.distance_km:.1f} км")
+            point_text += f"\n   *Расстояние:* {distance}"
+        status = format_opening_status(snapshot, point, minute)
+        if status:
+            point_text += f"\n   {escape_markdown(status)}"
+        response_parts.append(point_text)
     return "\n\n".join(response_parts)
 
-def get_knowledge_answer(question: str) -> Tuple[str, str | None]:
-    clean_question = re.sub(r'[^\w\s]', '', question.lower())
-    user_words = set(clean_question.split()) - STOP_WORDS
-    if not user_words: return "", None
-    best_match_score = 0
-    best_answer, best_context = "", None
-    for item in knowledge_base:
-        kb_clean_question = re.sub(r'[^\w\s]', '', item['question'].lower())
-        kb_words = set(kb_clean_question.split()) - STOP_WORDS
-        if not kb_words: continue
-        score = len(user_words.intersection(kb_words))
-        ratio = score / len(kb_words) if len(kb_words) > 0 else 0
-        if score >= 2 and ratio > 0.6 and score > best_match_score:
-            best_match_score, best_answer = score, item['answer']
-            best_context = item.get('context_keyword')
-    return (best_answer, best_context) if best_match_score >= 2 else ("", None)
+def get_user_location(user_id: int) -> Tuple[float, float] | None:
+    """Последняя присланная пользователем геолокация, если она не старше USER_LOCATION_TTL."""
+    location = user_context.get(user_id, {}).get('location')
+    if not location or time.time() - location[2] > USER_LOCATION_TTL:
+        return None
+    return location[0], location[1]
+
+def order_by_distance(snapshot: DataSnapshot, user_id: int, points: List[RecyclingPoint]) -> List[RecyclingPoint]:
+    """Сортирует найденные пункты по удаленности от пользователя, если известна его геолокация."""
+    location = get_user_location(user_id)
+    return snapshot.points.sort_by_distance(points, *location) if location and points else points
+
+def order_points(snapshot: DataSnapshot, user_id: int, points: List[RecyclingPoint], open_only: bool = False) -> Tuple[List[RecyclingPoint], str | None]:
+    """
+    Порядок выдачи: сначала открытые сейчас и скоро открывающиеся, внутри - по расстоянию.
+    Если просили только открытые, а таких нет, возвращаем все пункты и пояснение для заголовка.
+    """
+    minute = current_week_minute()
+    points = order_by_distance(snapshot, user_id, points)
+    if open_only:
+        open_points = snapshot.points.rank_by_opening(points, minute, open_only=True)
+        if open_points:
+            return open_points, None
+        return snapshot.points.rank_by_opening(points, minute), "Сейчас все подходящие пункты закрыты, вот когда они работают:"
+    return snapshot.points.rank_by_opening(points, minute), None
+
+def get_knowledge_candidates(snapshot: DataSnapshot, question: str, k: int = 5) -> List[Tuple[KnowledgeEntry, float]]:
+    """Top-k записей базы знаний по BM25 (без порога), с оценками."""
+    return [(snapshot.knowledge[entry_id], score) for entry_id, score in snapshot.kb_ranker.search(question, k)]
+
+def find_knowledge_entry(snapshot: DataSnapshot, question: str) -> KnowledgeEntry | None:
+    # Порог прежний (>= 2 общих слова и > 60% слов вопроса), а среди прошедших
+    # при равном числе совпадений выбираем запись с большей BM25-оценкой
+    candidates = snapshot.kb_index.candidates(question)
+    if not candidates: return None
+    bm25_scores = snapshot.kb_ranker.score(question)
+    entry_id = max(candidates, key=lambda c: (c[1], bm25_scores[c[0]]))[0]
+    return snapshot.knowledge[entry_id]
+
+def get_knowledge_answer(snapshot: DataSnapshot, question: str) -> Tuple[str, str | None]:
+    item = find_knowledge_entry(snapshot, question)
+    return (item.answer, item.context_keyword) if item else ("", None)
+
+def lookup_answer(snapshot: DataSnapshot, text: str, include_llm: bool) -> dict | None:
+    """
+    Шаг 5 handle_text: ответ из кэша ответов или из базы знаний - в виде записи response_cache
+    (найденный в базе ответ кладется в кэш). include_llm=False - без ответов GigaChat (идет диалог).
+    """
+    cached = response_cache.get(text, include_llm=include_llm)
+    if cached:
+        return cached
+    entry = find_knowledge_entry(snapshot, text.lower())
+    if not entry or not entry.answer:
+        return None
+    response_cache.put(text, 'kb', entry.answer, entry.context_keyword, entry)
+    return {'kind': 'kb', 'answer': entry.answer, 'context': entry.context_keyword, 'entry': entry}
     
-def get_user_intent(question: str) -> str:
-    if not giga: return "GENERAL"
-    system_prompt = ("Твоя задача - определить намерение пользователя. Ответь ОДНИМ словом. "
-                     "1. Если пользователь хочет найти место, куда что-то сдать, или спрашивает адрес - ответь SEARCH. "
-                     "2. Если он спрашивает о твоих возможностях, просит помощи ('помоги', 'что ты умеешь') или здоровается - ответь HELP. "
-                     "3. Если речь о челленджах, вызовах, заданиях - ответь CHALLENGE. "
-                     "4. Во всех остальных случаях (общие вопросы об экологии) - ответь GENERAL.")
+INTENT_RULES = ("1. Если пользователь хочет найти место, куда что-то сдать, или спрашивает адрес - SEARCH. "
+                "2. Если он спрашивает о твоих возможностях, просит помощи ('помоги', 'что ты умеешь') или здоровается - HELP. "
+                "3. Если речь о челленджах, вызовах, заданиях - CHALLENGE. "
+                "4. Во всех остальных случаях (общие вопросы об экологии) - GENERAL.")
+
+ANSWER_SYSTEM_PROMPT = (
+    "Твоя роль - дружелюбный и полезный эксперт по экологии. Ты помнишь предыдущие сообщения "
+    "и можешь поддерживать осмысленный диалог. Отвечай на вопросы, связанные с экологией и переработкой. "
+    "Будь кратким, но информативным. Отвечай строго на русском языке. Не включай в ответ примеры вопросов или текст на других языках. "
+    "Важно: Не приводи в пример названия реальных компаний, брендов или имена людей, если тебя об этом не просят напрямую. "
+    "Если вопрос не по теме, вежливо откажи: 'К сожалению, я могу обсуждать только вопросы, связанные с экологией.'"
+)
+
+def predict_local_intent(question: str, model: IntentModel | None) -> Tuple[str, float, bool]:
+    """Намерение по локальной модели, ее уверенность и достаточно ли ее, чтобы не спрашивать GigaChat."""
+    local_intent, confidence = model.predict(question) if model else ("GENERAL", 0.0)
+    confident = model is not None and confidence >= INTENT_CONFIDENCE
+    if confident:
+        intent_stats['local'] += 1
+        logging.info(f"Intent for '{question[:30]}...' -> {local_intent} (локальная модель, {confidence:.2f})")
+    return local_intent, confidence, confident
+
+def record_llm_intent(question: str, intent: str, local_intent: str, confidence: float, model: IntentModel | None):
+    intent_stats['llm'] += 1
+    if model and intent == local_intent: intent_stats['agree'] += 1
+    # Метка GigaChat - обучающий пример для следующей версии модели (train_intent_model.py)
+    intent_log.append(question, intent, local=local_intent, confidence=round(confidence, 3))
+
+def llm_available() -> bool:
+    """GigaChat загружен и предохранитель не отключил его после серии ошибок."""
+    return giga is not None and giga.available
+
+def with_llm_budget(handler):
+    """Все вызовы GigaChat внутри обработчика укладываются в LLM_HANDLER_BUDGET секунд."""
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        with giga.budget(LLM_HANDLER_BUDGET) if giga else nullcontext():
+            return handler(*args, **kwargs)
+    return wrapper
+
+def degraded_answer(snapshot: DataSnapshot, question: str) -> str:
+    """Ответ без GigaChat: ближайшая запись базы знаний (BM25 top-k без порога) и похожие вопросы."""
+    candidates = [entry for entry, score in get_knowledge_candidates(snapshot, question, k=3) if score > 0]
+    if not candidates:
+        return DEGRADED_NO_ANSWER
+    response = f"{DEGRADED_NOTE}\n\n{candidates[0].answer}"
+    if len(candidates) > 1:
+        response += "\n\nПохожие вопросы: " + "; ".join(entry.question for entry in candidates[1:])
+    return response
+
+def get_user_intent(question: str, model: IntentModel | None = None) -> str:
+    # Сначала локальная модель: GigaChat спрашиваем, только если она не уверена
+    local_intent, confidence, confident = predict_local_intent(question, model)
+    if confident or not llm_available(): return local_intent
+    system_prompt = f"Твоя задача - определить намерение пользователя. Ответь ОДНИМ словом. {INTENT_RULES}"
     payload = Chat(messages=[Messages(role=MessagesRole.SYSTEM, content=system_prompt), Messages(role=MessagesRole.USER, content=question)], temperature=0.1, model='GigaChat-Max')
     try:
-        response = giga.chat(payload)
+        response = giga.chat(payload, timeout=LLM_INTENT_TIMEOUT)
         intent = response.choices[0].message.content.strip().upper()
-        if intent in ["SEARCH", "HELP", "CHALLENGE", "GENERAL"]:
+        if intent in INTENTS:
             logging.info(f"Intent for '{question[:30]}...' -> {intent}")
+            record_llm_intent(question, intent, local_intent, confidence, model)
             return intent
         else:
-            logging.warning(f"Unexpected intent response: '{intent}'. Defaulting to GENERAL.")
-            return "GENERAL"
+            logging.warning(f"Unexpected intent response: '{intent}'. Defaulting to {local_intent}.")
+            return local_intent
     except Exception as e:
         logging.error(f"Error in get_user_intent: {e}")
-        return "GENERAL"
-
-def get_gigachat_answer(question: str, history: deque) -> str:
-    if not giga: return "Извините, модуль GigaChat не был загружен."
-    system_prompt = (
-        "Твоя роль - дружелюбный и полезный эксперт по экологии. Ты помнишь предыдущие сообщения "
-        "и можешь поддерживать осмысленный диалог. Отвечай на вопросы, связанные с экологией и переработкой. "
-        "Будь кратким, но информативным. Отвечай строго на русском языке. Не включай в ответ примеры вопросов или текст на других языках. "
-        "Важно: Не приводи в пример названия реальных компаний, брендов или имена людей, если тебя об этом не просят напрямую. "
-        "Если вопрос не по теме, вежливо откажи: 'К сожалению, я могу обсуждать только вопросы, связанные с экологией.'"
-    )
+        return local_intent
+
+def new_conversation() -> Conversation:
+    return Conversation(token_budget=HISTORY_TOKEN_BUDGET, max_turns=MAX_HISTORY_LENGTH)
+
+def build_answer_payload(question: str, history: Conversation, system_prompt: str = ANSWER_SYSTEM_PROMPT, temperature: float = 0.7) -> Chat:
+    # Начало длинного диалога - сводкой в системном промпте, последние реплики - в пределах бюджета токенов
+    summary = history.summary
+    if summary:
+        system_prompt = f"{system_prompt}\n\nКратко о начале разговора: {summary}"
     messages_for_giga = [Messages(role=MessagesRole.SYSTEM, content=system_prompt)]
-    for msg in history:
-        role = MessagesRole.USER if msg['role'] == 'user' else MessagesRole.ASSISTANT
-        messages_for_giga.append(Messages(role=role, content=msg['content']))
+    for role, content in history.prompt_turns():
+        messages_for_giga.append(Messages(role=MessagesRole.USER if role == 'user' else MessagesRole.ASSISTANT, content=content))
     messages_for_giga.append(Messages(role=MessagesRole.USER, content=question))
-    payload = Chat(messages=messages_for_giga, temperature=0.7, model='GigaChat-Max')
+    return Chat(messages=messages_for_giga, temperature=temperature, model='GigaChat-Max')
+
+def get_gigachat_answer(question: str, history: Conversation) -> str:
+    if not giga: return GIGACHAT_UNAVAILABLE
+    payload = build_answer_payload(question, history)
+    started = time.monotonic()
     try:
-        return giga.chat(payload).choices[0].message.content
+        answer = giga.chat(payload).choices[0].message.content
     except Exception as e:
         logging.error(f"Ошибка при обращении к GigaChat: {e}")
-        return "Извините, произошла ошибка."
+        return GIGACHAT_ERROR
+    llm_latency['full'].add(time.monotonic() - started)
+    return answer
+
+def stream_gigachat_answer(question: str, history: Conversation, on_text) -> str:
+    """
+    То же, что get_gigachat_answer, но ответ приходит частями: on_text(накопленный текст) вызывается
+    на каждом фрагменте. Оборванный на середине поток считается ошибкой - неполный ответ не кэшируется.
+    """
+    if not giga: return GIGACHAT_UNAVAILABLE
+    payload = build_answer_payload(question, history)
+    started = time.monotonic()
+    parts = []
+    try:
+        for chunk in giga.stream(payload):
+            content = chunk.choices[0].delta.content if chunk.choices else None
+            if not content:
+                continue
+            if not parts:
+                llm_latency['ttft'].add(time.monotonic() - started)
+            parts.append(content)
+            on_text(''.join(parts))
+    except Exception as e:
+        logging.error(f"Ошибка при потоковом обращении к GigaChat: {e}")
+        return GIGACHAT_ERROR
+    llm_latency['stream_total'].add(time.monotonic() - started)
+    return ''.join(parts) or GIGACHAT_ERROR
+
+# --- РЕЖИМ МАРШРУТИЗАТОРА (LLM_MODE = 'router') ---
+# Один вызов GigaChat вместо двух (намерение, затем ответ): модель возвращает JSON с намерением,
+# ответом для GENERAL и материалом/городом для SEARCH. Если JSON не разобрать, работаем как раньше.
+ROUTER_SYSTEM_PROMPT = (
+    f"{ANSWER_SYSTEM_PROMPT} "
+    f"Сначала определи намерение последнего сообщения пользователя: {INTENT_RULES} "
+    "Ответь строго одним JSON-объектом без пояснений и без markdown-блока: "
+    '{"intent": "SEARCH|HELP|CHALLENGE|GENERAL", "answer": "ответ пользователю, только для GENERAL", '
+    '"material": "что сдать, только для SEARCH", "city": "город, только для SEARCH"}. '
+    "Поля, которые не нужны, оставь пустыми строками."
+)
+
+class RoutedMessage(NamedTuple):
+    intent: str
+    answer: str | None = None     # готовый ответ для GENERAL
+    material: str | None = None   # для SEARCH: как модель поняла материал и город
+    city: str | None = None
+
+def parse_router_response(response_text: str) -> RoutedMessage | None:
+    """
+    Разбирает ответ маршрутизатора. Допускает текст вокруг JSON и переводы строк внутри ответа;
+    голое слово-намерение тоже принимается (без ответа). None - если намерение не понять.
+    """
+    text = response_text.strip()
+    data = None
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group(0), strict=False)
+        except ValueError:
+            data = None
+    if not isinstance(data, dict):
+        word = text.strip('`"\'. \n').upper()
+        return RoutedMessage(word) if word in INTENTS else None
+    intent = str(data.get('intent', '')).strip().upper()
+    if intent not in INTENTS:
+        return None
+
+    def field(name):
+        value = data.get(name)
+        return value.strip() if isinstance(value, str) and value.strip() else None
+
+    return RoutedMessage(intent, field('answer') if intent == 'GENERAL' else None, field('material'), field('city'))
+
+def route_message(question: str, history: Conversation, model: IntentModel | None = None) -> RoutedMessage:
+    """
+    Намерение (и, если повезет, готовый ответ) за один вызов GigaChat. Уверенная локальная модель
+    отвечает без вызова; при ошибке или неразборчивом ответе - намерение локальной модели без ответа.
+    """
+    local_intent, confidence, confident = predict_local_intent(question, model)
+    if confident or not llm_available(): return RoutedMessage(local_intent)
+    payload = build_answer_payload(question, history, ROUTER_SYSTEM_PROMPT, temperature=0.3)
+    started = time.monotonic()
+    try:
+        response_text = giga.chat(payload).choices[0].message.content
+    except Exception as e:
+        logging.error(f"Error in route_message: {e}")
+        return RoutedMessage(local_intent)
+    llm_latency['router'].add(time.monotonic() - started)
+    routed = parse_router_response(response_text)
+    if not routed:
+        intent_stats['router_unparsed'] += 1
+        logging.warning(f"Unexpected router response: '{response_text[:100]}'. Defaulting to {local_intent}.")
+        return RoutedMessage(local_intent)
+    logging.info(f"Intent for '{question[:30]}...' -> {routed.intent} (маршрутизатор, ответ: {'да' if routed.answer else 'нет'})")
+    record_llm_intent(question, routed.intent, local_intent, confidence, model)
+    return routed
 
 def handle_info_request(text: str) -> str | None:
     text_lower = text.lower()
@@ -352,11 +651,12 @@ def check_challenges():
         challenge_info = challenges.CHALLENGES[challenge_id]
         days_passed = (date.today() - start_date).days
         if days_passed >= challenge_info['duration_days']:
-            db.end_challenge(user_id)
-            profile = db.get_or_create_user_profile(user_id)
-            new_count = profile['challenges_completed_count'] + 1
-            db.update_profile_stats(user_id, {'challenges_completed_count': new_count})
-            add_points_and_notify(user_id, POINTS_FOR_CHALLENGE, f"За завершение челленджа «{challenge_info['title']}»", check_referral=True)
+            with db.transaction():
+                db.end_challenge(user_id)
+                result = gamification.apply_event(
+                    user_id, [Award(POINTS_FOR_CHALLENGE, f"За завершение челленджа «{challenge_info['title']}»")],
+                    update=lambda profile: {'challenges_completed_count': profile['challenges_completed_count'] + 1})
+            send_notifications(result)
             bot.send_message(user_id, challenge_info['end_message'])
             logging.info(f"Челлендж {challenge_id} завершен для {user_id}.")
         elif days_passed > 0 and (days_passed + 1) % 2 == 0 : # Напоминание раз в 2 дня
@@ -366,6 +666,7 @@ def check_challenges():
 def send_daily_tip():
     logging.info("Запущена рассылка эко-советов...")
     subscribers = db.get_all_subscribers()
+    eco_tips = snapshots.current.tips
     if not subscribers or not eco_tips: 
         logging.info("Нет подписчиков или советов для рассылки.")
         return
@@ -393,12 +694,44 @@ def show_all_challenges(chat_id, edit_message_id=None):
     except Exception as e:
         print(f"Ошибка в show_all_challenges: {e}")
 
-def generate_quiz_data():
-    if not giga or not (interesting_facts and eco_tips):
+# Ограничения Telegram для опроса-викторины
+QUIZ_QUESTION_MAX_LENGTH = 300
+QUIZ_OPTION_MAX_LENGTH = 100
+
+def quiz_fact_candidates(snapshot: DataSnapshot) -> List[str]:
+    """Короткие факты и советы, по которым GigaChat составляет вопросы."""
+    return [fact for fact in (snapshot.facts + snapshot.tips) if len(fact) <= 80]
+
+def parse_quiz_response(response_text: str) -> dict | None:
+    """Разбирает ответ GigaChat ("Вопрос: ...", "Верный ответ: ...", "Неверный ответ 1: ...") и проверяет его."""
+    quiz_dict = {}
+    for line in response_text.strip().split('\n'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            quiz_dict[key.strip(' *-').lower()] = value.strip(' *"«»')
+    question = quiz_dict.get("вопрос")
+    correct_answer = quiz_dict.get("верный ответ")
+    wrong_answers = [quiz_dict.get(f"неверный ответ {i}") for i in (1, 2, 3)]
+    options = [correct_answer] + wrong_answers
+    if not all(options) or not question:
+        return None
+    if len(question) > QUIZ_QUESTION_MAX_LENGTH or any(len(option) > QUIZ_OPTION_MAX_LENGTH for option in options):
+        return None
+    # Варианты не должны повторяться, иначе правильный ответ неоднозначен
+    if len({option.lower() for option in options}) < len(options):
+        return None
+    random.shuffle(options)
+    return {"question": question, "options": options, "correct_option_id": options.index(correct_answer)}
+
+def generate_quiz_data(base_fact: str | None = None):
+    """Вопрос викторины по факту (по умолчанию - случайному) через GigaChat; None, если не получилось."""
+    snapshot = snapshots.current
+    if not giga or not (snapshot.facts and snapshot.tips):
         return None
-    all_facts = [fact for fact in (interesting_facts + eco_tips) if len(fact) <= 80]
-    if len(all_facts) < 1: return None
-    base_fact = random.choice(all_facts)
+    if base_fact is None:
+        all_facts = quiz_fact_candidates(snapshot)
+        if len(all_facts) < 1: return None
+        base_fact = random.choice(all_facts)
     prompt = (
         f"Создай вопрос для викторины на основе этого факта: '{base_fact}'.\n"
         "Затем придумай 3 неверных, но правдоподобных ответа на этот вопрос.\n"
@@ -413,30 +746,40 @@ def generate_quiz_data():
     payload = Chat(messages=[Messages(role=MessagesRole.USER, content=prompt)], temperature=0.7, model='GigaChat-Max')
     try:
         response_text = giga.chat(payload).choices[0].message.content
-        lines = response_text.strip().split('\n')
-        quiz_dict = {}
-        for line in lines:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                quiz_dict[key.strip()] = value.strip()
-        question = quiz_dict.get("Вопрос")
-        correct_answer = quiz_dict.get("Верный ответ")
-        wrong_answers = [
-            quiz_dict.get("Неверный ответ 1"),
-            quiz_dict.get("Неверный ответ 2"),
-            quiz_dict.get("Неверный ответ 3")
-        ]
-        if not all([question, correct_answer] + wrong_answers):
+        quiz = parse_quiz_response(response_text)
+        if not quiz:
             logging.error("GigaChat returned malformed quiz data.")
             return None
-        options = [correct_answer] + wrong_answers
-        random.shuffle(options)
-        correct_option_id = options.index(correct_answer)
-        return {"question": question, "options": options, "correct_option_id": correct_option_id}
+        quiz["fact"] = base_fact
+        return quiz
     except Exception as e:
         logging.error(f"Failed to generate quiz data with GigaChat: {e}")
         return None
 
+def refill_quiz_pool():
+    """
+    Пополняет пул викторины до QUIZ_POOL_SIZE проверенных вопросов (запускается ночью, когда GigaChat свободен).
+    Не больше одного вопроса на факт: факты, по которым вопрос уже лежит в пуле, пропускаются.
+    """
+    if not giga:
+        return
+    missing = QUIZ_POOL_SIZE - db.count_quizzes()
+    if missing <= 0:
+        return
+    used_facts = db.get_quiz_pool_facts()
+    facts = [fact for fact in dict.fromkeys(quiz_fact_candidates(snapshots.current)) if fact not in used_facts]
+    random.shuffle(facts)
+    added = failed = 0
+    for fact in facts:
+        if added >= missing or failed >= QUIZ_POOL_MAX_FAILURES or not llm_available():
+            break
+        quiz = generate_quiz_data(fact)
+        if quiz and db.add_quiz(fact, quiz["question"], quiz["options"], quiz["correct_option_id"]):
+            added += 1
+        else:
+            failed += 1
+    logging.info(f"Пул викторины пополнен: +{added} (не удалось: {failed}), всего {db.count_quizzes()}.")
+
 # Вставьте этот код в bot_polling.py
 
 def send_help_message(message):
@@ -454,6 +797,7 @@ def send_help_message(message):
 Примеры:
 `Куда сдать батарейки?`
 `Стекло в Кургане`
+Нажмите *«Пункты рядом 📍»* и отправьте геолокацию — я покажу ближайшие пункты\\.
 
 
 🧠 *Отвечать на вопросы об экологии*
@@ -510,28 +854,33 @@ def send_welcome(message):
 @bot.message_handler(commands=['recycled'])
 def handle_recycled(message):
     user_id = message.from_user.id
-    profile = db.get_or_create_user_profile(user_id)
     today = date.today()
     today_str = today.isoformat()
+    yesterday_str = (today - timedelta(days=1)).isoformat()
 
-    if profile.get('last_recycle_report_date') == today_str:
+    def report(profile):
+        if profile.get('last_recycle_report_date') == today_str:
+            return None
+        current_streak = profile['recycle_streak_count']
+        current_streak = current_streak + 1 if profile.get('last_recycle_report_date') == yesterday_str else 1
+        return {
+            'recycle_report_count': profile['recycle_report_count'] + 1,
+            'last_recycle_report_date': today_str,
+            'recycle_streak_count': current_streak
+        }
+
+    def awards(profile):
+        current_streak = profile['recycle_streak_count']
+        result = [Award(POINTS_FOR_RECYCLE, "За ежедневный отчет о сдаче вторсырья")]
+        if current_streak >= 5 and current_streak % 7 == 5:
+            result.append(Award(POINTS_FOR_STREAK, f"За {current_streak}-дневную серию сдачи вторсырья!"))
+        return result
+
+    result = gamification.apply_event(user_id, awards, update=report)
+    if not result.applied:
         bot.reply_to(message, "Вы уже сообщали о сдаче вторсырья сегодня. Спасибо! 😉")
         return
-
-    yesterday_str = (today - timedelta(days=1)).isoformat()
-    current_streak = profile['recycle_streak_count']
-    current_streak = current_streak + 1 if profile.get('last_recycle_report_date') == yesterday_str else 1
-    
-    db.update_profile_stats(user_id, {
-        'recycle_report_count': profile['recycle_report_count'] + 1,
-        'last_recycle_report_date': today_str,
-        'recycle_streak_count': current_streak
-    })
-    
-    add_points_and_notify(user_id, POINTS_FOR_RECYCLE, "За ежедневный отчет о сдаче вторсырья", check_referral=True)
-    
-    if current_streak >= 5 and current_streak % 7 == 5:
-         add_points_and_notify(user_id, POINTS_FOR_STREAK, f"За {current_streak}-дневную серию сдачи вторсырья!", check_referral=True)
+    send_notifications(result)
 
 @bot.message_handler(commands=['profile'])
 def handle_profile(message):
@@ -573,13 +922,16 @@ def handle_leaderboard(message):
     response_parts = ["🏆 *Таблица Лидеров (текущий квартал)* 🏆\n"]
     medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣"]
     
+    names = user_names.names(leader['user_id'] for leader in leaders)
     for i, leader in enumerate(leaders):
-        try:
-            user_info = bot.get_chat(leader['user_id'])
-            user_name = user_info.first_name or user_info.username or f"Герой"
-        except Exception: user_name = f"Герой"
+        user_name = names[leader['user_id']] or "Герой"
         response_parts.append(f"{medals[i]} *{escape_markdown(user_name)}* \\- {leader['quarterly_points']} очков")
 
+    rank = db.get_user_rank(message.from_user.id)
+    if rank:
+        place, points = rank
+        response_parts.append(f"\nВы на *{place}\\-м месте* \\- {points} очков")
+
     send_message_safely(message, "\n".join(response_parts))
 
 @bot.message_handler(commands=['help'])
@@ -588,6 +940,7 @@ def handle_help_command(message):
     send_help_message(message)
 
 @bot.message_handler(commands=['quiz'])
+@with_llm_budget
 def handle_quiz(message):
     user_id = message.from_user.id
     profile = db.get_or_create_user_profile(user_id)
@@ -599,8 +952,11 @@ def handle_quiz(message):
         
     db.update_profile_stats(user_id, {'last_quiz_date': today_str})
     
-    bot.send_message(message.chat.id, "🧠 Генерирую для вас уникальный вопрос... Пожалуйста, подождите немного.")
-    quiz_data = generate_quiz_data()
+    # Обычно вопрос уже готов в пуле; генерируем на месте, только если пул пуст
+    quiz_data = db.pop_quiz()
+    if not quiz_data:
+        bot.send_message(message.chat.id, "🧠 Генерирую для вас уникальный вопрос... Пожалуйста, подождите немного.")
+        quiz_data = generate_quiz_data()
     
     if not quiz_data:
         bot.reply_to(message, "Не удалось создать вопрос для викторины. Попробуйте, пожалуйста, позже.")
@@ -628,13 +984,12 @@ def handle_poll_answer(poll_answer):
         logging.warning(f"Poll with ID {poll_answer.poll_id} not found in memory.")
         return
 
-    profile = db.get_or_create_user_profile(user_id)
-    
     if correct_option_id == poll_answer.option_ids[0]:
-        new_streak = profile['quiz_correct_streak'] + 1
-        db.update_profile_stats(user_id, {'quiz_correct_streak': new_streak})
-        add_points_and_notify(user_id, POINTS_FOR_QUIZ, "За правильный ответ в викторине", check_referral=True)
+        result = gamification.apply_event(user_id, [Award(POINTS_FOR_QUIZ, "За правильный ответ в викторине")],
+                                          update=lambda profile: {'quiz_correct_streak': profile['quiz_correct_streak'] + 1})
+        send_notifications(result)
     else:
+        db.get_or_create_user_profile(user_id)
         db.update_profile_stats(user_id, {'quiz_correct_streak': 0})
         bot.send_message(user_id, "В этот раз неверно, но не переживайте! В следующий раз обязательно получится. 👍")
 
@@ -651,7 +1006,44 @@ def handle_invite(message):
     
     bot.send_message(user_id, response, parse_mode='Markdown')
 
+@bot.message_handler(content_types=['location'])
+def handle_location(message):
+    """Геолокация пользователя: сортируем последние найденные пункты по расстоянию или ищем ближайшие."""
+    try:
+        user_id = message.from_user.id
+        db.get_or_create_user_profile(user_id)
+        if user_id not in user_context:
+            user_context[user_id] = {'history': new_conversation()}
+        context = user_context[user_id]
+        lat, lon = message.location.latitude, message.location.longitude
+        context['location'] = (lat, lon, time.time())
+
+        snapshot = snapshots.current
+        points = snapshot.points.sort_by_distance(context.get('found_points', []), lat, lon)
+        header = "📍 *Найденные пункты, ближе всего к вам:*"
+        if not any(p.distance_km is not None for p in points):
+            # У прошлых результатов нет координат (или поиска еще не было) - ищем ближайшие пункты вообще
+            points = snapshot.points.nearest(lat, lon, k=NEAREST_POINTS_LIMIT)
+            header = "📍 *Ближайшие к вам пункты приема:*"
+        # Среди ближайших работающие сейчас - выше
+        points = snapshot.points.rank_by_opening(points, current_week_minute())
+        if not points:
+            bot.reply_to(message, "Запомнил ваше местоположение, но координат пунктов рядом пока нет\\. "
+                                  "Напишите, что и в каком городе хотите сдать, например: *Батарейки в Кургане*", parse_mode='MarkdownV2')
+            return
+
+        context.update({'found_points': points, 'page': 0, 'city': context.get('city') or points[0].city.lower(), 'district': None})
+        response = format_points_response(snapshot, points[:MAX_POINTS_TO_SHOW], header)
+        markup = types.InlineKeyboardMarkup()
+        if len(points) > MAX_POINTS_TO_SHOW:
+            markup.add(types.InlineKeyboardButton("🔄 Показать другие варианты", callback_data=f"more_points_{random.randint(1,1000)}"))
+        send_message_safely(message, response, reply_markup=markup)
+    except Exception as e:
+        logging.error(f"Ошибка в handle_location: {e}", exc_info=True)
+        bot.reply_to(message, "Не получилось обработать геолокацию. Попробуйте написать адрес или город.")
+
 @bot.message_handler(func=lambda message: True)
+@with_llm_budget
 def handle_text(message):
     try:
         # --- 1. Начальная настройка ---
@@ -659,16 +1051,24 @@ def handle_text(message):
         text = message.text.strip()
         text_lower = text.lower()
         db.get_or_create_user_profile(user_id)
+        # Разбор, сделанный диспетчером при выборе полосы (classify_update), не повторяем
+        prepared = getattr(message, 'prepared', None)
+        if prepared is not None:
+            snapshot, parsed = prepared.snapshot, prepared.parsed
+        else:
+            # Снимок данных берется один раз: перезагрузка файлов посреди запроса его не затронет
+            snapshot = snapshots.current
+            # Один проход словаря по сообщению: триггеры помощи, город, материал
+            parsed = parse_message(text_lower, snapshot.gazetteer)
 
         # Проверка на ключевые слова для вызова инструкции
-        HELP_TRIGGERS = {'помощь', 'помоги', 'инструкция', 'что ты умеешь', 'хелп', 'справка'}
-        if text_lower in HELP_TRIGGERS:
+        if parsed.is_help:
             send_help_message(message)
             return # Завершаем выполнение, чтобы не идти дальше
 
         # Инициализация контекста для диалога
         if user_id not in user_context:
-            user_context[user_id] = {'history': deque(maxlen=MAX_HISTORY_LENGTH)}
+            user_context[user_id] = {'history': new_conversation()}
 
         # --- 2. Обработка точных нажатий на кнопки меню ---
         button_handlers = {
@@ -684,13 +1084,13 @@ def handle_text(message):
 
         # --- 3.  Приоритетная обработка явных поисковых запросов ---
         # Пытаемся извлечь материал и город. Если успешно, это точно поиск.
-        potential_material, potential_city, potential_district = extract_entities(text_lower)
+        potential_material, potential_city, potential_district = parsed.material, parsed.city, parsed.district
         
         if potential_city and potential_material:
             logging.info(f"Обнаружен прямой поисковый запрос: Город={potential_city}, Материал={potential_material}")
             
             bot.send_chat_action(message.chat.id, 'typing')
-            all_city_points, search_terms = find_recycling_points(potential_material, potential_city)
+            all_city_points, search_terms = find_recycling_points(snapshot, potential_material, potential_city, parsed.category)
 
             if not all_city_points:
                 fallback_point = FALLBACK_POINTS.get(potential_city.lower())
@@ -708,20 +1108,21 @@ def handle_text(message):
                 send_message_safely(message, response)
             else:
                 if potential_district:
-                    points_in_district = [p for p in all_city_points if potential_district in p.get('address', '').lower()]
+                    points_in_district = [p for p in all_city_points if potential_district in p.address.lower()]
                     if points_in_district:
                         all_city_points = points_in_district
 
-                unique_points_by_name = {f"{p.get('name', '')}:{p.get('address', '')}".lower(): p for p in all_city_points}
-                unique_points_list = list(unique_points_by_name.values())
-
+                # Пункты из индекса уже без дублей по "название:адрес"
+                unique_points_list, note = order_points(snapshot, user_id, all_city_points, parsed.open_now)
                 user_context[user_id].update({'found_points': unique_points_list, 'page': 0, 'city': potential_city, 'district': potential_district})
                 points_to_show = unique_points_list[:MAX_POINTS_TO_SHOW]
                 header = f"✅ *Вот что удалось найти в городе {escape_markdown(potential_city.capitalize())}:*"
-                if potential_district and any(potential_district in p.get('address', '').lower() for p in points_to_show):
+                if potential_district and any(potential_district in p.address.lower() for p in points_to_show):
                      header = f"✅ *Вот что удалось найти в районе {escape_markdown(potential_district.capitalize())}:*"
+                if note:
+                    header = f"{escape_markdown(note)}\n\n{header}"
 
-                response = format_points_response(points_to_show, header)
+                response = format_points_response(snapshot, points_to_show, header)
                 markup = types.InlineKeyboardMarkup()
                 if len(unique_points_list) > MAX_POINTS_TO_SHOW:
                     markup.add(types.InlineKeyboardButton("🔄 Показать другие варианты", callback_data=f"more_points_{random.randint(1,1000)}"))
@@ -745,13 +1146,13 @@ def handle_text(message):
             return
 
         if text_lower == BTN_TIP.lower():
-            tip_of_the_day = random.choice(eco_tips) if eco_tips else "Извините, у меня закончились советы."
+            tip_of_the_day = random.choice(snapshot.tips) if snapshot.tips else "Извините, у меня закончились советы."
             response = f"💡 *Случайный совет:*\n\n{escape_markdown(tip_of_the_day)}"
-            profile = db.get_or_create_user_profile(user_id)
             today_str = date.today().isoformat()
-            if profile.get('last_tip_date') != today_str:
-                db.update_profile_stats(user_id, {'last_tip_date': today_str})
-                add_points_and_notify(user_id, POINTS_FOR_TIP, "За проявленный интерес к экологии", check_referral=True)
+            result = gamification.apply_event(
+                user_id, [Award(POINTS_FOR_TIP, "За проявленный интерес к экологии")],
+                update=lambda profile: None if profile.get('last_tip_date') == today_str else {'last_tip_date': today_str})
+            send_notifications(result)
             send_message_safely(message, response)
             return
 
@@ -763,8 +1164,21 @@ def handle_text(message):
             bot.reply_to(message, "Слушаю ваш вопрос о переработке отходов!")
             return
 
-        # --- 5. Поиск ответа в локальной базе знаний ---
-        answer, context_to_save = get_knowledge_answer(text_lower)
+        # --- 5. Поиск ответа в кэше и локальной базе знаний ---
+        # Ответы GigaChat из кэша отдаем только вне диалога: уточняющие вопросы зависят от истории
+        include_llm = not user_context[user_id]['history']
+        if prepared is not None and prepared.looked_up and \
+                (include_llm or not prepared.answer or prepared.answer['kind'] != 'llm'):
+            cached = prepared.answer
+        else:
+            # Разбора не было или диалог начался, пока сообщение ждало в очереди
+            cached = lookup_answer(snapshot, text, include_llm)
+        if cached and cached['kind'] == 'llm':
+            send_message_safely(message, escape_markdown(cached['answer']))
+            user_context[user_id]['history'].add_exchange(text, cached['answer'])
+            return
+
+        answer, context_to_save, entry = (cached['answer'], cached['context'], cached['entry']) if cached else ("", None, None)
         if answer:
             response, markup = escape_markdown(answer), None
             if context_to_save:
@@ -773,25 +1187,37 @@ def handle_text(message):
                 markup.add(types.InlineKeyboardButton(f"Найти пункты для '{context_to_save}'", callback_data=f"search_context_{context_to_save}"))
             
             send_message_safely(message, response, reply_markup=markup)
-            # Добавляем в историю для поддержания диалога
-            user_context[user_id]['history'].append({'role': 'user', 'content': text})
-            user_context[user_id]['history'].append({'role': 'assistant', 'content': answer})
+            # Добавляем в историю для поддержания диалога (ответ базы знаний - ссылкой на запись)
+            user_context[user_id]['history'].add_exchange(text, entry or answer)
             return
 
         # --- 6. Если ничего не подошло - обращаемся к GigaChat (Fallback) ---
         bot.send_chat_action(message.chat.id, 'typing')
 
         # Определяем намерение, если предыдущие шаги не дали результата
-        intent = get_user_intent(text_lower)
+        routed = None  # RoutedMessage в режиме маршрутизатора: намерение и, для GENERAL, уже готовый ответ
+        if LLM_MODE == 'router':
+            routed = route_message(text_lower, user_context[user_id]['history'], snapshot.intent_model)
+            intent = routed.intent
+        else:
+            intent = get_user_intent(text_lower, snapshot.intent_model)
         response = ""
+        stream = None  # StreamingReply, если ответ GigaChat печатается по мере генерации
 
         if intent == "SEARCH":
-            material, city, district = extract_entities(text_lower)
+            material, city, district, category = parsed.material, parsed.city, parsed.district, parsed.category
+            if routed and (routed.material or routed.city):
+                # Материал и город, которые выделил маршрутизатор, проводим через тот же словарь и справочник;
+                # его материал лучше остатка фразы, если только по нему словарь узнал категорию сырья
+                extracted = parse_message(' '.join(filter(None, (routed.material, routed.city))), snapshot.gazetteer)
+                if extracted.material and (not material or (extracted.category and not category)):
+                    material, category = extracted.material, extracted.category
+                city = city or extracted.city
             if not city:
                 city = "курган"
                 logging.info(f"Город не указан, автоматически используется 'курган' для материала: {material}")
 
-            all_city_points, search_terms = find_recycling_points(material, city)
+            all_city_points, search_terms = find_recycling_points(snapshot, material, city, category)
             if not all_city_points:
                 
                 fallback_point = FALLBACK_POINTS.get(city.lower())
@@ -810,12 +1236,13 @@ def handle_text(message):
                 return # И завершаем
             else:
                 # ... (логика форматирования и отправки, если точки найдены, остается без изменений) ...
-                unique_points_by_name = {f"{p.get('name', '')}:{p.get('address', '')}".lower(): p for p in all_city_points}
-                unique_points_list = list(unique_points_by_name.values())
+                unique_points_list, note = order_points(snapshot, user_id, all_city_points, parsed.open_now)
                 user_context[user_id].update({'found_points': unique_points_list, 'page': 0, 'city': city, 'district': district})
                 points_to_show = unique_points_list[:MAX_POINTS_TO_SHOW]
                 header = f"✅ Нашел пункты в городе *{escape_markdown(city.capitalize())}*:"
-                response = format_points_response(points_to_show, header)
+                if note:
+                    header = f"{escape_markdown(note)}\n\n{header}"
+                response = format_points_response(snapshot, points_to_show, header)
                 markup = types.InlineKeyboardMarkup()
                 if len(unique_points_list) > MAX_POINTS_TO_SHOW:
                     markup.add(types.InlineKeyboardButton("🔄 Показать другие варианты", callback_data=f"more_points_{random.randint(1,1000)}"))
@@ -832,17 +1259,43 @@ def handle_text(message):
         else: # GENERAL
             if len(text.split()) <= 2 and text_lower in VAGUE_REPLIES:
                 response = "Привет! Кажется, твой ответ неполный. Задай, пожалуйста, полноценный вопрос или воспользуйся кнопками меню."
+            elif giga and not giga.available and not (routed and routed.answer):
+                # Предохранитель отключил GigaChat: отвечаем сразу, а не ждем заведомо неудачного вызова
+                cached_answer = semantic_cache.lookup(text) if not user_context[user_id]['history'] else None
+                response = escape_markdown(cached_answer or degraded_answer(snapshot, text_lower))
             else:
-                history = user_context[user_id].get('history', deque(maxlen=MAX_HISTORY_LENGTH))
-                response_giga = get_gigachat_answer(text, history)
+                history = user_context[user_id]['history']
+                is_first_turn = not history
+                # Перефразированный одиночный вопрос может уже иметь ответ в семантическом кэше
+                # Ответ маршрутизатора уже получен - кэш спрашивать незачем, но сохранить ответ в него стоит
+                has_routed_answer = bool(routed and routed.answer)
+                response_giga = semantic_cache.lookup(text) if is_first_turn and not has_routed_answer else None
+                if not response_giga:
+                    if has_routed_answer:
+                        response_giga = routed.answer
+                    elif GIGACHAT_STREAMING and giga:
+                        # Заглушка сразу, дальше она дописывается по мере генерации; отправка - в шаге 7
+                        stream = StreamingReply(bot, message, STREAM_EDIT_INTERVAL)
+                        stream.start(reply_markup=create_main_keyboard())
+                        response_giga = stream_gigachat_answer(text, history, stream.update)
+                    else:
+                        response_giga = get_gigachat_answer(text, history)
+                    if is_first_turn and response_giga not in (GIGACHAT_UNAVAILABLE, GIGACHAT_ERROR):
+                        semantic_cache.store(text, response_giga)
+                if is_first_turn and response_giga not in (GIGACHAT_UNAVAILABLE, GIGACHAT_ERROR):
+                    response_cache.put(text, 'llm', response_giga)
+                if response_giga == GIGACHAT_ERROR:
+                    response_giga = degraded_answer(snapshot, text_lower)
                 response = escape_markdown(response_giga)
 
         # --- 7. Отправка ответа и сохранение истории ---
         if response:
              clean_response_for_history = re.sub(r'\\([_*\[\]()~`>#+\-={}.!])', r'\1', response)
-             user_context[user_id]['history'].append({'role': 'user', 'content': text})
-             user_context[user_id]['history'].append({'role': 'assistant', 'content': clean_response_for_history})
-             send_message_safely(message, response)
+             user_context[user_id]['history'].add_exchange(text, clean_response_for_history)
+             if stream:
+                 stream.finish(response, clean_response_for_history)
+             else:
+                 send_message_safely(message, response)
 
     except Exception as e:
         logging.critical(f"Произошла критическая ошибка в handle_text: {e}", exc_info=True)
@@ -864,6 +1317,7 @@ def handle_callbacks(call):
             current_page = context.get('page', 0)
             city = context['city']
             district = context.get('district')
+            snapshot = snapshots.current
 
             new_page = current_page + 1
             start_index = new_page * MAX_POINTS_TO_SHOW
@@ -877,10 +1331,10 @@ def handle_callbacks(call):
             points_to_show = all_points[start_index : start_index + MAX_POINTS_TO_SHOW]
             
             header = f"✅ Нашел пункты в городе *{escape_markdown(city.capitalize())}*:"
-            if district and any(district in p.get('address', '').lower() for p in points_to_show):
+            if district and any(district in p.address.lower() for p in points_to_show):
                 header = f"✅ Нашел пункты в районе *{escape_markdown(district.capitalize())}*:"
             
-            response = format_points_response(points_to_show, header)
+            response = format_points_response(snapshot, points_to_show, header)
             
             markup = types.InlineKeyboardMarkup()
             markup.add(types.InlineKeyboardButton("🔄 Показать другие варианты", callback_data=f"more_points_{random.randint(1,1000)}"))
@@ -923,20 +1377,107 @@ def handle_callbacks(call):
     except Exception as e:
         logging.error(f"Ошибка в callback_query_handler: {e}", exc_info=True)
 
+# --- ДИСПЕТЧЕР ОБНОВЛЕНИЙ ---
+# Кнопки меню, которые отвечают без GigaChat (викторина - нет: вопрос генерирует GigaChat)
+FAST_BUTTONS = {button.lower() for button in (BTN_RECYCLED, BTN_FIND_POINT, BTN_PROFILE, BTN_CHALLENGE, BTN_LEADERBOARD,
+                                              BTN_TIP, BTN_INVITE, BTN_QUESTION, BTN_NEAREST)}
+BUSY_REPLY = "Я думаю над предыдущим вопросом… Отвечу на него и сразу возьмусь за следующий."
+OVERLOAD_REPLY = "Сейчас очень много вопросов, я не успеваю. Попробуйте, пожалуйста, через минуту."
+
+class PreparedText(NamedTuple):
+    """Разбор текстового сообщения в classify_update; handle_text берет его из message.prepared."""
+    snapshot: DataSnapshot
+    parsed: ParsedMessage
+    looked_up: bool = False     # шаг 5 (кэш ответов, база знаний) уже выполнен
+    answer: dict | None = None  # его результат - запись response_cache или None
+
+def classify_update(update) -> str:
+    """
+    Полоса для обновления: LLM, если обработчик, скорее всего, будет ждать GigaChat
+    (викторина, свободный текст без готового ответа), иначе FAST.
+    Разбор сообщения и найденный ответ передаются обработчику, чтобы он их не повторял.
+    """
+    message = update.message
+    if message is None or message.content_type != 'text':
+        return dispatcher.FAST  # кнопки под сообщениями, ответы на викторину, геолокация
+    text = message.text.strip()
+    text_lower = text.lower()
+    if text_lower in (BTN_QUIZ.lower(), '/quiz'):
+        return dispatcher.LLM
+    if text_lower.startswith('/') or text_lower in FAST_BUTTONS:
+        return dispatcher.FAST
+    # Те же быстрые шаги, что и в handle_text: помощь, прямой поиск пунктов, кэш ответов и база знаний
+    snapshot = snapshots.current
+    parsed = parse_message(text_lower, snapshot.gazetteer)
+    if parsed.is_help or (parsed.material and parsed.city):
+        message.prepared = PreparedText(snapshot, parsed)
+        return dispatcher.FAST
+    context = user_context.get(message.from_user.id) if message.from_user else None
+    answer = lookup_answer(snapshot, text, include_llm=not (context and context['history']))
+    message.prepared = PreparedText(snapshot, parsed, True, answer)
+    return dispatcher.FAST if answer else dispatcher.LLM
+
+def reject_update(update, lane: str, reason: str):
+    """Ответ вместо постановки в очередь: пользователь сразу видит, что его сообщение получено."""
+    text = BUSY_REPLY if reason == dispatcher.USER_BUSY else OVERLOAD_REPLY
+    logging.warning(f"Обновление {update.update_id} не принято в полосу {lane}: {reason}")
+    if update.callback_query:
+        bot.answer_callback_query(update.callback_query.id, text=text)
+    elif update.message:
+        bot.reply_to(update.message, text)
+
+# Не больше одного вопроса к GigaChat на пользователя: следующий получает BUSY_REPLY
+update_dispatcher = Dispatcher({
+    dispatcher.FAST: Lane(dispatcher.FAST, FAST_LANE_WORKERS, FAST_LANE_MAX_QUEUE),
+    dispatcher.LLM: Lane(dispatcher.LLM, LLM_LANE_WORKERS, LLM_LANE_MAX_QUEUE, per_user=1),
+}, classify_update, on_reject=reject_update)
+
+def log_runtime_stats():
+    """Периодически пишет в лог счетчики кэшей и очередей (сколько вызовов LLM сэкономлено и т.п.)."""
+    logging.info(f"Кэш ответов: {response_cache.stats()}")
+    logging.info(f"Семантический кэш: {semantic_cache.stats()}")
+    logging.info(f"Снимок данных: {snapshots.stats()}")
+    logging.info(f"Намерения: {dict(intent_stats)}")
+    logging.info(f"Полосы обработки: {update_dispatcher.stats()}")
+    logging.info(f"Вопросов в пуле викторины: {db.count_quizzes()}")
+    logging.info(f"Кэш таблицы лидеров: {db.leaderboard_stats()}")
+    logging.info(f"Имена пользователей: {user_names.stats()}")
+    if WRITE_BEHIND:
+        logging.info(f"Отложенная запись профилей: {db.write_behind_stats()}")
+    if giga:
+        logging.info(f"GigaChat: {giga.stats()}")
+    # ttft - до первого фрагмента потокового ответа, full - полный ответ без потока
+    logging.info(f"Задержки GigaChat: { {name: samples.summary() for name, samples in llm_latency.items()} }")
+
 # --- ЗАПУСК БОТА ---
 if __name__ == "__main__":
     logging.info("Загрузка данных...")
-    points_df, knowledge_base, interesting_facts, eco_tips = load_data()
+    snapshots.load()
+    # kill -HUP <pid> - перечитать все файлы данных; кроме того, изменения файлов подхватываются сами
+    snapshots.install_signal_handler()
     
     scheduler = BackgroundScheduler(timezone="Europe/Moscow")
     scheduler.add_job(check_challenges, 'cron', hour=10)
     scheduler.add_job(send_daily_tip, 'cron', hour=11)
+    scheduler.add_job(log_runtime_stats, 'interval', minutes=30)
+    scheduler.add_job(semantic_cache.purge_expired, 'cron', hour=4)
+    scheduler.add_job(snapshots.check_for_changes, 'interval', seconds=DATA_RELOAD_INTERVAL)
+    scheduler.add_job(refill_quiz_pool, 'cron', hour=QUIZ_POOL_REFILL_HOUR)
     scheduler.start()
     logging.info("Планировщик запущен.")
     
+    # Обновления раздаются по полосам: ожидание GigaChat не задерживает кнопки меню
+    update_dispatcher.install(bot)
     logging.info("Бот (в режиме polling) запущен...")
+    # kill <pid> (SIGTERM от systemd/docker) - та же остановка, что и по Ctrl+C: через finally ниже
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     try:
         bot.polling(none_stop=True)
     except Exception as e:
         logging.critical(f"Бот остановился из-за критической ошибки: {e}")
-        scheduler.shutdown()
\ No newline at end of file
+    finally:
+        scheduler.shutdown(wait=False)
+        # Обработчики дорабатывают, и только потом буфер счетчиков записывается в базу
+        update_dispatcher.shutdown(wait=True)
+        db.stop_write_behind()
+        logging.info("Бот остановлен.")
\ No newline at end of file
@@ -0,0 +1,138 @@
+# conversation.py
+# История диалога для запросов к GigaChat с бюджетом токенов. У каждой реплики хранится оценка
+# длины в токенах (считается один раз). Когда история выходит за бюджет, самые старые обмены
+# репликами уходят в краткую сводку: по строке на обмен, строка считается один раз при вытеснении
+# и дальше не пересчитывается. Сводка попадает в системный промпт, последние реплики - целиком.
+#
+# Ответы из базы знаний хранятся ссылкой на запись (KnowledgeEntry), а не копией текста:
+# текст берется из записи при сборке промпта.
+
+import math
+import threading
+from collections import deque
+from typing import List, NamedTuple, Tuple
+
+from data_store import KnowledgeEntry
+
+# Русский текст в токенизаторе GigaChat - примерно 3-4 символа на токен; берем с запасом
+CHARS_PER_TOKEN = 3
+SUMMARY_ITEMS = 4           # сколько вытесненных обменов помнит сводка
+SUMMARY_QUESTION_CHARS = 80
+SUMMARY_ANSWER_CHARS = 120
+USER, ASSISTANT = 'user', 'assistant'
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def shorten(text: str, limit: int) -> str:
+    """Первое предложение текста, не длиннее limit символов."""
+    text = ' '.join(text.split())
+    for mark in ('. ', '! ', '? ', '\n'):
+        end = text.find(mark)
+        if 0 < end < limit:
+            text = text[:end + 1]
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '…'
+
+
+class Turn(NamedTuple):
+    role: str
+    text: str | None                  # None - ответ из базы знаний, см. entry
+    tokens: int
+    entry: KnowledgeEntry | None = None
+
+    @property
+    def content(self) -> str:
+        return self.entry.answer if self.entry is not None else self.text
+
+
+class Conversation:
+    """
+    max_turns - сколько последних реплик храним целиком; token_budget - сколько токенов истории
+    (реплики вместе со сводкой) можно отправить в одном запросе.
+    """
+
+    def __init__(self, token_budget: int = 800, max_turns: int = 6):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.turns = deque()
+        self.tokens = 0
+        self._summary = deque(maxlen=SUMMARY_ITEMS)  # (строка, токены)
+        self._pending_question = None  # вопрос вытесненного обмена ждет свой ответ
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.turns) + len(self._summary)
+
+    def add_user(self, text: str):
+        self._add(Turn(USER, text, estimate_tokens(text)))
+
+    def add_assistant(self, text: str):
+        self._add(Turn(ASSISTANT, text, estimate_tokens(text)))
+
+    def add_knowledge(self, entry: KnowledgeEntry):
+        self._add(Turn(ASSISTANT, None, estimate_tokens(entry.answer), entry))
+
+    def add_exchange(self, question: str, answer: str | KnowledgeEntry):
+        self.add_user(question)
+        if isinstance(answer, KnowledgeEntry):
+            self.add_knowledge(answer)
+        else:
+            self.add_assistant(answer)
+
+    @property
+    def summary(self) -> str | None:
+        with self._lock:
+            return ' '.join(line for line, _ in self._summary) or None
+
+    def _summary_tokens(self) -> int:
+        return sum(tokens for _, tokens in self._summary)
+
+    def _add(self, turn: Turn):
+        with self._lock:
+            self.turns.append(turn)
+            self.tokens += turn.tokens
+            # Последнюю реплику оставляем всегда, даже если она одна больше бюджета (ее обрежет prompt_turns)
+            while len(self.turns) > 1 and (len(self.turns) > self.max_turns
+                                           or self.tokens + self._summary_tokens() > self.token_budget):
+                self._evict()
+
+    def _evict(self):
+        turn = self.turns.popleft()
+        self.tokens -= turn.tokens
+        if turn.role == USER:
+            self._pending_question = turn.text
+            return
+        question, self._pending_question = self._pending_question, None
+        if turn.entry is not None:
+            answer = f"ответ из базы знаний на вопрос «{turn.entry.question}»"
+        else:
+            answer = f"ответ: {shorten(turn.text, SUMMARY_ANSWER_CHARS).rstrip('.!?')}"
+        line = f"Пользователь спрашивал: «{shorten(question, SUMMARY_QUESTION_CHARS)}», {answer}." if question \
+            else f"Ранее был {answer}."
+        self._summary.append((line, estimate_tokens(line)))
+
+    def prompt_turns(self) -> List[Tuple[str, str]]:
+        """(роль, текст) для промпта, от старых к новым, в пределах бюджета за вычетом сводки."""
+        with self._lock:
+            budget = self.token_budget - self._summary_tokens()
+            turns = list(self.turns)
+        selected = []
+        for turn in reversed(turns):
+            if turn.tokens > budget:
+                if not selected and budget > 0:
+                    # Единственная реплика длиннее бюджета: берем ее конец - он ближе к вопросу
+                    selected.append((turn.role, '…' + turn.content[-budget * CHARS_PER_TOKEN:]))
+                break
+            selected.append((turn.role, turn.content))
+            budget -= turn.tokens
+        selected.reverse()
+        return selected
+
+    def clear(self):
+        with self._lock:
+            self.turns.clear()
+            self.tokens = 0
+            self._summary.clear()
+            self._pending_question = None
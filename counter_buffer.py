@@ -0,0 +1,143 @@
+# counter_buffer.py
+# Отложенная запись (write-behind) счетчиков профиля. Изменения копятся в памяти по пользователям
+# и записываются пачкой - одной транзакцией с executemany - раз в flush_interval секунд или сразу,
+# как только накопилось max_events изменений. Обработчики не ждут блокировку записи SQLite на каждое
+# начисление, а в пиках (рассылка совета дня, реферальная акция) десятки коммитов сливаются в один.
+#
+# Для каждого поля хранится одна операция: прибавить (DELTA) или установить (SET); следующие
+# изменения того же поля сливаются с ней. merge() накладывает еще не записанные изменения
+# на прочитанный из базы профиль - пользователь всегда видит свои начисления.
+#
+# Порядок блокировок: сначала lock буфера, потом запись SQLite. Запись пачки выполняется под lock,
+# поэтому чтение под lock никогда не видит пачку дважды (и в базе, и в памяти).
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Set, Tuple
+
+DELTA, SET = 'delta', 'set'
+
+# user_id -> поле -> (операция, значение)
+PendingUpdates = Dict[int, Dict[str, Tuple[str, object]]]
+
+
+class CounterBuffer:
+    """
+    write(updates, achievements) записывает пачку одной транзакцией; вызывается под lock.
+    Если запись не удалась, изменения остаются в буфере до следующей попытки.
+    """
+
+    def __init__(self, write: Callable[[PendingUpdates, Dict[int, Set[str]]], None],
+                 flush_interval: float = 0.5, max_events: int = 500):
+        self.write = write
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self.lock = threading.RLock()
+        self._updates: PendingUpdates = {}
+        self._achievements: Dict[int, Set[str]] = {}
+        self._events = 0
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.counters = {'events': 0, 'flushes': 0, 'rows': 0, 'errors': 0}
+        self.last_flush_ms = 0.0
+
+    def _record(self, user_id: int, fields: dict, op: str):
+        with self.lock:
+            ops = self._updates.setdefault(user_id, {})
+            for field, value in fields.items():
+                current = ops.get(field)
+                if op == SET or current is None:
+                    ops[field] = (op, value)
+                else:
+                    # DELTA после SET - новое значение для SET, DELTA после DELTA - сумма
+                    ops[field] = (current[0], current[1] + value)
+            self._added(len(fields))
+
+    def _added(self, count: int):
+        self._events += count
+        self.counters['events'] += count
+        if self._events >= self.max_events:
+            self._wake.set()
+
+    def add(self, user_id: int, deltas: dict):
+        """Прибавить к счетчикам: {'quarterly_points': 10, ...}."""
+        self._record(user_id, deltas, DELTA)
+
+    def set(self, user_id: int, fields: dict):
+        """Установить поля: {'quiz_correct_streak': 0, 'last_quiz_date': '...'}."""
+        self._record(user_id, fields, SET)
+
+    def grant(self, user_id: int, achievement_id: str):
+        with self.lock:
+            self._achievements.setdefault(user_id, set()).add(achievement_id)
+            self._added(1)
+
+    def merge(self, user_id: int, profile: dict) -> dict:
+        """Профиль из базы с еще не записанными изменениями (вызывать под lock вместе с чтением из базы)."""
+        with self.lock:
+            for field, (op, value) in self._updates.get(user_id, {}).items():
+                profile[field] = value if op == SET else (profile.get(field) or 0) + value
+        return profile
+
+    def granted(self, user_id: int) -> Set[str]:
+        with self.lock:
+            return set(self._achievements.get(user_id, ()))
+
+    def flush(self, on_commit: Callable[[Callable[[], None]], None] | None = None) -> int:
+        """
+        Записывает все накопленное одной транзакцией; возвращает число записанных изменений.
+        on_commit(callback) - запись идет внутри внешней транзакции: буфер очищается только после
+        ее COMMIT (при откате изменения остаются в буфере). Вызывающий держит lock до COMMIT.
+        """
+        with self.lock:
+            if not self._events:
+                return 0
+            started = time.perf_counter()
+            try:
+                self.write(self._updates, self._achievements)
+            except Exception:
+                self.counters['errors'] += 1
+                raise
+            events, rows = self._events, len(self._updates) + sum(map(len, self._achievements.values()))
+
+            def written():
+                self._updates, self._achievements, self._events = {}, {}, 0
+                self.counters['flushes'] += 1
+                self.counters['rows'] += rows
+                self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+            if on_commit is None:
+                written()
+            else:
+                on_commit(written)
+            return events
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Не удалось записать буфер счетчиков (повторю через {self.flush_interval} с): {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='counter-buffer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Останавливает фоновую запись и записывает остаток. Повторный вызов безопасен."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self.lock:
+            pending = self._events
+        return {**self.counters, 'pending': pending, 'last_flush_ms': round(self.last_flush_ms, 2)}
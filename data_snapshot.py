@@ -0,0 +1,138 @@
+# data_snapshot.py
+# Горячая перезагрузка данных без перезапуска бота.
+# Все данные (пункты, база знаний, факты, советы, модель намерений) и индексы по ним собраны в один неизменяемый
+# снимок DataSnapshot. Обработчик берет snapshots.current один раз в начале запроса и работает
+# с ним до конца, поэтому подмена снимка не ломает запросы "на лету".
+#
+# SnapshotManager следит за временем изменения файлов (или получает SIGHUP), собирает новый снимок
+# в фоновом потоке и подменяет ссылку одной операцией присваивания. Если новый файл не разобрался,
+# остается прежний снимок, а ошибка пишется в лог.
+
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from data_store import KnowledgeEntry
+from gazetteer import Gazetteer
+from intent_model import IntentModel
+from knowledge_index import KnowledgeIndex
+from knowledge_ranker import KnowledgeRanker
+from points_index import PointsIndex
+
+
+class DataSnapshot(NamedTuple):
+    points: PointsIndex
+    gazetteer: Gazetteer
+    knowledge: List[KnowledgeEntry]
+    kb_index: KnowledgeIndex
+    kb_ranker: KnowledgeRanker
+    facts: Tuple[str, ...]
+    tips: Tuple[str, ...]
+    intent_model: IntentModel | None = None
+    version: int = 0
+
+
+# builder(прежний снимок или None, имена изменившихся частей) -> новый снимок
+SnapshotBuilder = Callable[[Optional[DataSnapshot], Set[str]], DataSnapshot]
+
+
+class SnapshotManager:
+    """
+    watched: часть снимка -> файлы, от которых она зависит (например, 'points' -> CSV и кэш геокодирования).
+    builder пересобирает только изменившиеся части, остальные берет из прежнего снимка.
+    """
+
+    def __init__(self, watched: Dict[str, Sequence[str]], builder: SnapshotBuilder,
+                 on_swap: Callable[[DataSnapshot, Set[str]], None] | None = None):
+        self.watched = {name: list(paths) for name, paths in watched.items()}
+        self.builder = builder
+        self.on_swap = on_swap
+        self._current: DataSnapshot | None = None
+        self._build_lock = threading.Lock()
+        self._loaded_mtimes: Dict[str, tuple] = {}
+        self._failed_mtimes: Dict[str, tuple] = {}  # сломанные версии файлов: не разбираем их повторно
+        self._seen_mtimes: Dict[str, tuple] = {}
+        self.reloads = 0
+        self.failures = 0
+
+    @property
+    def current(self) -> DataSnapshot | None:
+        return self._current
+
+    def _mtimes(self) -> Dict[str, tuple]:
+        result = {}
+        for name, paths in self.watched.items():
+            result[name] = tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None for path in paths)
+        return result
+
+    def load(self) -> DataSnapshot:
+        """Первая загрузка, синхронно."""
+        self._rebuild(set(self.watched))
+        return self._current
+
+    def reload(self, names: Set[str] | None = None, wait: bool = False):
+        """Пересобрать снимок в фоне: names - какие части (None - все)."""
+        thread = threading.Thread(target=self._rebuild, args=(set(names) if names is not None else set(self.watched),),
+                                  name='snapshot-reload', daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+
+    def check_for_changes(self):
+        """
+        Вызывается периодически (планировщиком). Часть перезагружается, когда время изменения ее файлов
+        отличается от загруженного и не менялось с прошлой проверки - так не читаем файл, который еще пишется.
+        """
+        mtimes = self._mtimes()
+        changed = {name for name, value in mtimes.items()
+                   if value != self._loaded_mtimes.get(name) and value != self._failed_mtimes.get(name)
+                   and value == self._seen_mtimes.get(name)}
+        self._seen_mtimes = mtimes
+        if changed:
+            logging.info(f"Изменились файлы данных: {', '.join(sorted(changed))}. Перезагружаю снимок...")
+            self.reload(changed)
+
+    def install_signal_handler(self):
+        """SIGHUP - перечитать все файлы (kill -HUP <pid>). Вызывать из главного потока."""
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.reload())
+
+    def _rebuild(self, names: Set[str]):
+        with self._build_lock:
+            mtimes = self._mtimes()
+            if not self._build(names, mtimes) and len(names) > 1 and self._current is not None:
+                # Какая из частей сломана, неизвестно: собираем по одной, чтобы исправные не ждали следующей правки
+                for name in sorted(names):
+                    self._build({name}, mtimes)
+
+    def _build(self, names: Set[str], mtimes: Dict[str, tuple]) -> bool:
+        previous = self._current
+        started = time.perf_counter()
+        try:
+            snapshot = self.builder(previous, names)
+        except Exception as e:
+            self.failures += 1
+            if len(names) == 1 or previous is None:
+                # Запоминаем время изменения, чтобы не разбирать тот же сломанный файл на каждой проверке
+                self._failed_mtimes.update({name: mtimes[name] for name in names})
+            logging.error(f"❌ Не удалось пересобрать данные ({', '.join(sorted(names))}), остается снимок "
+                          f"v{previous.version if previous else 0}: {e}", exc_info=True)
+            return False
+        snapshot = snapshot._replace(version=(previous.version + 1) if previous else 1)
+        self._current = snapshot  # атомарная подмена ссылки: новые запросы сразу видят новый снимок
+        for name in names:
+            self._loaded_mtimes[name] = mtimes[name]
+            self._failed_mtimes.pop(name, None)
+        if previous is not None:
+            self.reloads += 1
+            logging.info(f"✅ Снимок данных v{snapshot.version} собран за {(time.perf_counter() - started) * 1000:.0f} мс "
+                         f"({', '.join(sorted(names))}).")
+        if self.on_swap:
+            self.on_swap(snapshot, names)
+        return True
+
+    def stats(self) -> dict:
+        return {'version': self._current.version if self._current else 0, 'reloads': self.reloads, 'failures': self.failures}
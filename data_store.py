@@ -0,0 +1,72 @@
+# data_store.py
+# Загрузка данных бота без pandas: пункты приема, база знаний, факты и советы.
+# Записи - неизменяемые NamedTuple (без словаря на каждый объект), списки текстов - кортежи.
+# Индексы поверх записей строят points_index, knowledge_index и knowledge_ranker.
+
+import csv
+import json
+import logging
+from typing import List, NamedTuple, Tuple
+
+POINT_COLUMNS = ('name', 'city', 'address', 'accepts', 'work_hours', 'phone_number', 'website')
+
+
+class RecyclingPoint(NamedTuple):
+    name: str
+    city: str
+    address: str
+    accepts: str
+    work_hours: str
+    phone_number: str
+    website: str
+    lat: float | None = None
+    lon: float | None = None
+    distance_km: float | None = None  # заполняется только в копиях для выдачи (см. points_index.with_distance)
+
+
+class KnowledgeEntry(NamedTuple):
+    question: str
+    answer: str
+    context_keyword: str | None = None
+
+
+def _coordinate(value: str | None) -> float | None:
+    try:
+        return float(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def load_points(path: str) -> List[RecyclingPoint]:
+    """
+    Читает recycling_points.csv. Колонки берутся из заголовка файла, lat/lon необязательны;
+    повторные строки заголовка и строки без города пропускаются.
+    """
+    points = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            if row.get('name') == 'name':
+                continue
+            values = [(row.get(column) or '').strip() for column in POINT_COLUMNS]
+            if not values[1]:
+                continue
+            points.append(RecyclingPoint(*values, lat=_coordinate(row.get('lat')), lon=_coordinate(row.get('lon'))))
+    return points
+
+
+def load_knowledge(path: str) -> List[KnowledgeEntry]:
+    with open(path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    entries = []
+    for item in raw:
+        if not item.get('question') or not item.get('answer'):
+            logging.warning(f"Запись базы знаний без вопроса или ответа пропущена: {str(item)[:80]}")
+            continue
+        entries.append(KnowledgeEntry(item['question'], item['answer'], item.get('context_keyword') or None))
+    return entries
+
+
+def load_texts(path: str) -> Tuple[str, ...]:
+    """Список строк из JSON (interesting_facts.json, eco_tips.json)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return tuple(str(text) for text in json.load(f))
@@ -0,0 +1,95 @@
+# db_connection.py
+# Соединения с SQLite для db_manager: у каждого потока (полосы обработчиков, планировщик) одно
+# долгоживущее соединение вместо connect/commit/close на каждый запрос.
+#   - WAL: чтение не ждет записи, а запись не блокирует читателей;
+#   - synchronous=NORMAL: в WAL fsync только при контрольной точке, а не на каждый commit;
+#   - busy_timeout: конкурирующая запись ждет освобождения базы, а не падает сразу с "database is locked";
+#   - cached_statements: подготовленные выражения живут вместе с соединением и не разбираются заново.
+# Одиночные запросы выполняются в режиме автокоммита; несколько запросов, которые должны
+# примениться вместе, - внутри transaction().
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionManager:
+    def __init__(self, path: str, busy_timeout: float = 5.0, cached_statements: int = 256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока; создается при первом обращении. Закрывать его не нужно."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False, cached_statements=self.cached_statements)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout * 1000)}')
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate: bool = True):
+        """
+        with db.transaction() as conn: ... - все запросы внутри применяются вместе или не применяются вовсе.
+        immediate - сразу захватить запись (BEGIN IMMEDIATE): прочитанное внутри не изменится до COMMIT.
+        Вложенный transaction() становится частью внешней транзакции.
+        """
+        conn = self.connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        self._local.depth = 1
+        self._local.after_commit = []
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            self._local.depth = 0
+            callbacks, self._local.after_commit = self._local.after_commit, []
+        for callback in callbacks:
+            callback()
+
+    def depth(self) -> int:
+        """Вложенность transaction() в текущем потоке: 0 - вне транзакции, 1 - внешняя транзакция."""
+        return getattr(self._local, 'depth', 0)
+
+    def after_commit(self, callback):
+        """
+        callback() после COMMIT текущей транзакции потока (сразу, если транзакции нет); при откате не вызывается.
+        Для кэшей поверх базы: сброшенный до COMMIT кэш успел бы снова заполниться старыми данными.
+        """
+        if self.depth():
+            self._local.after_commit.append(callback)
+        else:
+            callback()
+
+    def close_all(self):
+        """Закрывает соединения всех потоков (при остановке бота или в тестовых скриптах)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
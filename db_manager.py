@@ -1,196 +1,341 @@
-# db_manager.py 
+# db_manager.py
 
-import sqlite3
+import atexit
+import json
+from contextlib import contextmanager, nullcontext
 from datetime import date
 from config import DB_PATH
+import config
+from counter_buffer import DELTA, CounterBuffer
+from db_connection import ConnectionManager
+from leaderboard import LeaderboardCache
+
+# Сколько секунд запись ждет, пока базу держит другой поток (или скрипт вроде reset_quarter.py)
+DB_BUSY_TIMEOUT = getattr(config, 'DB_BUSY_TIMEOUT', 5)
+# Сколько первых строк таблицы лидеров держать в памяти и сколько секунд им доверять
+LEADERBOARD_CACHE_SIZE = getattr(config, 'LEADERBOARD_CACHE_SIZE', 10)
+LEADERBOARD_CACHE_TTL = getattr(config, 'LEADERBOARD_CACHE_TTL', 60)
+
+_connections = ConnectionManager(DB_PATH, busy_timeout=DB_BUSY_TIMEOUT)
+_buffer: CounterBuffer | None = None  # отложенная запись профилей, см. enable_write_behind
 
 def get_connection():
-    """Возвращает соединение с базой данных."""
-    conn = sqlite3.connect(DB_PATH)
-    return conn
+    """Возвращает соединение текущего потока (долгоживущее, закрывать не нужно)."""
+    return _connections.connection()
 
-def init_db():
-    """Инициализирует базу данных и создает таблицы, если их нет."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # ... (таблицы user_challenges, subscribers без изменений) ...
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_challenges (
-            user_id INTEGER PRIMARY KEY,
-            challenge_id TEXT NOT NULL,
-            start_date TEXT NOT NULL
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS subscribers (
-            user_id INTEGER PRIMARY KEY
-        )
-    ''')
+@contextmanager
+def transaction(immediate: bool = True):
+    """
+    with db.transaction() as conn: несколько запросов одной транзакцией.
+    Если при отложенной записи внутри были изменения через буфер, накопленное записывается в эту же
+    транзакцию перед COMMIT: запрос к базе и начисление (завершение челленджа и его очки) применяются вместе.
+    """
+    buffer = _buffer
+    # При отложенной записи сначала блокировка буфера, потом запись SQLite - тот же порядок, что и у flush
+    with (buffer.lock if buffer else nullcontext()), _connections.transaction(immediate) as conn:
+        events = buffer.counters['events'] if buffer else 0
+        yield conn
+        if buffer is not None and _connections.depth() == 1 and buffer.counters['events'] != events:
+            buffer.flush(on_commit=_connections.after_commit)
 
-    # ### ОБНОВЛЕННАЯ ТАБЛИЦА ПРОФИЛЕЙ ###
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_profiles (
-            user_id INTEGER PRIMARY KEY,
-            total_points INTEGER DEFAULT 0,
-            quarterly_points INTEGER DEFAULT 0,
-            level INTEGER DEFAULT 1,
-            
-            recycle_report_count INTEGER DEFAULT 0,
-            last_recycle_report_date TEXT,
-            recycle_streak_count INTEGER DEFAULT 0,
-            
-            challenges_completed_count INTEGER DEFAULT 0,
-            
-            last_quiz_date TEXT,
-            quiz_correct_streak INTEGER DEFAULT 0,
-            
-            last_tip_date TEXT,
-            
-            -- Реферальная система
-            referred_by INTEGER,
-            referrals_count INTEGER DEFAULT 0,
-            referrer_bonus_given INTEGER DEFAULT 0 -- 0 = нет, 1 = да
-        )
-    ''')
-    
-    # ... (таблица user_achievements без изменений) ...
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_achievements (
-            user_id INTEGER NOT NULL,
-            achievement_id TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (user_id, achievement_id)
+def profile_lock():
+    """
+    Чтение-изменение-запись профиля (gamification.apply_event): транзакция SQLite, а при отложенной
+    записи - только блокировка буфера: изменения уходят в буфер и попадают в базу со следующей пачкой
+    (или в COMMIT внешнего db.transaction()).
+    """
+    return _buffer.lock if _buffer else transaction()
+
+# --- ОТЛОЖЕННАЯ ЗАПИСЬ ПРОФИЛЕЙ ---
+def enable_write_behind(flush_interval: float = 0.5, max_events: int = 500) -> CounterBuffer:
+    """
+    Изменения профилей и достижений копятся в памяти и пишутся пачкой (counter_buffer.py).
+    Остаток записывается при выходе из процесса; при остановке бота - stop_write_behind().
+    """
+    global _buffer
+    if _buffer is None:
+        _buffer = CounterBuffer(_write_buffered, flush_interval, max_events)
+        _buffer.start()
+        atexit.register(stop_write_behind)
+    return _buffer
+
+def stop_write_behind():
+    """Записывает накопленное и возвращает прямую запись."""
+    global _buffer
+    buffer, _buffer = _buffer, None
+    if buffer is not None:
+        buffer.stop()
+
+def write_behind_stats() -> dict | None:
+    return _buffer.stats() if _buffer else None
+
+def _write_buffered(updates: dict, achievements: dict):
+    """Пачка из буфера: один UPDATE на набор полей (executemany), достижения - одним INSERT."""
+    batches = {}
+    for user_id, ops in updates.items():
+        fields = tuple(sorted(ops))
+        signature = tuple((field, ops[field][0]) for field in fields)
+        batches.setdefault(signature, []).append((*(ops[field][1] for field in fields), user_id))
+    with _connections.transaction() as conn:
+        for signature, rows in batches.items():
+            set_clause = ", ".join(f"{field} = {field} + ?" if op == DELTA else f"{field} = ?" for field, op in signature)
+            conn.executemany(f"UPDATE user_profiles SET {set_clause} WHERE user_id = ?", rows)
+        conn.executemany("INSERT OR IGNORE INTO user_achievements (user_id, achievement_id) VALUES (?, ?)",
+                         [(user_id, ach_id) for user_id, ach_ids in achievements.items() for ach_id in ach_ids])
+    for user_id, ops in updates.items():
+        op, value = ops.get('quarterly_points', (None, None))
+        if op is not None:
+            _points_changed(user_id, value if op != DELTA else None)
+
+def _init_points_histogram(conn):
+    """
+    Сколько пользователей набрало каждое число очков за квартал. Место пользователя - сумма по строкам
+    с большим числом очков: их столько, сколько разных значений очков выше (сотни), а не пользователей
+    (миллион). Таблицу ведут триггеры, поэтому она верна при любой записи, в том числе из reset_quarter.py.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'quarterly_points_histogram'").fetchone()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quarterly_points_histogram (
+            points INTEGER PRIMARY KEY,
+            users INTEGER NOT NULL
         )
     ''')
+    if not exists:
+        conn.execute('''
+            INSERT INTO quarterly_points_histogram (points, users)
+            SELECT COALESCE(quarterly_points, 0), COUNT(*) FROM user_profiles GROUP BY COALESCE(quarterly_points, 0)
+        ''')
+    add = '''
+        INSERT INTO quarterly_points_histogram (points, users) VALUES (COALESCE(NEW.quarterly_points, 0), 1)
+            ON CONFLICT(points) DO UPDATE SET users = users + 1;'''
+    remove = '''
+        UPDATE quarterly_points_histogram SET users = users - 1 WHERE points = COALESCE(OLD.quarterly_points, 0);
+        DELETE FROM quarterly_points_histogram WHERE points = COALESCE(OLD.quarterly_points, 0) AND users <= 0;'''
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_points_histogram_insert AFTER INSERT ON user_profiles BEGIN {add} END")
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_points_histogram_update AFTER UPDATE OF quarterly_points ON user_profiles
+                     WHEN COALESCE(OLD.quarterly_points, 0) != COALESCE(NEW.quarterly_points, 0) BEGIN {remove} {add} END''')
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_points_histogram_delete AFTER DELETE ON user_profiles BEGIN {remove} END")
+
+def init_db():
+    """Инициализирует базу данных и создает таблицы, если их нет."""
+    with transaction() as conn:
+        # ... (таблицы user_challenges, subscribers без изменений) ...
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_challenges (
+                user_id INTEGER PRIMARY KEY,
+                challenge_id TEXT NOT NULL,
+                start_date TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS subscribers (
+                user_id INTEGER PRIMARY KEY
+            )
+        ''')
+
+        # ### ОБНОВЛЕННАЯ ТАБЛИЦА ПРОФИЛЕЙ ###
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_profiles (
+                user_id INTEGER PRIMARY KEY,
+                total_points INTEGER DEFAULT 0,
+                quarterly_points INTEGER DEFAULT 0,
+                level INTEGER DEFAULT 1,
+
+                recycle_report_count INTEGER DEFAULT 0,
+                last_recycle_report_date TEXT,
+                recycle_streak_count INTEGER DEFAULT 0,
+
+                challenges_completed_count INTEGER DEFAULT 0,
 
-    conn.commit()
-    conn.close()
+                last_quiz_date TEXT,
+                quiz_correct_streak INTEGER DEFAULT 0,
+
+                last_tip_date TEXT,
+
+                -- Реферальная система
+                referred_by INTEGER,
+                referrals_count INTEGER DEFAULT 0,
+                referrer_bonus_given INTEGER DEFAULT 0 -- 0 = нет, 1 = да
+            )
+        ''')
+
+        # ... (таблица user_achievements без изменений) ...
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_achievements (
+                user_id INTEGER NOT NULL,
+                achievement_id TEXT NOT NULL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, achievement_id)
+            )
+        ''')
+
+        # Таблица лидеров читается по индексу, без сортировки всей таблицы
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_profiles_quarterly ON user_profiles (quarterly_points DESC, user_id)')
+        _init_points_histogram(conn)
+
+        # Имена пользователей для таблицы лидеров (user_names.py); updated_at - время по часам (time.time())
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_names (
+                user_id INTEGER PRIMARY KEY,
+                first_name TEXT,
+                username TEXT,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+        # Заранее сгенерированные вопросы викторины; fact - исходный факт (не больше одного вопроса на факт)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS quiz_pool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fact TEXT NOT NULL UNIQUE,
+                question TEXT NOT NULL,
+                options TEXT NOT NULL, -- JSON-список вариантов
+                correct_option_id INTEGER NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
     print("База данных успешно инициализирована (с полной структурой для геймификации).")
 
 def start_challenge(user_id: int, challenge_id: str):
-    conn = get_connection()
-    cursor = conn.cursor()
     today = date.today().isoformat()
-    cursor.execute('INSERT OR REPLACE INTO user_challenges VALUES (?, ?, ?)', (user_id, challenge_id, today))
-    conn.commit()
-    conn.close()
+    get_connection().execute('INSERT OR REPLACE INTO user_challenges VALUES (?, ?, ?)', (user_id, challenge_id, today))
 
 def get_user_challenge(user_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT challenge_id, start_date FROM user_challenges WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = get_connection().execute('SELECT challenge_id, start_date FROM user_challenges WHERE user_id = ?', (user_id,)).fetchone()
     return {"challenge_id": result[0], "start_date": result[1]} if result else None
 
 def get_all_active_challenges():
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, challenge_id, start_date FROM user_challenges')
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    return get_connection().execute('SELECT user_id, challenge_id, start_date FROM user_challenges').fetchall()
 
 def end_challenge(user_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM user_challenges WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    get_connection().execute('DELETE FROM user_challenges WHERE user_id = ?', (user_id,))
 
 def add_subscriber(user_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO subscribers (user_id) VALUES (?)', (user_id,))
-    conn.commit()
-    conn.close()
+    get_connection().execute('INSERT OR IGNORE INTO subscribers (user_id) VALUES (?)', (user_id,))
 
 def remove_subscriber(user_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM subscribers WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    get_connection().execute('DELETE FROM subscribers WHERE user_id = ?', (user_id,))
 
 def is_subscribed(user_id: int) -> bool:
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM subscribers WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    return get_connection().execute('SELECT 1 FROM subscribers WHERE user_id = ?', (user_id,)).fetchone() is not None
 
 def get_all_subscribers() -> list:
-    conn = get_connection()
-    cursor = conn.cursor()
-    results = cursor.execute('SELECT user_id FROM subscribers').fetchall()
-    conn.close()
+    results = get_connection().execute('SELECT user_id FROM subscribers').fetchall()
     return [row[0] for row in results]
 
 def get_or_create_user_profile(user_id: int, referred_by: int = None):
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM user_profiles WHERE user_id = ?", (user_id,))
-    profile = cursor.fetchone()
-    
-    if not profile:
-        if referred_by:
-            cursor.execute("INSERT INTO user_profiles (user_id, referred_by) VALUES (?, ?)", (user_id, referred_by))
-        else:
-            cursor.execute("INSERT INTO user_profiles (user_id) VALUES (?)", (user_id,))
-        conn.commit()
-        cursor.execute("SELECT * FROM user_profiles WHERE user_id = ?", (user_id,))
-        profile = cursor.fetchone()
-            
-    conn.close()
-    return dict(profile)
+    buffer = _buffer
+    with (buffer.lock if buffer else nullcontext()):
+        profile = get_connection().execute("SELECT * FROM user_profiles WHERE user_id = ?", (user_id,)).fetchone()
+        if not profile:
+            # Вставка и повторное чтение - одной транзакцией: параллельный обработчик не создаст профиль дважды
+            with transaction() as conn:
+                conn.execute("INSERT OR IGNORE INTO user_profiles (user_id, referred_by) VALUES (?, ?)", (user_id, referred_by))
+                profile = conn.execute("SELECT * FROM user_profiles WHERE user_id = ?", (user_id,)).fetchone()
+        return buffer.merge(user_id, dict(profile)) if buffer else dict(profile)
 
 def add_points(user_id: int, points_to_add: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE user_profiles SET total_points = total_points + ?, quarterly_points = quarterly_points + ? WHERE user_id = ?",
-        (points_to_add, points_to_add, user_id)
-    )
-    conn.commit()
-    conn.close()
+    increment_profile_stats(user_id, {'total_points': points_to_add, 'quarterly_points': points_to_add})
+
+def increment_profile_stats(user_id: int, deltas: dict):
+    """Прибавляет к счетчикам профиля: {'recycle_report_count': 1, ...}."""
+    if _buffer:
+        _buffer.add(user_id, deltas)
+        return
+    set_clause = ", ".join([f"{key} = {key} + ?" for key in deltas.keys()])
+    rows = get_connection().execute(f"UPDATE user_profiles SET {set_clause} WHERE user_id = ? RETURNING quarterly_points",
+                                    (*deltas.values(), user_id)).fetchall()
+    if rows and 'quarterly_points' in deltas:
+        _points_changed(user_id, rows[0][0])
 
 def update_profile_stats(user_id: int, fields_to_update: dict):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
+    if _buffer:
+        _buffer.set(user_id, fields_to_update)
+        return
     set_clause = ", ".join([f"{key} = ?" for key in fields_to_update.keys()])
     values = list(fields_to_update.values())
     values.append(user_id)
-    
+
     query = f"UPDATE user_profiles SET {set_clause} WHERE user_id = ?"
-    cursor.execute(query, tuple(values))
-    conn.commit()
-    conn.close()
+    get_connection().execute(query, tuple(values))
+    if 'quarterly_points' in fields_to_update:
+        _points_changed(user_id, fields_to_update['quarterly_points'])
 
 def grant_achievement(user_id: int, achievement_id: str):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO user_achievements (user_id, achievement_id) VALUES (?, ?)", (user_id, achievement_id))
-    conn.commit()
-    conn.close()
+    if _buffer:
+        _buffer.grant(user_id, achievement_id)
+        return
+    get_connection().execute("INSERT OR IGNORE INTO user_achievements (user_id, achievement_id) VALUES (?, ?)", (user_id, achievement_id))
 
 def get_user_achievements(user_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT achievement_id FROM user_achievements WHERE user_id = ?", (user_id,))
-    achievements = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    buffer = _buffer
+    with (buffer.lock if buffer else nullcontext()):
+        results = get_connection().execute("SELECT achievement_id FROM user_achievements WHERE user_id = ?", (user_id,)).fetchall()
+        achievements = [row[0] for row in results]
+        if buffer:
+            achievements += sorted(buffer.granted(user_id) - set(achievements))
     return achievements
-    
+
+def _load_leaderboard(limit: int):
+    leaders = get_connection().execute("SELECT user_id, quarterly_points FROM user_profiles ORDER BY quarterly_points DESC, user_id LIMIT ?", (limit,)).fetchall()
+    return [dict(row) for row in leaders]
+
+_leaderboard = LeaderboardCache(_load_leaderboard, size=LEADERBOARD_CACHE_SIZE, ttl=LEADERBOARD_CACHE_TTL)
+
+def _points_changed(user_id: int, points: int | None):
+    _connections.after_commit(lambda: _leaderboard.points_changed(user_id, points))
+
 def get_leaderboard(limit: int = 5):
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, quarterly_points FROM user_profiles ORDER BY quarterly_points DESC LIMIT ?", (limit,))
-    leaders = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in leaders]
\ No newline at end of file
+    # При отложенной записи таблица отстает от начислений не больше чем на интервал записи буфера
+    return _leaderboard.top(limit)
+
+def get_user_rank(user_id: int):
+    """(место, очки за квартал) пользователя или None, если профиля нет. Одинаковые очки - одно место."""
+    row = get_connection().execute("SELECT quarterly_points FROM user_profiles WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None:
+        return None
+    points = _buffer.merge(user_id, {'quarterly_points': row[0]})['quarterly_points'] if _buffer else row[0]
+    above = get_connection().execute("SELECT COALESCE(SUM(users), 0) FROM quarterly_points_histogram WHERE points > ?", (points,)).fetchone()[0]
+    return above + 1, points
+
+def leaderboard_stats() -> dict:
+    return _leaderboard.stats()
+
+def add_quiz(fact: str, question: str, options: list, correct_option_id: int) -> bool:
+    """Добавляет вопрос в пул викторины; False, если вопрос по этому факту уже есть."""
+    cursor = get_connection().execute("INSERT OR IGNORE INTO quiz_pool (fact, question, options, correct_option_id) VALUES (?, ?, ?, ?)",
+                                      (fact, question, json.dumps(options, ensure_ascii=False), correct_option_id))
+    return cursor.rowcount > 0
+
+def pop_quiz():
+    """Забирает самый старый вопрос из пула одной транзакцией (два обработчика не получат один и тот же)."""
+    with transaction() as conn:
+        row = conn.execute("SELECT id, fact, question, options, correct_option_id FROM quiz_pool ORDER BY id LIMIT 1").fetchone()
+        if row:
+            conn.execute("DELETE FROM quiz_pool WHERE id = ?", (row[0],))
+    if not row:
+        return None
+    return {"fact": row[1], "question": row[2], "options": json.loads(row[3]), "correct_option_id": row[4]}
+
+def count_quizzes() -> int:
+    return get_connection().execute('SELECT COUNT(*) FROM quiz_pool').fetchone()[0]
+
+def get_quiz_pool_facts() -> set:
+    results = get_connection().execute('SELECT fact FROM quiz_pool').fetchall()
+    return {row[0] for row in results}
+
+def save_user_name(user_id: int, first_name: str | None, username: str | None, updated_at: float):
+    get_connection().execute("""
+        INSERT INTO user_names (user_id, first_name, username, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET first_name = excluded.first_name, username = excluded.username,
+                                           updated_at = excluded.updated_at
+    """, (user_id, first_name, username, updated_at))
+
+def get_user_names(user_ids: list) -> dict:
+    """user_id -> (first_name, username, updated_at) для найденных пользователей."""
+    if not user_ids:
+        return {}
+    placeholders = ", ".join("?" * len(user_ids))
+    rows = get_connection().execute(f"SELECT user_id, first_name, username, updated_at FROM user_names WHERE user_id IN ({placeholders})",
+                                    tuple(user_ids)).fetchall()
+    return {row[0]: (row[1], row[2], row[3]) for row in rows}
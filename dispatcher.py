@@ -0,0 +1,155 @@
+# dispatcher.py
+# Раздача обновлений Telegram по "полосам" (lanes): быстрые обработчики (кнопки, профиль, лидеры -
+# чтение SQLite) и обработчики, которые ждут GigaChat по несколько секунд. У каждой полосы свои потоки
+# и своя предельная длина очереди, поэтому медленные вопросы не занимают потоки быстрых кнопок.
+#
+# Если очередь полосы заполнена или у пользователя уже обрабатывается вопрос к GigaChat, обновление
+# не ставится в очередь, а пользователю сразу отвечают (on_reject) - вместо долгого молчания.
+
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from telebot import types
+
+from metrics import LatencySamples
+
+FAST, LLM = 'fast', 'llm'
+QUEUE_FULL, USER_BUSY = 'queue_full', 'user_busy'
+
+
+def update_user_id(update: types.Update) -> int | None:
+    for event in (update.message, update.callback_query, update.edited_message):
+        if event is not None and event.from_user is not None:
+            return event.from_user.id
+    if update.poll_answer is not None and update.poll_answer.user is not None:
+        return update.poll_answer.user.id
+    return None
+
+
+class Lane:
+    """
+    Пул из workers потоков с ограниченной очередью (max_queue ждущих задач).
+    per_user - сколько задач одного пользователя могут быть в полосе одновременно (None - без ограничения).
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int, per_user: int | None = None):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'lane-{name}')
+        self._lock = threading.Lock()
+        self._by_user = Counter()
+        self.waits = LatencySamples()  # время от постановки в очередь до начала обработки
+        self.pending = 0   # в очереди + выполняются
+        self.running = 0
+        self.accepted = 0
+        self.completed = 0
+        self.rejected = Counter()
+        self.max_depth = 0
+
+    def try_submit(self, user_id: int | None, task: Callable[[], None]) -> str | None:
+        """Ставит задачу в очередь; возвращает причину отказа (QUEUE_FULL / USER_BUSY) или None."""
+        with self._lock:
+            if self.pending - self.running >= self.max_queue:
+                reason = QUEUE_FULL
+            elif self.per_user is not None and user_id is not None and self._by_user[user_id] >= self.per_user:
+                reason = USER_BUSY
+            else:
+                reason = None
+                self.pending += 1
+                self.accepted += 1
+                self.max_depth = max(self.max_depth, self.pending - self.running)
+                if user_id is not None:
+                    self._by_user[user_id] += 1
+            if reason:
+                self.rejected[reason] += 1
+                return reason
+        self._executor.submit(self._run, user_id, task, time.monotonic())
+        return None
+
+    def _run(self, user_id: int | None, task: Callable[[], None], enqueued_at: float):
+        self.waits.add(time.monotonic() - enqueued_at)
+        with self._lock:
+            self.running += 1
+        try:
+            task()
+        except Exception as e:
+            logging.error(f"Ошибка в полосе {self.name}: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.pending -= 1
+                self.completed += 1
+                if user_id is not None:
+                    self._by_user[user_id] -= 1
+                    if self._by_user[user_id] <= 0:
+                        del self._by_user[user_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {'queued': self.pending - self.running, 'running': self.running, 'max_depth': self.max_depth,
+                      'accepted': self.accepted, 'completed': self.completed, 'rejected': dict(self.rejected)}
+        result['wait'] = self.waits.summary()
+        return result
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+class Dispatcher:
+    """
+    classify(update) -> имя полосы; on_reject(update, имя полосы, причина) отвечает пользователю,
+    если полоса не приняла обновление. Обновления, которые не удалось классифицировать, идут в default.
+    """
+
+    def __init__(self, lanes: Dict[str, Lane], classify: Callable[[types.Update], str],
+                 on_reject: Callable[[types.Update, str, str], None] | None = None, default: str = FAST):
+        self.lanes = lanes
+        self.classify = classify
+        self.on_reject = on_reject
+        self.default = default
+
+    def submit(self, update: types.Update, process: Callable[[types.Update], None]):
+        try:
+            lane_name = self.classify(update)
+        except Exception as e:
+            logging.error(f"Не удалось классифицировать обновление {update.update_id}: {e}")
+            lane_name = self.default
+        lane = self.lanes.get(lane_name) or self.lanes[self.default]
+        reason = lane.try_submit(update_user_id(update), lambda: process(update))
+        if reason and self.on_reject:
+            try:
+                self.on_reject(update, lane.name, reason)
+            except Exception as e:
+                logging.error(f"Не удалось ответить на отклоненное обновление: {e}")
+
+    def install(self, bot):
+        """
+        Подменяет bot.process_new_updates: каждое обновление уходит в свою полосу, а поток polling
+        сразу возвращается за следующими. Бот должен работать с threaded=False - обработчики
+        выполняются в потоках полос, а не в собственном пуле TeleBot.
+        """
+        process_updates = bot.process_new_updates
+
+        def process_new_updates(updates):
+            for update in updates:
+                # offset следующего getUpdates считается от last_update_id: сдвигаем его сразу,
+                # иначе обновления, которые еще ждут в очереди, придут повторно
+                if update.update_id > bot.last_update_id:
+                    bot.last_update_id = update.update_id
+                self.submit(update, lambda u: process_updates([u]))
+
+        bot.threaded = False
+        bot.process_new_updates = process_new_updates
+
+    def stats(self) -> dict:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+    def shutdown(self, wait: bool = True):
+        for lane in self.lanes.values():
+            lane.shutdown(wait)
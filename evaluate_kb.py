@@ -0,0 +1,45 @@
+# evaluate_kb.py
+# Офлайн-оценка поиска по базе знаний: прогоняет пачку запросов через BM25-ранжировщик
+# и печатает скорость и точность top-1 / top-k.
+#
+# Запуск:
+#   python evaluate_kb.py                      # вопросы самой базы (каждый должен найти сам себя)
+#   python evaluate_kb.py queries.jsonl 10     # {"query": "...", "question": "ожидаемый вопрос из базы"}
+import json
+import sys
+import time
+
+from data_store import load_knowledge
+from text_normalizer import STOP_WORDS
+from knowledge_ranker import KnowledgeRanker
+
+KB_PATH = './data/knowledge_base.json'
+
+knowledge_base = load_knowledge(KB_PATH)
+
+queries_path = sys.argv[1] if len(sys.argv) > 1 else None
+k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+if queries_path:
+    with open(queries_path, 'r', encoding='utf-8') as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+else:
+    cases = [{"query": item.question, "question": item.question} for item in knowledge_base]
+
+started = time.perf_counter()
+ranker = KnowledgeRanker(knowledge_base, STOP_WORDS)
+print(f"Индекс построен за {(time.perf_counter() - started) * 1000:.1f} мс: {len(ranker)} записей, {len(ranker.vocabulary)} терминов.")
+
+started = time.perf_counter()
+results = ranker.search_batch([case['query'] for case in cases], k=k)
+elapsed = time.perf_counter() - started
+
+top1 = topk = 0
+for case, ranked in zip(cases, results):
+    found = [knowledge_base[entry_id].question.lower() for entry_id, _ in ranked]
+    expected = case.get('question', '').lower()
+    top1 += bool(found) and found[0] == expected
+    topk += expected in found
+
+print(f"Запросов: {len(cases)}, время: {elapsed * 1000:.1f} мс ({len(cases) / max(elapsed, 1e-9):.0f} запросов/с)")
+print(f"Точность top-1: {top1 / max(len(cases), 1):.1%}, top-{k}: {topk / max(len(cases), 1):.1%}")
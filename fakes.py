@@ -0,0 +1,191 @@
+# fakes.py
+# Офлайн-заменители внешних сервисов для нагрузочного теста (load_test.py) и ручных проверок:
+#   FakeBotAPI   - Bot API в том же процессе: перехватывает все запросы TeleBot (apihelper.CUSTOM_REQUEST_SENDER),
+#                  записывает их и отвечает правдоподобными объектами;
+#   FakeGigaChat - вместо GigaChatSyncClient: chat/stream с заданным распределением задержек и заготовленными ответами;
+#   install_config - модуль config для bot_polling/db_manager без настоящих ключей.
+# Сеть не нужна: после install() ни один запрос TeleBot не уходит наружу.
+
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import types
+from collections import Counter
+from typing import Callable
+
+import httpx
+from telebot import apihelper
+
+
+class Latency:
+    """Логнормальная задержка с медианой median (сек) и разбросом sigma; sigma=0 - всегда median."""
+
+    def __init__(self, median: float = 0.0, sigma: float = 0.0, rng: random.Random | None = None):
+        self.median = median
+        self.sigma = sigma
+        self._rng = rng or random.Random()
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self.sigma * self._rng.gauss(0, 1)) if self.sigma else self.median
+
+    def sleep(self):
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+
+
+def install_config(data_dir: str, work_dir: str, **overrides) -> types.ModuleType:
+    """
+    Подкладывает в sys.modules модуль config: данные из data_dir, база и кэши - в work_dir.
+    Вызывать до импорта bot_polling и db_manager.
+    """
+    config = types.ModuleType('config')
+    config.BASE_DIR = os.path.dirname(os.path.abspath(data_dir))
+    config.GIGACHAT_API_KEY = 'offline'
+    config.TELEGRAM_TOKEN = '123456:offline'
+    config.KNOLEDGE_BASE_PATH = os.path.join(data_dir, 'knowledge_base.json')
+    config.RECYCLING_POINTS_PATH = os.path.join(data_dir, 'recycling_points.csv')
+    config.INTERESTING_FACTS_PATH = os.path.join(data_dir, 'interesting_facts.json')
+    config.ECO_TIPS_PATH = os.path.join(data_dir, 'eco_tips.json')
+    config.DB_PATH = os.path.join(work_dir, 'eco_bot.db')
+    config.FALLBACK_POINTS = {'курган': {'name': 'Экотехнопарк', 'address': 'ул. Промышленная, 1',
+                                         'phone': '+7 000 000-00-00', 'note': 'Уточняйте прием по телефону.'}}
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    sys.modules['config'] = config
+    return config
+
+
+# --- TELEGRAM ---
+class _Response:
+    status_code = 200
+    reason = 'OK'
+
+    def __init__(self, result):
+        self.text = json.dumps({'ok': True, 'result': result}, ensure_ascii=False)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeBotAPI:
+    """
+    Записывает вызовы Bot API (calls - счетчик по методам, last - последние вызовы) и отвечает на них.
+    latency - задержка одного запроса (сеть до api.telegram.org).
+    """
+
+    def __init__(self, latency: Latency | None = None, keep_last: int = 100):
+        self.latency = latency or Latency()
+        self.calls = Counter()
+        self.last = []
+        self.keep_last = keep_last
+        self.polls = []  # (poll_id, chat_id) отправленных опросов - для синтетических ответов на них
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def install(self):
+        apihelper.CUSTOM_REQUEST_SENDER = self.send
+
+    def send(self, method, url, params=None, files=None, **kwargs):
+        name = url.rsplit('/', 1)[-1]
+        params = dict(params or {})
+        self.latency.sleep()
+        with self._lock:
+            self.calls[name] += 1
+            self.last.append((name, params))
+            del self.last[:-self.keep_last]
+            message_id = next(self._ids)
+        chat_id = int(params.get('chat_id', 0) or 0)
+        chat = {'id': chat_id, 'type': 'private'}
+        if name in ('sendMessage', 'editMessageText'):
+            return _Response({'message_id': message_id, 'date': int(time.time()), 'chat': chat, 'text': params.get('text', '')})
+        if name == 'sendPoll':
+            poll_id = f'poll{message_id}'
+            options = json.loads(params.get('options', '[]'))
+            with self._lock:
+                self.polls.append((poll_id, chat_id))
+            return _Response({'message_id': message_id, 'date': int(time.time()), 'chat': chat, 'poll': {
+                'id': poll_id, 'question': params.get('question', ''), 'total_voter_count': 0, 'is_closed': False,
+                'is_anonymous': False, 'type': 'quiz', 'allows_multiple_answers': False,
+                'options': [{'text': option if isinstance(option, str) else option.get('text', ''), 'voter_count': 0,
+                             'persistent_id': str(i)} for i, option in enumerate(options)]}})
+        if name == 'getMe':
+            return _Response({'id': 1, 'is_bot': True, 'first_name': 'EcoBot', 'username': 'eco_bot'})
+        if name == 'getChat':
+            return _Response({'id': chat_id, 'type': 'private', 'first_name': f'User{chat_id}'})
+        if name == 'getUpdates':
+            return _Response([])
+        return _Response(True)
+
+    def take_poll(self) -> tuple | None:
+        with self._lock:
+            return self.polls.pop(0) if self.polls else None
+
+
+# --- GIGACHAT ---
+def canned_response(payload) -> str:
+    """Ответ по виду запроса бота: намерение, JSON маршрутизатора, вопрос викторины или обычный ответ."""
+    system = payload.messages[0].content if payload.messages else ''
+    question = payload.messages[-1].content if payload.messages else ''
+    if 'определить намерение' in system:
+        return 'GENERAL'
+    if 'JSON' in system:
+        return json.dumps({'intent': 'GENERAL', 'answer': 'Коротко: это важно для экологии.', 'material': '', 'city': ''},
+                          ensure_ascii=False)
+    if 'викторин' in question:
+        return ("Вопрос: Сколько раз можно переработать ПЭТ-бутылку?\nВерный ответ: До 35 раз\n"
+                "Неверный ответ 1: Один раз\nНеверный ответ 2: Ни разу\nНеверный ответ 3: Бесконечно")
+    return ("Хороший вопрос! Если коротко, бережное отношение к ресурсам снижает нагрузку на природу. "
+            "Сортируйте отходы и сдавайте вторсырье в пункты приема.")
+
+
+class FakeGigaChat:
+    """
+    Заменитель GigaChatSyncClient. latency - время полного ответа chat(); для stream() - ttft до первого
+    фрагмента, дальше фрагменты по словам с равными паузами. error_rate - доля вызовов с ошибкой сети.
+    """
+
+    def __init__(self, latency: Latency | None = None, ttft: Latency | None = None,
+                 respond: Callable = canned_response, error_rate: float = 0.0, rng: random.Random | None = None):
+        self.latency = latency or Latency()
+        self.ttft = ttft or Latency()
+        self.respond = respond
+        self.error_rate = error_rate
+        self._rng = rng or random.Random()
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _maybe_fail(self):
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise httpx.ConnectError('fake GigaChat: соединение сброшено')
+
+    def chat(self, payload):
+        with self._lock:
+            self.calls['chat'] += 1
+        total = self.latency.sample()
+        time.sleep(total)
+        self._maybe_fail()
+        message = types.SimpleNamespace(content=self.respond(payload), role='assistant')
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message, finish_reason='stop')])
+
+    def stream(self, payload):
+        with self._lock:
+            self.calls['stream'] += 1
+        text = self.respond(payload)
+        words = text.split(' ')
+        first = self.ttft.sample()
+        rest = max(0.0, self.latency.sample() - first) / max(1, len(words))
+        time.sleep(first)
+        self._maybe_fail()
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(rest)
+            delta = types.SimpleNamespace(content=word if i == len(words) - 1 else word + ' ', role='assistant')
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
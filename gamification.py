@@ -0,0 +1,167 @@
+# gamification.py
+# Начисление Эко-Очков. Одно событие (отчет о сдаче, верный ответ викторины, завершенный челлендж...)
+# применяется целиком: статистика профиля, очки, уровень, достижения вместе с их очками и бонус
+# пригласившему. Профиль и достижения читаются один раз, все изменения считаются в памяти
+# и записываются в конце события - параллельные события не теряют начисления друг друга.
+# При прямой записи событие - одна транзакция SQLite. При отложенной (counter_buffer.py) - изменения
+# буфера под его блокировкой: в базу они попадают одной пачкой, но позже; до записи пачки событие
+# может потеряться при аварийном завершении процесса. Событие, которое должно записаться вместе
+# с другим запросом к базе, оборачивается в db.transaction() - буфер записывается в ту же транзакцию.
+#
+# Счетчики (COUNTER_FIELDS) записываются приращением, а не новым значением: так они складываются
+# с изменениями, сделанными в обход движка (reset_quarter.py), и с отложенной записью (counter_buffer.py).
+#
+# Внутри транзакции ничего не отправляется: apply_event возвращает EventResult со списком уведомлений,
+# бот отправляет их после COMMIT (см. send_notifications в bot_polling.py).
+
+from typing import Callable, List, NamedTuple, Sequence
+
+import db_manager as db
+
+POINTS_FOR_ACHIEVEMENT = 20
+POINTS_FOR_INVITE = 30
+REFERRAL_THRESHOLD = 50  # сколько очков должен набрать приглашенный, чтобы пригласивший получил бонус
+
+LEVELS = {
+    1: {"name": "Новичок", "min_points": 0}, 2: {"name": "Осознанный житель", "min_points": 100},
+    3: {"name": "Эко-активист", "min_points": 250}, 4: {"name": "Страж Природы", "min_points": 500},
+    5: {"name": "Эко-Воин", "min_points": 1000},
+}
+ACHIEVEMENTS = {
+    'first_steps': 'Первые шаги', 'recycler_adept': 'Сортировщик-любитель',
+    'paper_master': 'Магистр макулатуры', 'plastic_lord': 'Повелитель пластика',
+    'eco_erudite': 'Эко-Эрудит', 'marathoner': 'Марафонец',
+    'mentor': 'Наставник', 'perfectionist': 'Перфекционист',
+}
+# Условия выдачи: достижение, поле профиля, порог
+ACHIEVEMENT_RULES = [
+    ('first_steps', 'total_points', 10),
+    ('recycler_adept', 'recycle_report_count', 10),
+    ('eco_erudite', 'quiz_correct_streak', 10),
+    ('marathoner', 'challenges_completed_count', 3),
+    ('mentor', 'referrals_count', 1),
+    ('perfectionist', 'recycle_streak_count', 7),
+]
+
+# Поля профиля, которые только растут (кроме квартального сброса) - пишутся приращением
+COUNTER_FIELDS = ('total_points', 'quarterly_points', 'recycle_report_count', 'challenges_completed_count', 'referrals_count')
+
+# Виды уведомлений
+POINTS, LEVEL_UP, REFERRAL = 'points', 'level_up', 'referral'
+
+
+class Award(NamedTuple):
+    points: int
+    reason: str
+
+
+class Notification(NamedTuple):
+    user_id: int
+    kind: str                       # POINTS, LEVEL_UP или REFERRAL
+    points: int = 0
+    reason: str = ''
+    level: int = 0                  # LEVEL_UP: новый уровень
+    friend_id: int | None = None    # REFERRAL: приглашенный, который набрал REFERRAL_THRESHOLD очков
+
+
+class EventResult(NamedTuple):
+    applied: bool                   # False - update отказался от события (например, отчет сегодня уже был)
+    profile: dict                   # профиль пользователя после события
+    notifications: List[Notification]
+
+
+def level_for(points: int) -> int:
+    return max(level for level, info in LEVELS.items() if points >= info["min_points"])
+
+
+class _UserState:
+    """Профиль и достижения одного пользователя внутри транзакции; изменения копятся и пишутся в save()."""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.profile = db.get_or_create_user_profile(user_id)
+        self.original = dict(self.profile)
+        self.achievements = set(db.get_user_achievements(user_id))
+        self.changed = {}
+        self.granted = []
+
+    def set(self, fields: dict):
+        self.profile.update(fields)
+        self.changed.update(fields)
+
+    def save(self):
+        deltas = {field: self.profile[field] - (self.original[field] or 0)
+                  for field in COUNTER_FIELDS if field in self.changed and self.profile[field] != self.original[field]}
+        fields = {field: value for field, value in self.changed.items() if field not in COUNTER_FIELDS}
+        if deltas:
+            db.increment_profile_stats(self.user_id, deltas)
+        if fields:
+            db.update_profile_stats(self.user_id, fields)
+        for ach_id in self.granted:
+            db.grant_achievement(self.user_id, ach_id)
+
+
+def _award(state: _UserState, award: Award, notifications: list, kind: str = POINTS, friend_id: int | None = None):
+    profile = state.profile
+    state.set({'total_points': profile['total_points'] + award.points,
+               'quarterly_points': profile['quarterly_points'] + award.points})
+    notifications.append(Notification(state.user_id, kind, award.points, award.reason, friend_id=friend_id))
+    _check_progress(state, notifications)
+
+
+def _check_progress(state: _UserState, notifications: list):
+    """Новый уровень и достижения; очки за достижение могут открыть следующие (first_steps, уровень)."""
+    profile = state.profile
+    level = level_for(profile['total_points'])
+    if level > profile['level']:
+        state.set({'level': level})
+        notifications.append(Notification(state.user_id, LEVEL_UP, level=level))
+    for ach_id, field, threshold in ACHIEVEMENT_RULES:
+        if ach_id not in state.achievements and (profile[field] or 0) >= threshold:
+            state.achievements.add(ach_id)
+            state.granted.append(ach_id)
+            _award(state, Award(POINTS_FOR_ACHIEVEMENT, f"Новое достижение: {ACHIEVEMENTS[ach_id]}!"), notifications)
+
+
+def _referral_bonus(state: _UserState, notifications: list) -> _UserState | None:
+    """Бонус пригласившему, когда приглашенный впервые набрал REFERRAL_THRESHOLD очков."""
+    profile = state.profile
+    referrer_id = profile.get('referred_by')
+    if not referrer_id or referrer_id == state.user_id or profile.get('referrer_bonus_given') \
+            or profile['total_points'] < REFERRAL_THRESHOLD:
+        return None
+    state.set({'referrer_bonus_given': 1})
+    referrer = _UserState(referrer_id)
+    referrer.set({'referrals_count': (referrer.profile['referrals_count'] or 0) + 1})
+    _award(referrer, Award(POINTS_FOR_INVITE, ''), notifications, kind=REFERRAL, friend_id=state.user_id)
+    return referrer
+
+
+def apply_event(user_id: int, awards: Sequence[Award] | Callable[[dict], Sequence[Award]] = (),
+                update: Callable[[dict], dict | None] | None = None, check_referral: bool = True) -> EventResult:
+    """
+    Применяет событие целиком (см. заголовок модуля).
+    update(profile) - поля профиля, которые меняет событие (считаются по профилю, прочитанному под блокировкой
+    записи), или None, если событие не засчитывается. awards - начисления; можно передать функцию от профиля
+    после update (например, бонус за серию зависит от новой длины серии).
+    Вызванная внутри внешнего db.transaction() функция становится частью внешней транзакции.
+    При отложенной записи (db.enable_write_behind) событие применяется под блокировкой буфера
+    и попадает в базу целиком одной пачкой - через flush_interval секунд или при COMMIT внешнего
+    db.transaction().
+    """
+    notifications = []
+    with db.profile_lock():
+        state = _UserState(user_id)
+        if update is not None:
+            fields = update(dict(state.profile))
+            if fields is None:
+                return EventResult(False, state.profile, notifications)
+            state.set(fields)
+        for award in (awards(dict(state.profile)) if callable(awards) else awards):
+            _award(state, award, notifications)
+        _check_progress(state, notifications)
+        referrer = _referral_bonus(state, notifications) if check_referral else None
+        state.save()
+        if referrer is not None:
+            referrer.save()
+    return EventResult(True, state.profile, notifications)
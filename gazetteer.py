@@ -0,0 +1,141 @@
+# gazetteer.py
+# Справочник городов: названия из колонки city в recycling_points.csv плюс варианты написания
+# из data/city_aliases.json ("кгн" -> "курган"). Строится вместе с индексом пунктов.
+#
+# Точное совпадение ищется по основам слов (словоформа не важна: "в Кургане"). Нечеткий поиск
+# (опечатки, порог 80% схожести, как раньше) идет не по всем вариантам, а только по нескольким
+# кандидатам, у которых больше всего общих триграмм с окном из нескольких слов сообщения.
+# Короткие слова и сокращения ("кгн", "екб") - только точно: у трехбуквенных строк одна лишняя буква
+# уже дает 80% ("кг" -> "кгн"). Единицы измерения ("5 кг макулатуры") нечетко не сравниваются вовсе.
+
+import heapq
+import json
+import math
+import logging
+import os
+from collections import Counter
+from itertools import chain
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Set, Tuple
+
+from thefuzz import fuzz
+
+from text_normalizer import fold, normalize_term
+
+SCORE_CUTOFF = 80
+# Сколько вариантов с наибольшим числом общих триграмм сравнивать нечетко для одного окна слов
+MAX_CANDIDATES = 8
+# Окна и варианты не длиннее стольких символов сравниваются только точно
+MAX_EXACT_ONLY_LENGTH = 3
+UNIT_WORDS = {'кг', 'г', 'гр', 'грамм', 'тонн', 'т', 'л', 'литр', 'мл', 'шт', 'штук', 'м', 'км', 'см', 'мм', 'см3', 'м3'}
+
+
+class CityMatch(NamedTuple):
+    city: str
+    start: int    # номер первого слова
+    end: int      # номер слова после последнего
+    score: int    # 100 - точное совпадение
+
+
+def trigrams(text: str) -> Set[str]:
+    """Триграммы символов; пробелы по краям, чтобы начало и конец слова давали свои триграммы."""
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def load_city_aliases(path: str) -> Dict[str, List[str]]:
+    """data/city_aliases.json: {"город": ["вариант", ...]}; город - как в колонке city."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    return {city.strip().lower(): [str(alias) for alias in aliases] for city, aliases in raw.items()}
+
+
+class Gazetteer:
+    """Города и их варианты написания с индексом по основам слов и по триграммам."""
+
+    def __init__(self, aliases: Dict[str, Iterable[str]], score_cutoff: int = SCORE_CUTOFF,
+                 max_candidates: int = MAX_CANDIDATES):
+        self.score_cutoff = score_cutoff
+        self.max_candidates = max_candidates
+        self.aliases: List[str] = []       # варианты написания (fold), номер варианта - индекс в списке
+        self.alias_city: List[str] = []    # город для каждого варианта
+        self.exact: Dict[Tuple[str, ...], str] = {}  # основы слов варианта -> город
+        self.postings: Dict[Tuple[str, int], List[int]] = {}  # (триграмма, длина варианта) -> номера вариантов
+        self.gram_counts: List[int] = []             # число триграмм каждого варианта
+        self.max_words = 1
+
+        seen = set()
+        for city, city_aliases in aliases.items():
+            for alias in dict.fromkeys([city, *city_aliases]):
+                text = ' '.join(fold(alias).split())
+                stems = normalize_term(text)
+                if not stems or text in seen:
+                    continue
+                seen.add(text)
+                alias_id = len(self.aliases)
+                self.aliases.append(text)
+                self.alias_city.append(city)
+                self.exact.setdefault(stems, city)
+                self.max_words = max(self.max_words, len(stems))
+                grams = trigrams(text)
+                self.gram_counts.append(len(grams))
+                for gram in grams:
+                    self.postings.setdefault((gram, len(text)), []).append(alias_id)
+
+    @classmethod
+    def from_sources(cls, cities: Iterable[str], alias_path: str | None = None) -> 'Gazetteer':
+        """Города из данных о пунктах плюс файл вариантов (в нем могут быть и города без пунктов)."""
+        aliases = {city.strip().lower(): [] for city in cities if city.strip()}
+        for city, city_aliases in load_city_aliases(alias_path).items():
+            aliases.setdefault(city, []).extend(city_aliases)
+        gazetteer = cls(aliases)
+        logging.info(f"Справочник городов: {len(aliases)} городов, {len(gazetteer)} вариантов написания.")
+        return gazetteer
+
+    def __len__(self):
+        return len(self.aliases)
+
+    def cities(self) -> List[str]:
+        return list(dict.fromkeys(self.alias_city))
+
+    def candidates(self, text: str) -> List[int]:
+        """
+        Номера вариантов, самых похожих на text по триграммам (коэффициент Дайса), не больше max_candidates.
+        Варианты, которые по длине не могут набрать score_cutoff, отбрасываются сразу.
+        """
+        # ratio = 2 * совпавшие символы / сумма длин, поэтому длины строк могут отличаться
+        # не больше чем в (200 - cutoff) / cutoff раз: остальные длины даже не просматриваем
+        grams = trigrams(text)
+        ratio = (200 - self.score_cutoff) / self.score_cutoff
+        lengths = range(math.ceil(len(text) / ratio), math.floor(len(text) * ratio) + 1)
+        shared = Counter(chain.from_iterable(self.postings.get((gram, length), ()) for gram in grams for length in lengths))
+        ranked = heapq.nlargest(self.max_candidates, shared.items(),
+                                key=lambda item: item[1] / (len(grams) + self.gram_counts[item[0]]))
+        return [alias_id for alias_id, _ in ranked]
+
+    def match(self, words: Sequence[str], stems: Sequence[str]) -> CityMatch | None:
+        """
+        Город в сообщении (words/stems - слова и их основы, как в vocabulary.Scan).
+        Сначала точное совпадение основ (более длинные названия важнее), затем нечеткое.
+        """
+        for size in range(min(self.max_words, len(stems)), 0, -1):
+            for start in range(len(stems) - size + 1):
+                city = self.exact.get(tuple(stems[start:start + size]))
+                if city:
+                    return CityMatch(city, start, start + size, 100)
+
+        best = None
+        for size in range(1, min(self.max_words, len(words)) + 1):
+            for start in range(len(words) - size + 1):
+                window_words = words[start:start + size]
+                window = ' '.join(window_words)
+                if len(window) <= MAX_EXACT_ONLY_LENGTH or UNIT_WORDS.intersection(window_words):
+                    continue
+                for alias_id in self.candidates(window):
+                    if len(self.aliases[alias_id]) <= MAX_EXACT_ONLY_LENGTH:
+                        continue
+                    score = fuzz.ratio(window, self.aliases[alias_id])
+                    if score >= self.score_cutoff and (best is None or score > best.score):
+                        best = CityMatch(self.alias_city[alias_id], start, start + size, score)
+        return best
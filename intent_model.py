@@ -0,0 +1,153 @@
+# intent_model.py
+# Локальный классификатор намерения (SEARCH / HELP / CHALLENGE / GENERAL) - чтобы не тратить вызов
+# GigaChat ради одного слова. Мультиномиальный наивный Байес по символьным n-граммам: устойчив к
+# опечаткам и словоформам, предсказание - сумма нескольких десятков чисел на каждый класс.
+# Соседние n-граммы сильно зависимы, поэтому "сырой" Байес слишком уверен в себе; уверенность
+# калибруется температурой, подобранной при обучении на отложенных примерах.
+#
+# Модель обучается офлайн (train_intent_model.py) по JSONL {"text": ..., "intent": ...} и сохраняется
+# в небольшой JSON. Бот загружает ее при старте и спрашивает GigaChat, только если модель не уверена;
+# ответы GigaChat дописываются в журнал и становятся обучающими примерами для следующей модели.
+
+import json
+import math
+import os
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from text_normalizer import fold
+
+INTENTS = ('SEARCH', 'HELP', 'CHALLENGE', 'GENERAL')
+NGRAM_SIZES = (2, 3, 4)
+
+
+def char_ngrams(text: str, sizes: Sequence[int] = NGRAM_SIZES) -> Counter:
+    """Символьные n-граммы текста; слова обрамлены пробелами, чтобы начало и конец слова были отдельными признаками."""
+    padded = f" {' '.join(fold(text).split())} "
+    return Counter(padded[i:i + n] for n in sizes for i in range(len(padded) - n + 1))
+
+
+def read_examples(paths: Iterable[str]) -> List[Tuple[str, str]]:
+    """Пары (текст, намерение) из JSONL-файлов; строки с неизвестным намерением пропускаются."""
+    examples = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                intent = str(item.get('intent', '')).upper()
+                if item.get('text') and intent in INTENTS:
+                    examples.append((item['text'], intent))
+    return examples
+
+
+def confidence(scores: Sequence[float], index: int, temperature: float = 1.0) -> float:
+    """Вероятность намерения index: softmax(scores / temperature)."""
+    return 1 / sum(math.exp((score - scores[index]) / temperature) for score in scores)
+
+
+class IntentLog:
+    """
+    Журнал намерений, определенных GigaChat: обучающие примеры для train_intent_model.py.
+    Как RotatingFileHandler: файл больше max_bytes переименовывается в path.1 (path.1 - в path.2 и т.д.,
+    хранится backups старых файлов). max_bytes=0 - без ограничения.
+    """
+
+    def __init__(self, path: str | None, max_bytes: int = 5 * 1024 * 1024, backups: int = 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._size = None
+        self._lock = threading.Lock()
+
+    def append(self, text: str, intent: str, **extra):
+        if not self.path:
+            return
+        line = (json.dumps({'text': text, 'intent': intent, **extra}, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            if self._size is None:
+                self._size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if self.max_bytes and self._size and self._size + len(line) > self.max_bytes:
+                self._rotate()
+            with open(self.path, 'ab') as f:
+                f.write(line)
+            self._size += len(line)
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._size = 0
+
+
+class IntentModel:
+    """log P(намерение) и log P(n-грамма | намерение) для каждого намерения."""
+
+    def __init__(self, intents: Sequence[str], priors: Sequence[float], features: Dict[str, List[float]],
+                 sizes: Sequence[int] = NGRAM_SIZES, temperature: float = 1.0):
+        self.intents = list(intents)
+        self.priors = list(priors)
+        self.features = features  # n-грамма -> log-вероятности по намерениям
+        self.sizes = tuple(sizes)
+        self.temperature = temperature
+
+    @classmethod
+    def train(cls, examples: Sequence[Tuple[str, str]], alpha: float = 0.5, min_count: int = 2,
+              sizes: Sequence[int] = NGRAM_SIZES) -> 'IntentModel':
+        """
+        examples - пары (текст, намерение). alpha - аддитивное сглаживание,
+        n-граммы реже min_count раз во всех примерах отбрасываются (модель остается маленькой).
+        """
+        intents = [intent for intent in INTENTS if any(label == intent for _, label in examples)]
+        counts = {intent: Counter() for intent in intents}
+        documents = Counter(label for _, label in examples)
+        for text, label in examples:
+            counts[label].update(char_ngrams(text, sizes))
+        total = Counter()
+        for intent_counts in counts.values():
+            total.update(intent_counts)
+        vocabulary = [gram for gram, count in total.items() if count >= min_count]
+
+        priors = [math.log(documents[intent] / len(examples)) for intent in intents]
+        denominators = [sum(counts[intent][gram] for gram in vocabulary) + alpha * len(vocabulary) for intent in intents]
+        features = {gram: [math.log((counts[intent][gram] + alpha) / denominator)
+                           for intent, denominator in zip(intents, denominators)] for gram in vocabulary}
+        return cls(intents, priors, features, sizes)
+
+    def scores(self, text: str) -> List[float]:
+        """Логарифмы совместной вероятности текста и каждого намерения (без калибровки)."""
+        scores = list(self.priors)
+        for gram, count in char_ngrams(text, self.sizes).items():
+            log_probs = self.features.get(gram)
+            if log_probs is None:
+                continue  # n-граммы вне словаря модели одинаково мало говорят о любом намерении
+            for i, log_prob in enumerate(log_probs):
+                scores[i] += count * log_prob
+        return scores
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Намерение и его калиброванная вероятность (уверенность модели, от 0 до 1)."""
+        scores = self.scores(text)
+        best = max(range(len(scores)), key=scores.__getitem__)
+        return self.intents[best], confidence(scores, best, self.temperature)
+
+    def __len__(self):
+        return len(self.features)
+
+    def save(self, path: str):
+        data = {'intents': self.intents, 'priors': self.priors, 'sizes': self.sizes, 'temperature': self.temperature,
+                'features': {gram: [round(value, 4) for value in values] for gram, values in self.features.items()}}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path: str) -> 'IntentModel':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['intents'], data['priors'], data['features'], data['sizes'], data.get('temperature', 1.0))
@@ -0,0 +1,64 @@
+# knowledge_index.py
+# Инвертированный индекс базы знаний: вопросы нормализуются (text_normalizer) один раз при загрузке,
+# а поиск затрагивает только записи, у которых есть общие слова с запросом.
+
+from collections import defaultdict
+from typing import Iterable, List, Tuple
+
+from data_store import KnowledgeEntry
+from text_normalizer import STOP_WORDS, normalize_words
+
+
+def tokenize(text: str, stop_words: Iterable[str] = STOP_WORDS) -> set:
+    """Множество нормализованных основ слов текста без стоп-слов."""
+    return set(normalize_words(text, stop_words))
+
+
+class KnowledgeIndex:
+    """
+    Индекс: основа слова -> номера записей, плюс количество слов в каждом вопросе.
+    Семантика совпадает со старым перебором: совпадение засчитывается,
+    если общих слов >= 2 и они покрывают больше 60% слов вопроса из базы.
+    """
+
+    MIN_SCORE = 2
+    MIN_RATIO = 0.6
+
+    def __init__(self, knowledge: List[KnowledgeEntry], stop_words: Iterable[str] = STOP_WORDS):
+        self.entries = knowledge
+        self.stop_words = frozenset(stop_words)
+        self.postings = defaultdict(list)
+        self.token_counts = []
+        for entry_id, item in enumerate(knowledge):
+            kb_words = tokenize(item.question, self.stop_words)
+            self.token_counts.append(len(kb_words))
+            for word in kb_words:
+                self.postings[word].append(entry_id)
+        self.postings = dict(self.postings)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def match_scores(self, question: str) -> dict:
+        """Возвращает {номер записи: число общих слов} только для пересекающихся записей."""
+        scores = defaultdict(int)
+        for word in tokenize(question, self.stop_words):
+            for entry_id in self.postings.get(word, ()):
+                scores[entry_id] += 1
+        return scores
+
+    def candidates(self, question: str) -> List[Tuple[int, int]]:
+        """Записи, прошедшие порог (score >= 2 и ratio > 0.6): [(номер записи, score), ...] по возрастанию номера."""
+        return [(entry_id, score) for entry_id, score in sorted(self.match_scores(question).items())
+                if score >= self.MIN_SCORE and score / self.token_counts[entry_id] > self.MIN_RATIO]
+
+    def lookup(self, question: str) -> Tuple[str, str | None]:
+        """Лучший ответ и его context_keyword, либо ("", None)."""
+        best_match_score, best_entry = 0, None
+        # Перебор по возрастанию номера сохраняет прежнее правило: при равенстве побеждает первая запись
+        for entry_id, score in self.candidates(question):
+            if score > best_match_score:
+                best_match_score, best_entry = score, self.entries[entry_id]
+        if best_entry is None:
+            return "", None
+        return best_entry.answer, best_entry.context_keyword
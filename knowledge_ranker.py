@@ -0,0 +1,108 @@
+# knowledge_ranker.py
+# BM25-ранжирование базы знаний по нормализованным основам слов. Матрица термин-документ
+# строится один раз при загрузке и хранится в разреженном виде (CSR по терминам),
+# запросы оцениваются векторно через NumPy.
+
+from collections import Counter
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from data_store import KnowledgeEntry
+from text_normalizer import STOP_WORDS, normalize_words
+
+# Сколько запросов оценивается за один проход в search_batch (ограничивает память: chunk x число записей)
+BATCH_CHUNK_SIZE = 1024
+
+
+class KnowledgeRanker:
+    """
+    BM25 по полю question (и, по желанию, answer с меньшим весом).
+    search() возвращает top-k пар (номер записи, оценка), search_batch() делает то же
+    для списка запросов за один векторный проход.
+    """
+
+    def __init__(self, knowledge: List[KnowledgeEntry], stop_words: Iterable[str] = STOP_WORDS, include_answers: bool = False,
+                 answer_weight: float = 0.3, k1: float = 1.5, b: float = 0.75):
+        self.entries = knowledge
+        self.stop_words = frozenset(stop_words)
+        self.vocabulary = {}
+
+        doc_terms = []
+        for item in knowledge:
+            tf = Counter(normalize_words(item.question, self.stop_words))
+            if include_answers:
+                for word, count in Counter(normalize_words(item.answer, self.stop_words)).items():
+                    tf[word] += answer_weight * count
+            doc_terms.append(tf)
+            for word in tf:
+                self.vocabulary.setdefault(word, len(self.vocabulary))
+
+        n_docs = len(doc_terms)
+        doc_len = np.array([sum(tf.values()) for tf in doc_terms], dtype=np.float32)
+        avg_len = float(doc_len.mean()) if n_docs and doc_len.mean() > 0 else 1.0
+
+        # Собираем тройки (термин, документ, tf) и сортируем по термину -> CSR
+        term_ids, doc_ids, tfs = [], [], []
+        for doc_id, tf in enumerate(doc_terms):
+            for word, count in tf.items():
+                term_ids.append(self.vocabulary[word]); doc_ids.append(doc_id); tfs.append(count)
+        term_ids = np.array(term_ids, dtype=np.int32)
+        doc_ids = np.array(doc_ids, dtype=np.int32)
+        tfs = np.array(tfs, dtype=np.float32)
+
+        order = np.argsort(term_ids, kind='stable')
+        term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+        df = np.bincount(term_ids, minlength=len(self.vocabulary)).astype(np.float32)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+        norm = k1 * (1.0 - b + b * doc_len[doc_ids] / avg_len)
+        self.weights = (idf[term_ids] * tfs * (k1 + 1.0) / (tfs + norm)).astype(np.float32)
+        self.doc_ids = doc_ids
+        self.term_ptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(df.astype(np.int64), out=self.term_ptr[1:])
+        self.n_docs = n_docs
+
+    def __len__(self):
+        return self.n_docs
+
+    def _query_postings(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        term_ids = [self.vocabulary[w] for w in set(normalize_words(query, self.stop_words)) if w in self.vocabulary]
+        if not term_ids:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        slices = [slice(self.term_ptr[t], self.term_ptr[t + 1]) for t in term_ids]
+        return (np.concatenate([self.doc_ids[s] for s in slices]),
+                np.concatenate([self.weights[s] for s in slices]))
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def score(self, query: str) -> np.ndarray:
+        """Вектор BM25-оценок запроса по всем записям."""
+        docs, weights = self._query_postings(query)
+        return np.bincount(docs, weights=weights, minlength=self.n_docs)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Top-k записей для одного запроса: [(номер записи, оценка), ...] по убыванию оценки."""
+        return self._top_k(self.score(query), k)
+
+    def search_batch(self, queries: Sequence[str], k: int = 5) -> List[List[Tuple[int, float]]]:
+        """Top-k для каждого запроса из списка; оценки считаются одной матричной операцией на блок."""
+        results = []
+        for start in range(0, len(queries), BATCH_CHUNK_SIZE):
+            chunk = queries[start:start + BATCH_CHUNK_SIZE]
+            rows, docs, weights = [], [], []
+            for row, query in enumerate(chunk):
+                q_docs, q_weights = self._query_postings(query)
+                rows.append(np.full(q_docs.shape[0], row, dtype=np.int64)); docs.append(q_docs); weights.append(q_weights)
+            flat = np.concatenate(rows) * self.n_docs + np.concatenate(docs) if rows else np.empty(0, dtype=np.int64)
+            scores = np.bincount(flat, weights=np.concatenate(weights) if weights else None,
+                                 minlength=len(chunk) * self.n_docs).reshape(len(chunk), self.n_docs)
+            results.extend(self._top_k(row_scores, k) for row_scores in scores)
+        return results
@@ -0,0 +1,63 @@
+# leaderboard.py
+# Кэш первых строк таблицы лидеров. Таблицу читают на каждое нажатие "лидеры 🏆", а меняется ее верх
+# редко: сброс нужен, только если начисление может задеть первые size строк (пользователь уже в них
+# или его очки не меньше последней строки). ttl - страховка от изменений в обход db_manager
+# (reset_quarter.py обнуляет очки отдельным процессом).
+
+import threading
+import time
+from typing import Callable, List
+
+
+class LeaderboardCache:
+    """load(limit) -> [{'user_id', 'quarterly_points'}, ...] по убыванию очков."""
+
+    def __init__(self, load: Callable[[int], List[dict]], size: int = 10, ttl: float = 60):
+        self.load = load
+        self.size = size
+        self.ttl = ttl
+        self._rows = None
+        self._ids = frozenset()
+        self._loaded_at = 0.0
+        self._generation = 0  # растет при каждом сбросе: загрузка, начатая до сброса, не попадет в кэш
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def top(self, limit: int) -> List[dict]:
+        if limit > self.size:
+            return self.load(limit)
+        with self._lock:
+            if self._rows is not None and time.monotonic() - self._loaded_at < self.ttl:
+                self.counters['hits'] += 1
+                return self._rows[:limit]
+            self.counters['misses'] += 1
+            generation = self._generation
+        rows = self.load(self.size)
+        with self._lock:
+            if generation == self._generation:
+                self._rows = rows
+                self._ids = frozenset(row['user_id'] for row in rows)
+                self._loaded_at = time.monotonic()
+        return rows[:limit]
+
+    def points_changed(self, user_id: int, points: int | None = None):
+        """Очки пользователя изменились; points=None - новое значение неизвестно (сбросить в любом случае)."""
+        with self._lock:
+            rows = self._rows
+            if rows is not None and points is not None and user_id not in self._ids \
+                    and len(rows) == self.size and points < rows[-1]['quarterly_points']:
+                return
+            self._invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._invalidate()
+
+    def _invalidate(self):
+        if self._rows is not None:
+            self.counters['invalidations'] += 1
+        self._rows = None
+        self._generation += 1
+
+    def stats(self) -> dict:
+        return dict(self.counters)
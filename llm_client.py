@@ -0,0 +1,223 @@
+# llm_client.py
+# Обертка над GigaChatSyncClient: у каждого вызова есть крайний срок, временные ошибки повторяются
+# с экспоненциальной паузой и случайным разбросом (jitter), а после серии неудач включается
+# предохранитель (circuit breaker) - вызовы сразу завершаются ошибкой CircuitOpenError, и обработчик
+# отвечает без GigaChat, вместо того чтобы ждать таймаута в каждом потоке.
+#
+# У синхронного клиента нет таймаута на отдельный вызов, поэтому вызов выполняется в пуле потоков,
+# а ждем его не дольше оставшегося времени. Брошенный вызов дорабатывает в фоне до таймаута самого
+# клиента (timeout в GigaChatSyncClient), поэтому тот стоит задавать не больше самого длинного срока.
+#
+# Срок вызова - меньшее из его собственного timeout и остатка бюджета обработчика:
+#     with llm.budget(25):        # сколько обработчик готов ждать GigaChat в сумме
+#         llm.chat(payload, timeout=5)
+#         llm.chat(payload)       # оставшееся время
+
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+import httpx
+from gigachat.exceptions import RateLimitError, ServerError
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+# Ошибки, после которых повтор имеет смысл: сеть, перегрузка, 5xx
+TRANSIENT_ERRORS = (httpx.TransportError, RateLimitError, ServerError)
+
+
+class LLMUnavailable(Exception):
+    """GigaChat не ответил вовремя или отключен предохранителем."""
+
+
+class CircuitOpenError(LLMUnavailable):
+    pass
+
+
+class DeadlineExceeded(LLMUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """
+    CLOSED - вызовы идут; failure_threshold неудач подряд переводят в OPEN.
+    OPEN - вызовы отклоняются reset_timeout секунд, затем HALF_OPEN: пропускается один пробный вызов,
+    успех закрывает предохранитель, неудача снова открывает.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+
+    @property
+    def available(self) -> bool:
+        """Пропустит ли предохранитель вызов сейчас (ничего не меняя)."""
+        with self._lock:
+            self._refresh()
+            return self.state == CLOSED or (self.state == HALF_OPEN and not self._probe_in_flight)
+
+    def allow(self) -> bool:
+        """Разрешение на вызов; в HALF_OPEN - только одному пробному."""
+        with self._lock:
+            self._refresh()
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info("GigaChat снова отвечает, предохранитель закрыт.")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.trips += 1
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+                logging.warning(f"GigaChat: {self.failures} неудач подряд, вызовы отключены на {self.reset_timeout} с.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {'state': self.state, 'failures': self.failures, 'trips': self.trips}
+
+
+class LLMClient:
+    """
+    chat/stream с тем же интерфейсом, что у GigaChatSyncClient, плюс крайний срок, повторы и предохранитель.
+    timeout - срок вызова по умолчанию, max_retries - сколько раз повторять временную ошибку.
+    """
+
+    def __init__(self, client, timeout: float = 20, max_retries: int = 2, backoff: float = 0.5,
+                 breaker: CircuitBreaker | None = None, workers: int = 8):
+        self.client = client
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm-call')
+        self._local = threading.local()
+        self.counters = Counter()  # calls / retries / timeouts / errors / rejected
+
+    @property
+    def available(self) -> bool:
+        return self.breaker.available
+
+    @contextmanager
+    def budget(self, seconds: float):
+        """Общий срок для всех вызовов внутри блока (в этом потоке)."""
+        previous = getattr(self._local, 'deadline', None)
+        deadline = time.monotonic() + seconds
+        self._local.deadline = deadline if previous is None else min(previous, deadline)
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
+
+    def _deadline(self, timeout: float | None) -> float:
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        budget = getattr(self._local, 'deadline', None)
+        return deadline if budget is None else min(deadline, budget)
+
+    def _acquire(self):
+        if not self.breaker.allow():
+            self.counters['rejected'] += 1
+            raise CircuitOpenError("GigaChat временно отключен после серии ошибок")
+
+    def _wait(self, future, deadline: float):
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining <= 0:
+                raise FutureTimeout()
+            return future.result(timeout=remaining)
+        except FutureTimeout:
+            future.cancel()
+            self.counters['timeouts'] += 1
+            raise DeadlineExceeded("GigaChat не ответил в отведенное время") from None
+
+    def chat(self, payload, timeout: float | None = None):
+        deadline = self._deadline(timeout)
+        self._acquire()
+        self.counters['calls'] += 1
+        attempt = 0
+        while True:
+            try:
+                response = self._wait(self._executor.submit(self.client.chat, payload), deadline)
+            except TRANSIENT_ERRORS as e:
+                # Полная случайная пауза: повторы разных потоков не бьют в сервер одновременно
+                pause = random.uniform(0, self.backoff * 2 ** attempt)
+                if attempt >= self.max_retries or time.monotonic() + pause >= deadline:
+                    self._fail(e)
+                    raise
+                attempt += 1
+                self.counters['retries'] += 1
+                logging.warning(f"GigaChat: временная ошибка ({e}), повтор {attempt} через {pause:.2f} с")
+                time.sleep(pause)
+                continue
+            except DeadlineExceeded as e:
+                self._fail(e)
+                raise
+            except Exception:
+                # Ошибки запроса (400, авторизация) - не признак недоступности сервиса
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return response
+
+    def stream(self, payload, timeout: float | None = None):
+        """
+        Фрагменты ответа; срок - на весь ответ. Повторов нет: часть ответа уже могла быть показана.
+        """
+        deadline = self._deadline(timeout)
+        self._acquire()
+        self.counters['calls'] += 1
+        chunks = None
+        try:
+            chunks = self._wait(self._executor.submit(lambda: iter(self.client.stream(payload))), deadline)
+            while True:
+                chunk = self._wait(self._executor.submit(next, chunks, None), deadline)
+                if chunk is None:
+                    break
+                yield chunk
+        except (DeadlineExceeded, *TRANSIENT_ERRORS) as e:
+            self._fail(e)
+            raise
+        except GeneratorExit:
+            # Потребитель бросил поток сам - сервис при этом отвечал
+            self.breaker.record_success()
+            raise
+        except Exception:
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+
+    def _fail(self, error: Exception):
+        self.counters['errors'] += 1
+        logging.error(f"GigaChat недоступен: {error}")
+        self.breaker.record_failure()
+
+    def stats(self) -> dict:
+        return {**self.breaker.stats(), **self.counters}
@@ -0,0 +1,228 @@
+# load_test.py
+# Нагрузочный тест бота без сети: настоящие обработчики bot_polling и полосы update_dispatcher,
+# Bot API и GigaChat - заменители из fakes.py, база и кэши - во временной папке.
+# Синтетические обновления: вопросы из базы знаний, поиск пунктов, свободные вопросы к GigaChat,
+# кнопки меню, нажатия inline-кнопок и ответы на викторину. В конце печатаются пропускная способность,
+# p50/p95/p99 задержки обработки по видам обновлений, время вызовов SQLite и ошибки блокировки базы.
+#
+# Запуск (все параметры необязательны):
+#   python load_test.py --updates 2000 --users 500 --rate 50 --llm-median 0.3 --llm-sigma 0.5 --api-ms 20
+#   python load_test.py --rate 0            # все обновления сразу, как после простоя polling
+#   python load_test.py --llm-mode router --error-rate 0.05
+#   python load_test.py --write-behind 1    # счетчики профилей через буфер отложенной записи
+
+import functools
+import itertools
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from telebot import types
+
+import fakes
+from metrics import LatencySamples
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+QUANTILES = (50, 95, 99)
+DEFAULTS = {
+    'updates': 2000, 'users': 500, 'rate': 50.0, 'seed': 1,
+    'llm_median': 0.3, 'llm_sigma': 0.5, 'llm_ttft': 0.1, 'error_rate': 0.0, 'api_ms': 20.0,
+    'llm_mode': 'legacy', 'streaming': 0, 'write_behind': 0,
+}
+# Доли видов обновлений
+MIX = {'kb': 0.25, 'search': 0.2, 'llm': 0.2, 'button': 0.2, 'callback': 0.1, 'poll': 0.05}
+GENERAL_SUBJECTS = ['динозавры', 'ледники', 'пчелы', 'коралловые рифы', 'тропические леса', 'киты', 'болота',
+                    'городские парки', 'северные олени', 'мангровые леса', 'почвы', 'реки сибири']
+GENERAL_TEMPLATES = ['почему исчезают {}', 'как климат влияет на {}', 'чем опасно загрязнение для {}',
+                     'расскажи интересное про {}', 'что будет, если не станет {}']
+CALLBACKS = ['show_all_challenges', 'more_points_1', 'cancel_action', 'subscribe_tip']
+
+
+def parse_args(argv) -> dict:
+    options = dict(DEFAULTS)
+    args = iter(argv)
+    for arg in args:
+        name = arg.lstrip('-').replace('-', '_')
+        if not arg.startswith('--') or name not in options:
+            raise SystemExit(f"Неизвестный параметр {arg}; доступны: {', '.join('--' + n.replace('_', '-') for n in options)}")
+        options[name] = type(DEFAULTS[name])(next(args))
+    return options
+
+
+class UpdateFactory:
+    """Синтетические обновления Telegram для пользователей 1..users."""
+
+    def __init__(self, bp, api: fakes.FakeBotAPI, users: int, rng: random.Random):
+        self.bp = bp
+        self.api = api
+        self.users = users
+        self.rng = rng
+        self._ids = itertools.count(1)
+        snapshot = bp.snapshots.current
+        self.kb_questions = [entry.question for entry in snapshot.knowledge]
+        self.materials = list(bp.vocabulary.MATERIAL_SYNONYMS)
+        self.cities = sorted(snapshot.points.by_city) or ['курган']
+        self.buttons = [bp.BTN_PROFILE, bp.BTN_LEADERBOARD, bp.BTN_RECYCLED, bp.BTN_QUIZ, bp.BTN_CHALLENGE, '/help']
+        self.kinds, self.weights = zip(*MIX.items())
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+    def _message(self, user_id: int, text: str) -> dict:
+        return {'message_id': next(self._ids), 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+                'from': self._user(user_id), 'text': text}
+
+    def next(self):
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        user_id = self.rng.randint(1, self.users)
+        update = {'update_id': next(self._ids)}
+        if kind == 'poll':
+            poll = self.api.take_poll()
+            if poll:
+                poll_id, user_id = poll
+                option = self.rng.randint(0, 3)
+                update['poll_answer'] = {'poll_id': poll_id, 'user': self._user(user_id), 'option_ids': [option],
+                                         'option_persistent_ids': [str(option)]}
+                return kind, types.Update.de_json(update)
+            kind = 'button'  # опросов еще не было
+        if kind == 'callback':
+            update['callback_query'] = {'id': str(next(self._ids)), 'from': self._user(user_id), 'chat_instance': '1',
+                                        'data': self.rng.choice(CALLBACKS), 'message': self._message(user_id, 'меню')}
+            return kind, types.Update.de_json(update)
+        if kind == 'kb':
+            text = self.rng.choice(self.kb_questions)
+        elif kind == 'search':
+            text = f"куда сдать {self.rng.choice(self.materials)} в {self.rng.choice(self.cities)}"
+        elif kind == 'llm':
+            text = self.rng.choice(GENERAL_TEMPLATES).format(self.rng.choice(GENERAL_SUBJECTS))
+        else:
+            text = self.rng.choice(self.buttons)
+        update['message'] = self._message(user_id, text)
+        return kind, types.Update.de_json(update)
+
+
+class DbProbe:
+    """Время каждой функции db_manager и число ошибок блокировки базы (sqlite 'database is locked')."""
+
+    def __init__(self, db, maxlen: int):
+        self.calls = LatencySamples(maxlen)
+        self.locked = 0
+        self.errors = Counter()
+        for name in dir(db):
+            func = getattr(db, name)
+            if callable(func) and getattr(func, '__module__', None) == db.__name__ and name not in ('get_connection', 'init_db'):
+                setattr(db, name, self._wrap(func))
+
+    def _wrap(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if 'locked' in str(e):
+                    self.locked += 1
+                self.errors[func.__name__] += 1
+                raise
+            finally:
+                self.calls.add(time.perf_counter() - started)
+        return wrapper
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+        self.locked = 0
+
+    def emit(self, record):
+        self.count += 1
+        if 'locked' in record.getMessage():
+            self.locked += 1
+
+
+def format_summary(summary: dict) -> str:
+    if not summary.get('count'):
+        return 'нет данных'
+    quantiles = ' '.join(f"{key[:-3]}={value:.1f}" for key, value in summary.items() if key.startswith('p'))
+    return f"{quantiles} max={summary['max_ms']:.1f} мс (n={summary['count']})"
+
+
+def main():
+    options = parse_args(sys.argv[1:])
+    rng = random.Random(options['seed'])
+    work_dir = tempfile.mkdtemp(prefix='eco_load_')
+    fakes.install_config(DATA_DIR, work_dir, LLM_MODE=options['llm_mode'], GIGACHAT_STREAMING=bool(options['streaming']),
+                         STREAM_EDIT_INTERVAL=0.5, WRITE_BEHIND=bool(options['write_behind']))
+    api = fakes.FakeBotAPI(fakes.Latency(options['api_ms'] / 1000, 0.3, random.Random(rng.random())))
+    api.install()
+
+    import bot_polling as bp
+    # Отказы полос и прочие предупреждения посчитаны в отчете; в вывод - только ошибки
+    logging.getLogger().setLevel(logging.ERROR)
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    giga = fakes.FakeGigaChat(fakes.Latency(options['llm_median'], options['llm_sigma'], random.Random(rng.random())),
+                              fakes.Latency(options['llm_ttft'], options['llm_sigma'], random.Random(rng.random())),
+                              error_rate=options['error_rate'], rng=random.Random(rng.random()))
+    bp.giga = bp.wrap_giga(giga)
+    bp.snapshots.load()
+    db_probe = DbProbe(bp.db, options['updates'] * 20)
+    factory = UpdateFactory(bp, api, options['users'], rng)
+
+    latencies = {kind: LatencySamples(options['updates']) for kind in ('all', *MIX)}
+    process_updates = bp.bot.process_new_updates
+
+    def process(kind, submitted_at, update):
+        process_updates([update])
+        elapsed = time.monotonic() - submitted_at
+        latencies[kind].add(elapsed)
+        latencies['all'].add(elapsed)
+
+    print(f"Обновлений: {options['updates']}, пользователей: {options['users']}, "
+          f"темп: {options['rate'] or 'без ограничения'} в секунду, GigaChat: медиана {options['llm_median']} с, "
+          f"режим {options['llm_mode']}{', потоковые ответы' if options['streaming'] else ''}")
+    sent = Counter()
+    started = time.monotonic()
+    for i in range(options['updates']):
+        if options['rate']:
+            delay = started + i / options['rate'] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        kind, update = factory.next()
+        sent[kind] += 1
+        bp.update_dispatcher.submit(update, functools.partial(process, kind, time.monotonic()))
+    submitted = time.monotonic() - started
+    bp.update_dispatcher.shutdown(wait=True)
+    elapsed = time.monotonic() - started
+    buffer_stats = bp.db.write_behind_stats()
+    bp.db.stop_write_behind()
+
+    lanes = bp.update_dispatcher.stats()
+    completed = sum(lane['completed'] for lane in lanes.values())
+    print(f"\nОтправлено за {submitted:.1f} с, обработано {completed} за {elapsed:.1f} с: {completed / elapsed:.1f} обновлений в секунду")
+    print(f"Виды: {dict(sent)}")
+    for name, lane in lanes.items():
+        print(f"Полоса {name}: принято {lane['accepted']}, отклонено {lane['rejected'] or 0}, "
+              f"наибольшая очередь {lane['max_depth']}, ожидание в очереди {format_summary(lane['wait'])}")
+    print("\nЗадержка обработки (от постановки в очередь до конца обработчика):")
+    for kind, samples in latencies.items():
+        print(f"  {kind:>8}: {format_summary(samples.summary(QUANTILES))}")
+    print(f"\nSQLite: {format_summary(db_probe.calls.summary(QUANTILES))}; "
+          f"ошибок блокировки: {db_probe.locked} (в логе: {errors.locked}), ошибок по функциям: {dict(db_probe.errors)}")
+    if buffer_stats:
+        print(f"Отложенная запись профилей: {buffer_stats}")
+    print(f"GigaChat: вызовов {dict(giga.calls)}, клиент: {bp.giga.stats()}")
+    print(f"Bot API: {dict(api.calls.most_common())}")
+    print(f"Ошибок в логе: {errors.count}")
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# metrics.py
+# Скользящие замеры задержек для периодического лога (log_runtime_stats): последние N значений
+# и перцентили по ним. Без внешних зависимостей, потокобезопасно.
+
+import math
+import threading
+from collections import deque
+from typing import Sequence
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """q-й перцентиль (0-100) по уже отсортированным значениям, ближайший ранг."""
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LatencySamples:
+    """Последние maxlen задержек в секундах."""
+
+    def __init__(self, maxlen: int = 1000):
+        self._samples = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def summary(self, quantiles: Sequence[float] = (50, 95)) -> dict:
+        """{'count': ..., 'p50_ms': ..., 'p95_ms': ..., 'max_ms': ...}; перцентили - по последним значениям."""
+        with self._lock:
+            values = sorted(self._samples)
+            result = {'count': self.count}
+        if values:
+            for q in quantiles:
+                result[f'p{q:g}_ms'] = round(percentile(values, q) * 1000, 1)
+            result['max_ms'] = round(values[-1] * 1000, 1)
+        return result
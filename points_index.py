@@ -0,0 +1,187 @@
+# points_index.py
+# Индекс пунктов приема, который строится один раз при загрузке:
+# город -> категория сырья -> список пунктов (уже без дублей по "название:адрес").
+# Поиск по известной категории - пара обращений к словарю; произвольный материал
+# ищется подстрокой, но только среди пунктов нужного города.
+# Пункты с координатами (колонки lat/lon или офлайн-кэш геокодирования) дополнительно
+# попадают в k-d деревья spatial_index: общее и по каждой категории.
+# Часы работы каждого пункта один раз компилируются в недельное расписание (work_hours).
+
+import json
+import logging
+import os
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import vocabulary
+from data_store import RecyclingPoint
+from spatial_index import KDTree, haversine_km
+from text_normalizer import match_term, normalize_term
+from work_hours import OPEN, UNKNOWN, WeeklySchedule, parse_work_hours
+
+
+def material_category(material: str) -> Tuple[str | None, List[str]]:
+    """Категория и ее термины для материала из запроса; (None, [material]), если категория не найдена."""
+    category = vocabulary.scan(material).material_category()
+    return (category, vocabulary.MATERIAL_SYNONYMS[category]) if category else (None, [material])
+
+
+def point_key(point: RecyclingPoint) -> str:
+    return f"{point.name}:{point.address}".lower()
+
+
+def geocode_key(city: str, address: str) -> str:
+    return f"{city}|{address}".strip().lower()
+
+
+def load_geocode_cache(path: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Офлайн-кэш координат для адресов без lat/lon: {"город|адрес": [широта, долгота]}.
+    Заполняется заранее вручную или отдельным скриптом; бот в сеть за координатами не ходит.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    return {geocode_key(*key.split('|', 1)): (float(value[0]), float(value[1]))
+            for key, value in raw.items() if '|' in key and value}
+
+
+def point_coordinates(point: RecyclingPoint, geocode_cache: Dict[str, Tuple[float, float]] | None = None) -> Tuple[float, float] | None:
+    """(широта, долгота) из колонок lat/lon, иначе из кэша геокодирования; None, если координат нет."""
+    if point.lat is not None and point.lon is not None and -90 <= point.lat <= 90 and -180 <= point.lon <= 180:
+        return point.lat, point.lon
+    if geocode_cache:
+        return geocode_cache.get(geocode_key(point.city, point.address))
+    return None
+
+
+def with_distance(point: RecyclingPoint, distance_km: float) -> RecyclingPoint:
+    """Копия пункта с расстоянием до пользователя (записи индекса неизменяемы)."""
+    return point._replace(distance_km=distance_km)
+
+
+class PointsIndex:
+    """Пункты приема, сгруппированные по городу и категории сырья."""
+
+    def __init__(self, points: List[RecyclingPoint], geocode_cache: Dict[str, Tuple[float, float]] | None = None):
+        self.by_city: Dict[str, List[RecyclingPoint]] = {}
+        self.by_material: Dict[str, Dict[str, List[RecyclingPoint]]] = {}
+        self._accepts_stems: Dict[str, List[Tuple[str, ...]]] = {}  # город -> основы accepts, параллельно by_city
+        self._schedules: Dict[str, WeeklySchedule] = {}  # строка work_hours -> расписание (общее для одинаковых строк)
+        self.unparsed_hours: Counter = Counter()  # строки work_hours, которые не удалось разобрать
+
+        unique_by_city = {}
+        for point in points:
+            city = point.city.strip().lower()
+            if not city or not point.accepts:
+                continue
+            # Координаты из кэша геокодирования записываем прямо в запись, некорректные - сбрасываем
+            lat, lon = point_coordinates(point, geocode_cache) or (None, None)
+            if (lat, lon) != (point.lat, point.lon):
+                point = point._replace(lat=lat, lon=lon)
+            # Как и раньше при выдаче: при повторе "название:адрес" остается последняя запись на месте первой
+            unique_by_city.setdefault(city, {})[point_key(point)] = point
+
+        located = {}
+        for city, unique_points in unique_by_city.items():
+            city_points = list(unique_points.values())
+            self.by_city[city] = city_points
+            categories = self.by_material.setdefault(city, {})
+            city_stems = self._accepts_stems.setdefault(city, [])
+            for point in city_points:
+                scan = vocabulary.scan(point.accepts)
+                city_stems.append(tuple(scan.stems))
+                schedule = parse_work_hours(point.work_hours) if point.work_hours else None
+                if schedule is not None:
+                    self._schedules[point.work_hours] = schedule
+                elif point.work_hours:
+                    self.unparsed_hours[point.work_hours] += 1
+                # Пункт попадает во все категории, термины которых есть в accepts
+                point_categories = list(dict.fromkeys(m.value for m in scan.of_kind(vocabulary.MATERIAL)))
+                for category in point_categories:
+                    categories.setdefault(category, []).append(point)
+                if point.lat is not None:
+                    for category in [None] + point_categories:
+                        located.setdefault(category, []).append((point.lat, point.lon, point))
+
+        # Дерево по всем пунктам (ключ None) и отдельное по каждой категории сырья
+        self.spatial: Dict[str | None, KDTree] = {category: KDTree(items) for category, items in located.items()}
+        if unique_by_city:
+            logging.info(f"Пункты с координатами: {len(self.spatial.get(None, []))} из {len(self)}")
+        if self.unparsed_hours:
+            report = '; '.join(f"'{hours}' ({count})" for hours, count in self.unparsed_hours.most_common(10))
+            logging.warning(f"Не удалось разобрать часы работы у {sum(self.unparsed_hours.values())} пунктов: {report}")
+
+    def __len__(self):
+        return sum(len(points) for points in self.by_city.values())
+
+    def cities(self) -> List[str]:
+        return list(self.by_city)
+
+    def search(self, material: str, city: str, category: str | None = None) -> Tuple[List[RecyclingPoint], List[str]]:
+        """
+        Пункты города, принимающие материал, и термины, по которым шел поиск.
+        category можно передать готовой (из разбора сообщения), чтобы не сканировать материал повторно.
+        """
+        city = city.lower()
+        if city not in self.by_city:
+            return [], []
+        if category:
+            search_terms = vocabulary.MATERIAL_SYNONYMS[category]
+        else:
+            category, search_terms = material_category(material)
+        if category:
+            return list(self.by_material[city].get(category, [])), search_terms
+        # Материал без категории: подстрочный поиск только по пунктам этого города
+        term_stems = [normalize_term(term) for term in search_terms]
+        found = [point for point, stems in zip(self.by_city[city], self._accepts_stems[city])
+                 if any(match_term(stems, term) for term in term_stems)]
+        return found, search_terms
+
+    def nearest(self, lat: float, lon: float, category: str | None = None, k: int = 10) -> List[RecyclingPoint]:
+        """k ближайших к точке пунктов (во всех городах) с полем distance_km; category сужает выбор."""
+        tree = self.spatial.get(category)
+        if tree is None:
+            return []
+        return [with_distance(point, distance) for distance, point in tree.nearest(lat, lon, k)]
+
+    def sort_by_distance(self, points: List[RecyclingPoint], lat: float, lon: float) -> List[RecyclingPoint]:
+        """
+        Найденные пункты по возрастанию расстояния (копии с distance_km).
+        Пункты без координат остаются в конце в исходном порядке.
+        """
+        located, unknown = [], []
+        for point in points:
+            if point.lat is not None:
+                located.append(with_distance(point, haversine_km(lat, lon, point.lat, point.lon)))
+            else:
+                unknown.append(point)
+        located.sort(key=lambda point: point.distance_km)
+        return located + unknown
+
+    def schedule(self, point: RecyclingPoint) -> WeeklySchedule | None:
+        return self._schedules.get(point.work_hours)
+
+    def opening_status(self, point: RecyclingPoint, minute: int) -> int:
+        """work_hours.OPEN / OPENS_SOON / CLOSED для минуты недели; UNKNOWN, если часы не распознаны."""
+        schedule = self.schedule(point)
+        return schedule.status(minute) if schedule is not None else UNKNOWN
+
+    def rank_by_opening(self, points: List[RecyclingPoint], minute: int, open_only: bool = False) -> List[RecyclingPoint]:
+        """
+        Открытые сейчас и скоро открывающиеся - выше, закрытые - в конце; внутри статуса порядок
+        сохраняется (например, по расстоянию). open_only оставляет только открытые прямо сейчас.
+        """
+        # У многих пунктов одинаковые часы работы: статус считаем один раз на строку
+        by_hours = {}
+        statuses = []
+        for point in points:
+            status = by_hours.get(point.work_hours)
+            if status is None:
+                status = by_hours[point.work_hours] = self.opening_status(point, minute)
+            statuses.append(status)
+        if open_only:
+            return [point for point, status in zip(points, statuses) if status == OPEN]
+        order = sorted(range(len(points)), key=statuses.__getitem__)
+        return [points[i] for i in order]
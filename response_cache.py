@@ -0,0 +1,105 @@
+# response_cache.py
+# Кэш ответов на повторяющиеся вопросы (шаги 5-6 handle_text: база знаний и GigaChat).
+# Уровень 1 - точное совпадение нормализованного текста, уровень 2 - совпадение
+# "мешка основ" (порядок слов и окончания не важны). Записи живут TTL секунд,
+# вытесняются по LRU и ограничены суммарным размером в байтах.
+
+import threading
+import time
+from collections import OrderedDict
+
+from text_normalizer import fold, normalize_words
+
+# Примерные накладные расходы на одну запись (ключ кортежем, словарь значения), в байтах
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class ResponseCache:
+    """
+    Значение - словарь {'kind': 'kb' | 'llm', 'answer': str, 'context': str | None, 'entry': KnowledgeEntry | None}
+    (entry - запись базы знаний, из которой взят ответ 'kb').
+    Ответы GigaChat ('llm') кэшируются только для вопросов без истории диалога,
+    и при поиске их можно исключить (include_llm=False), если у пользователя уже есть история.
+    """
+
+    EXACT, NORMALIZED = 'exact', 'normalized'
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024, ttl_seconds: int = 6 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # (уровень, ключ) -> (истекает, размер, значение)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = {self.EXACT: 0, self.NORMALIZED: 0}
+        self.misses = 0
+        self.llm_calls_saved = 0
+
+    @staticmethod
+    def exact_key(text: str) -> str:
+        return ' '.join(fold(text).split())
+
+    @staticmethod
+    def normalized_key(text: str) -> str:
+        # Стоп-слова не выкидываем: "можно" и "нельзя" должны давать разные ключи
+        return ' '.join(sorted(set(normalize_words(text, ()))))
+
+    def _keys(self, text: str):
+        yield self.EXACT, self.exact_key(text)
+        normalized = self.normalized_key(text)
+        if normalized:
+            yield self.NORMALIZED, normalized
+
+    def get(self, text: str, include_llm: bool = True) -> dict | None:
+        now = time.monotonic()
+        with self._lock:
+            for tier, key in self._keys(text):
+                entry = self._entries.get((tier, key))
+                if entry is None:
+                    continue
+                expires_at, size, value = entry
+                if expires_at < now:
+                    self._drop((tier, key))
+                    continue
+                if value['kind'] == 'llm' and not include_llm:
+                    continue
+                self._entries.move_to_end((tier, key))
+                self.hits[tier] += 1
+                if value['kind'] == 'llm':
+                    self.llm_calls_saved += 1
+                return value
+            self.misses += 1
+            return None
+
+    def put(self, text: str, kind: str, answer: str, context: str | None = None, entry=None):
+        value = {'kind': kind, 'answer': answer, 'context': context, 'entry': entry}
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for tier, key in self._keys(text):
+                size = ENTRY_OVERHEAD_BYTES + len(key.encode('utf-8')) + len(answer.encode('utf-8'))
+                if size > self.max_bytes:
+                    continue
+                if (tier, key) in self._entries:
+                    self._drop((tier, key))
+                self._entries[(tier, key)] = (expires_at, size, value)
+                self._size += size
+            while self._size > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, entry_key):
+        _, size, _ = self._entries.pop(entry_key)
+        self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self.hits.values()) + self.misses
+            return {
+                'entries': len(self._entries), 'bytes': self._size,
+                'hits_exact': self.hits[self.EXACT], 'hits_normalized': self.hits[self.NORMALIZED],
+                'misses': self.misses, 'hit_rate': round(sum(self.hits.values()) / total, 3) if total else 0.0,
+                'llm_calls_saved': self.llm_calls_saved,
+            }
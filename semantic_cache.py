@@ -0,0 +1,157 @@
+# semantic_cache.py
+# Хранилище "почти одинаковых" вопросов к GigaChat и полученных ответов.
+# Для каждого вопроса считается MinHash-подпись по шинглам (основы слов и пары соседних основ); подпись
+# режется на полосы (LSH), и поиск кандидатов идет по индексу полос в SQLite, а не перебором.
+# Кандидаты проверяются точным коэффициентом Жаккара по сохраненным шинглам и совместимостью вопросов:
+# одно слово, замененное другим ("батарейки" -> "лампочки"), или отрицание ("можно" -> "нельзя")
+# делают вопрос другим, каким бы высоким ни было сходство.
+# База лежит рядом с основной (DB_PATH), поэтому переживает перезапуск и общая для всех процессов.
+
+import hashlib
+import logging
+import random
+import threading
+import time
+from typing import List, Set
+
+from db_connection import ConnectionManager
+from text_normalizer import STOP_WORDS, normalize_token, normalize_words
+
+NUM_PERMUTATIONS = 64
+BANDS = 32
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Параметры перестановок фиксированы, чтобы подписи совпадали во всех процессах и после перезапуска
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+# Стоп-слова, которые меняют смысл вопроса: в шинглах остаются (как и в ключах response_cache.py)
+MEANING_WORDS = {'не', 'нет', 'ни', 'нельзя', 'можно', 'надо', 'может', 'никогда', 'ничего', 'без', 'разве'}
+_STOP_WORDS = STOP_WORDS - MEANING_WORDS
+_MEANING_STEMS = {normalize_token(word) for word in MEANING_WORDS}
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+def shingles(text: str, size: int = 2) -> Set[str]:
+    """Шинглы из 1..size подряд идущих основ слов (стоп-слова выкидываются, кроме MEANING_WORDS)."""
+    stems = normalize_words(text, _STOP_WORDS)
+    return {' '.join(stems[i:i + n]) for n in range(1, size + 1) for i in range(len(stems) - n + 1)}
+
+
+def compatible(a: Set[str], b: Set[str]) -> bool:
+    """
+    Один вопрос может лишь дополнять другой словами ("подскажите, ..."): основы меньшего вопроса
+    все есть в большем, а лишние основы - не отрицания и не "можно"/"нельзя".
+    """
+    words_a = {s for s in a if ' ' not in s}
+    words_b = {s for s in b if ' ' not in s}
+    smaller, larger = sorted((words_a, words_b), key=len)
+    return smaller <= larger and not (larger - smaller) & _MEANING_STEMS
+
+
+def minhash(shingle_set: Set[str]) -> List[int]:
+    hashes = [_hash64(s.encode('utf-8')) & _MAX_HASH for s in shingle_set]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH for a, b in _PERMUTATIONS]
+
+
+def band_buckets(signature: List[int]) -> List[int]:
+    """Ключ корзины для каждой полосы (знаковое 63-битное число, чтобы влезть в INTEGER SQLite)."""
+    buckets = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        buckets.append(_hash64(b''.join(r.to_bytes(4, 'big') for r in rows)) >> 1)
+    return buckets
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class SemanticCache:
+    """Ответы GigaChat на одиночные (без истории) вопросы с поиском по сходству Жаккара."""
+
+    def __init__(self, db_path: str, threshold: float = 0.8, shingle_size: int = 2, ttl_seconds: int = 30 * 24 * 3600):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._connections = ConnectionManager(db_path, busy_timeout=10)
+        self._init_db()
+
+    def _init_db(self):
+        with self._connections.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS semantic_answers (
+                    id INTEGER PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    shingles TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS semantic_bands (
+                    band INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    answer_id INTEGER NOT NULL,
+                    PRIMARY KEY (band, bucket, answer_id)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_semantic_bands_answer ON semantic_bands (answer_id)')
+
+    def lookup(self, question: str) -> str | None:
+        query_shingles = shingles(question, self.shingle_size)
+        if not query_shingles:
+            return None
+        buckets = band_buckets(minhash(query_shingles))
+        conditions = ' OR '.join(['(band = ? AND bucket = ?)'] * BANDS)
+        params = [value for band, bucket in enumerate(buckets) for value in (band, bucket)]
+        rows = self._connections.connection().execute(f'''
+            SELECT id, shingles, answer FROM semantic_answers
+            WHERE created_at >= ? AND id IN (SELECT answer_id FROM semantic_bands WHERE {conditions})
+        ''', [time.time() - self.ttl_seconds] + params).fetchall()
+
+        best_score, best_answer = 0.0, None
+        for _, stored_shingles, answer in rows:
+            stored_shingles = set(stored_shingles.split('\n'))
+            score = jaccard(query_shingles, stored_shingles)
+            if score > best_score and compatible(query_shingles, stored_shingles):
+                best_score, best_answer = score, answer
+        with self._lock:
+            if best_answer is not None and best_score >= self.threshold:
+                self.hits += 1
+                logging.info(f"Семантический кэш: ответ для '{question[:30]}...' (Жаккар {best_score:.2f})")
+                return best_answer
+            self.misses += 1
+            return None
+
+    def store(self, question: str, answer: str):
+        question_shingles = shingles(question, self.shingle_size)
+        if not question_shingles:
+            return
+        buckets = band_buckets(minhash(question_shingles))
+        with self._connections.transaction() as conn:
+            cursor = conn.execute(
+                'INSERT INTO semantic_answers (question, shingles, answer, created_at) VALUES (?, ?, ?, ?)',
+                (question, '\n'.join(sorted(question_shingles)), answer, time.time()))
+            conn.executemany('INSERT OR IGNORE INTO semantic_bands (band, bucket, answer_id) VALUES (?, ?, ?)',
+                             [(band, bucket, cursor.lastrowid) for band, bucket in enumerate(buckets)])
+
+    def purge_expired(self) -> int:
+        """Удаляет записи старше TTL вместе с их полосами; возвращает число удаленных ответов."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._connections.transaction() as conn:
+            conn.execute('DELETE FROM semantic_bands WHERE answer_id IN (SELECT id FROM semantic_answers WHERE created_at < ?)', (cutoff,))
+            return conn.execute('DELETE FROM semantic_answers WHERE created_at < ?', (cutoff,)).rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,117 @@
+# spatial_index.py
+# Пространственный индекс пунктов приема: k-d дерево над точками на единичной сфере.
+# Широта/долгота переводятся в трехмерный единичный вектор; расстояние по хорде монотонно
+# связано с расстоянием по поверхности, поэтому k ближайших по хорде - это k ближайших на карте,
+# без искажений у полюсов и на стыке долгот. Дерево строится один раз при загрузке данных.
+
+import heapq
+import math
+from typing import Any, Iterable, List, Tuple
+
+EARTH_RADIUS_KM = 6371.0
+LEAF_SIZE = 8
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние по поверхности Земли в километрах."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def to_unit_vector(lat: float, lon: float) -> Tuple[float, float, float]:
+    phi, lam = math.radians(lat), math.radians(lon)
+    return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+
+def chord_to_km(chord_squared: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+
+
+class KDTree:
+    """
+    Элементы - (широта, долгота, объект). Узлы хранятся в параллельных списках:
+    axis[n] = -1 у листа, тогда low[n]:high[n] - диапазон его точек в xyz/items.
+    box_min[n]/box_max[n] - ограничивающий параллелепипед точек узла: по нему отсекаются
+    поддеревья, которые заведомо дальше k-го найденного пункта.
+    """
+
+    def __init__(self, items: Iterable[Tuple[float, float, Any]]):
+        points = [(to_unit_vector(lat, lon), item) for lat, lon, item in items]
+        self.xyz: List[Tuple[float, float, float]] = []
+        self.items: List[Any] = []
+        self.axis: List[int] = []
+        self.split: List[float] = []
+        self.low: List[int] = []    # у листа - начало диапазона точек, у узла - левый потомок
+        self.high: List[int] = []   # у листа - конец диапазона точек, у узла - правый потомок
+        self.box_min: List[Tuple[float, float, float]] = []
+        self.box_max: List[Tuple[float, float, float]] = []
+        if points:
+            self._build(points)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _new_node(self, points: list) -> int:
+        xs, ys, zs = zip(*(vector for vector, _ in points))
+        self.box_min.append((min(xs), min(ys), min(zs)))
+        self.box_max.append((max(xs), max(ys), max(zs)))
+        self.axis.append(-1); self.split.append(0.0); self.low.append(0); self.high.append(0)
+        return len(self.axis) - 1
+
+    def _build(self, points: list) -> int:
+        node = self._new_node(points)
+        if len(points) <= LEAF_SIZE:
+            self.low[node] = len(self.items)
+            for vector, item in points:
+                self.xyz.append(vector)
+                self.items.append(item)
+            self.high[node] = len(self.items)
+            return node
+        # Делим по оси с наибольшим разбросом, по медиане
+        spreads = [high - low for low, high in zip(self.box_min[node], self.box_max[node])]
+        axis = spreads.index(max(spreads))
+        points.sort(key=lambda p: p[0][axis])
+        middle = len(points) // 2
+        self.axis[node], self.split[node] = axis, points[middle][0][axis]
+        self.low[node] = self._build(points[:middle])
+        self.high[node] = self._build(points[middle:])
+        return node
+
+    def _box_distance(self, node: int, query: Tuple[float, float, float]) -> float:
+        """Квадрат расстояния от точки запроса до параллелепипеда узла (0, если точка внутри)."""
+        total = 0.0
+        for q, low, high in zip(query, self.box_min[node], self.box_max[node]):
+            if q < low:
+                total += (low - q) ** 2
+            elif q > high:
+                total += (q - high) ** 2
+        return total
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[float, Any]]:
+        """k ближайших объектов: [(расстояние в км, объект), ...] по возрастанию расстояния."""
+        if k <= 0 or not self.items:
+            return []
+        qx, qy, qz = query = to_unit_vector(lat, lon)
+        axis, split, low, high, xyz = self.axis, self.split, self.low, self.high, self.xyz
+        best = []  # max-куча: (-квадрат хорды, номер точки)
+        stack = [(0, 0.0)]  # (узел, квадрат хорды до его параллелепипеда - нижняя оценка)
+        while stack:
+            node, bound = stack.pop()
+            if len(best) == k and bound >= -best[0][0]:
+                continue
+            node_axis = axis[node]
+            if node_axis < 0:
+                for index in range(low[node], high[node]):
+                    x, y, z = xyz[index]
+                    distance = (x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, index))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, index))
+                continue
+            near, far = (low[node], high[node]) if query[node_axis] < split[node] else (high[node], low[node])
+            stack.append((far, self._box_distance(far, query)))
+            stack.append((near, self._box_distance(near, query)))
+        return [(chord_to_km(-distance), self.items[index]) for distance, index in sorted(best, reverse=True)]
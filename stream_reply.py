@@ -0,0 +1,140 @@
+# stream_reply.py
+# Ответ, который печатается по мере генерации: сначала короткая заглушка, затем то же сообщение
+# редактируется (edit_message_text) накопленным текстом. Telegram ограничивает частоту правок одного
+# чата (около одной в секунду, при превышении - 429 с retry_after), поэтому правки идут не чаще
+# min_interval, а после 429 откладываются на указанное время.
+#
+# Промежуточный текст отправляется без разметки: незакрытые * или _ в середине ответа ломают
+# MarkdownV2. Окончательный текст - уже экранированный, с MarkdownV2 и откатом на простой текст.
+
+import logging
+import time
+
+import telebot
+from telebot import util
+
+PLACEHOLDER = "💭 Думаю…"
+MAX_MESSAGE_LENGTH = 4096
+TYPING_MARK = " …"
+# Дольше ждать окончательную правку после 429 нет смысла - проще отправить ответ новым сообщением
+MAX_FINAL_RETRY_AFTER = 5
+
+
+def retry_after(error: Exception) -> float | None:
+    """Сколько секунд Telegram просит подождать (ошибка 429), иначе None."""
+    if isinstance(error, telebot.apihelper.ApiTelegramException) and error.error_code == 429:
+        return float(((error.result_json or {}).get('parameters') or {}).get('retry_after', 1))
+    return None
+
+
+def is_not_modified(error: Exception) -> bool:
+    return isinstance(error, telebot.apihelper.ApiTelegramException) and 'message is not modified' in error.description
+
+
+class StreamingReply:
+    """
+    Одно сообщение бота, которое дописывается по ходу ответа.
+    start() отправляет заглушку (reply_to + kwargs, например клавиатуру), update() - промежуточный текст,
+    finish() - окончательный.
+    """
+
+    def __init__(self, bot: telebot.TeleBot, message, min_interval: float = 1.5, placeholder: str = PLACEHOLDER):
+        self.bot = bot
+        self.message = message
+        self.min_interval = min_interval
+        self.placeholder = placeholder
+        self.message_id = None
+        self.shown = ''
+        self.edits = 0
+        self._last_edit_at = 0.0
+        self._blocked_until = 0.0  # после 429
+
+    @property
+    def chat_id(self):
+        return self.message.chat.id
+
+    def start(self, **kwargs):
+        try:
+            self.message_id = self.bot.reply_to(self.message, self.placeholder, **kwargs).message_id
+            self.shown = self.placeholder
+        except Exception as e:
+            logging.error(f"Не удалось отправить заглушку ответа в чат {self.chat_id}: {e}")
+        self._last_edit_at = time.monotonic()
+
+    def update(self, text: str):
+        """Показывает накопленный текст, если с прошлой правки прошло min_interval. Ошибки только логируются."""
+        now = time.monotonic()
+        if self.message_id is None or now < self._blocked_until or now - self._last_edit_at < self.min_interval:
+            return
+        text = text.strip()[:MAX_MESSAGE_LENGTH - len(TYPING_MARK)] + TYPING_MARK
+        if text == self.shown:
+            return
+        try:
+            self._edit(text)
+        except Exception as e:
+            logging.warning(f"Не удалось обновить ответ в чате {self.chat_id}: {e}")
+
+    def finish(self, markdown_text: str, plain_text: str):
+        """
+        Заменяет заглушку окончательным ответом: MarkdownV2, при ошибке разметки - простой текст.
+        Если править не получилось (или ответ не помещается в одно сообщение) - отправляет его заново.
+        """
+        if self.message_id is not None and len(markdown_text) <= MAX_MESSAGE_LENGTH:
+            for parse_mode, text in (('MarkdownV2', markdown_text), (None, plain_text)):
+                try:
+                    if self._final_edit(text, parse_mode):
+                        return
+                    break
+                except telebot.apihelper.ApiTelegramException as e:
+                    if "can't parse entities" in str(e):
+                        logging.warning(f"MarkdownV2 parsing failed for chat {self.chat_id}. Sending as plain text.")
+                        continue
+                    logging.error(f"Не удалось отредактировать ответ в чате {self.chat_id}: {e}")
+                    break
+                except Exception as e:
+                    logging.error(f"Не удалось отредактировать ответ в чате {self.chat_id}: {e}")
+                    break
+        self._send_anew(plain_text)
+
+    def _edit(self, text: str, parse_mode: str | None = None) -> bool:
+        """False - Telegram попросил подождать (429); остальные ошибки пробрасываются."""
+        self._last_edit_at = time.monotonic()
+        try:
+            self.bot.edit_message_text(text, self.chat_id, self.message_id, parse_mode=parse_mode)
+        except Exception as e:
+            wait = retry_after(e)
+            if wait is not None:
+                self._blocked_until = time.monotonic() + wait
+                logging.warning(f"Telegram ограничил правки в чате {self.chat_id} на {wait} с")
+                return False
+            if not is_not_modified(e):
+                raise
+        self.shown = text
+        self.edits += 1
+        return True
+
+    def _final_edit(self, text: str, parse_mode: str | None) -> bool:
+        """Окончательная правка: после 429 ждет и повторяет, если ждать не дольше MAX_FINAL_RETRY_AFTER."""
+        for _ in range(2):
+            wait = self._blocked_until - time.monotonic()
+            if wait > MAX_FINAL_RETRY_AFTER:
+                return False
+            if wait > 0:
+                time.sleep(wait)
+            if self._edit(text, parse_mode):
+                return True
+        return False
+
+    def _send_anew(self, plain_text: str):
+        """Окончательный ответ новыми сообщениями простым текстом; заглушку, если она была, удаляет."""
+        if self.message_id is not None:
+            try:
+                self.bot.delete_message(self.chat_id, self.message_id)
+            except Exception as e:
+                logging.warning(f"Не удалось удалить заглушку ответа в чате {self.chat_id}: {e}")
+        for part in util.smart_split(plain_text, MAX_MESSAGE_LENGTH):
+            try:
+                self.bot.send_message(self.chat_id, part)
+            except Exception as e:
+                logging.error(f"Failed to send message to {self.chat_id}: {e}")
+                return
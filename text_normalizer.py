@@ -0,0 +1,151 @@
+# text_normalizer.py
+# Единая нормализация русского текста для всех сопоставлений (база знаний, поиск пунктов,
+# разметка базы): приведение к нижнему регистру, ё -> е, пунктуация -> пробел и лёгкий
+# стеммер (алгоритм Snowball для русского языка). Результат стемминга кэшируется по
+# исходному слову, поэтому частые слова обходятся в один поиск по словарю.
+
+import re
+from functools import lru_cache
+from typing import Iterable, List, Sequence, Tuple
+
+STOP_WORDS = set(['и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она', 'так', 'его', 'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'только', 'ее', 'мне', 'было', 'вот', 'от', 'меня', 'еще', 'нет', 'о', 'из', 'ему', 'теперь', 'когда', 'даже', 'ну', 'вдруг', 'ли', 'если', 'уже', 'или', 'ни', 'быть', 'был', 'него', 'до', 'вас', 'нибудь', 'опять', 'уж', 'вам', 'ведь', 'там', 'потом', 'себя', 'ничего', 'ей', 'может', 'они', 'тут', 'где', 'есть', 'надо', 'ней', 'для', 'мы', 'тебя', 'их', 'чем', 'была', 'сам', 'чтоб', 'без', 'будто', 'чего', 'раз', 'тоже', 'себе', 'под', 'будет', 'ж', 'тогда', 'кто', 'этот', 'того', 'потому', 'этого', 'какой', 'совсем', 'ним', 'здесь', 'этом', 'один', 'почти', 'мой', 'тем', 'чтобы', 'нее', 'сейчас', 'были', 'куда', 'зачем', 'всех', 'никогда', 'можно', 'при', 'наконец', 'два', 'об', 'другой', 'хоть', 'после', 'над', 'больше', 'тот', 'через', 'эти', 'нас', 'про', 'всего', 'них', 'какая', 'много', 'разве', 'три', 'эту', 'моя', 'впрочем', 'хорошо', 'свою', 'этой', 'перед', 'иногда', 'лучше', 'чуть', 'том', 'нельзя', 'такой', 'им', 'более', 'всегда', 'конечно', 'всю', 'между', 'такое', 'это'])
+
+# Размер LRU-кэша стеммера (в словах)
+TOKEN_CACHE_SIZE = 50000
+
+_PUNCTUATION = re.compile(r'[^\w\s]|_')
+_VOWELS = 'аеиоуыэюя'
+
+_PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+_ADJECTIVE = ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+              'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+_PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+_REFLEXIVE = ('ся', 'сь')
+_VERB = (('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+         ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен',
+          'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'))
+_NOUN = ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й',
+         'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я')
+_SUPERLATIVE = ('ейше', 'ейш')
+_DERIVATIONAL = ('ость', 'ост')
+
+
+def fold(text: str) -> str:
+    """Нижний регистр, ё -> е, пунктуация заменяется пробелом."""
+    return _PUNCTUATION.sub(' ', text.lower().replace('ё', 'е'))
+
+
+def _match_ending(rv: str, endings: Sequence[str], after_a: Sequence[str] = ()) -> int:
+    """
+    Длина самого длинного окончания из endings/after_a, которым заканчивается rv.
+    Окончания из after_a засчитываются, только если перед ними стоит 'а' или 'я'.
+    Возвращает 0, если подходящего окончания нет.
+    """
+    best, needs_a = 0, False
+    for group, group_needs_a in ((endings, False), (after_a, True)):
+        for ending in group:
+            if len(ending) > best and rv.endswith(ending):
+                best, needs_a = len(ending), group_needs_a
+    if needs_a and (len(rv) <= best or rv[-best - 1] not in 'ая'):
+        return 0
+    return best
+
+
+def _regions(word: str) -> Tuple[int, int]:
+    """Начала областей RV и R2 (по правилам Snowball)."""
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+    r1 = next((i + 1 for i in range(1, len(word)) if word[i] not in _VOWELS and word[i - 1] in _VOWELS), len(word))
+    r2 = next((i + 1 for i in range(r1 + 1, len(word)) if word[i] not in _VOWELS and word[i - 1] in _VOWELS), len(word))
+    return rv, r2
+
+
+def stem(word: str) -> str:
+    """Основа русского слова по алгоритму Snowball (без кэша; обычно вызывается через normalize_token)."""
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1: деепричастие, иначе возвратная частица + прилагательное/глагол/существительное
+    cut = _match_ending(rv, _PERFECTIVE_GERUND[1], _PERFECTIVE_GERUND[0])
+    if cut:
+        rv = rv[:-cut]
+    else:
+        cut = _match_ending(rv, _REFLEXIVE)
+        if cut:
+            rv = rv[:-cut]
+        cut = _match_ending(rv, _ADJECTIVE)
+        if cut:
+            rv = rv[:-cut]
+            cut = _match_ending(rv, _PARTICIPLE[1], _PARTICIPLE[0])
+            if cut:
+                rv = rv[:-cut]
+        else:
+            cut = _match_ending(rv, _VERB[1], _VERB[0]) or _match_ending(rv, _NOUN)
+            if cut:
+                rv = rv[:-cut]
+
+    # Шаг 2: конечное 'и'
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательный суффикс, целиком лежащий в R2
+    cut = _match_ending(rv, _DERIVATIONAL)
+    if cut and len(prefix) + len(rv) - cut >= r2_start:
+        rv = rv[:-cut]
+
+    # Шаг 4: 'нн' -> 'н', превосходная степень, мягкий знак
+    cut = _match_ending(rv, _SUPERLATIVE)
+    if cut:
+        rv = rv[:-cut]
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    elif rv.endswith('ь'):
+        rv = rv[:-1]
+    return prefix + rv
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def normalize_token(token: str) -> str:
+    """Нормализованная основа одного слова; результат кэшируется по исходному написанию."""
+    return stem(token.lower().replace('ё', 'е'))
+
+
+def split_words(text: str) -> List[str]:
+    """Слова текста после fold(), в исходном порядке (без стемминга)."""
+    return fold(text).split()
+
+
+def normalize_words(text: str, stop_words: Iterable[str] = STOP_WORDS) -> List[str]:
+    """Основы слов текста (с повторами) без стоп-слов."""
+    return [normalize_token(word) for word in split_words(text) if word not in stop_words]
+
+
+@lru_cache(maxsize=1024)
+def normalize_term(term: str) -> Tuple[str, ...]:
+    """Основы слов словарного термина ('опасные отходы' -> ('опасн', 'отход'))."""
+    return tuple(normalize_token(word) for word in split_words(term))
+
+
+def match_term(tokens: Sequence[str], term: Tuple[str, ...]) -> bool:
+    """
+    Есть ли термин в последовательности основ. Слово засчитывается, если его основа
+    начинается с основы слова термина ('батарейк' находит и 'батарейки', и 'батарейками').
+    Многословный термин должен идти подряд.
+    """
+    if not term:
+        return False
+    size = len(term)
+    for start in range(len(tokens) - size + 1):
+        if all(tokens[start + i].startswith(term[i]) for i in range(size)):
+            return True
+    return False
+
+
+def find_term(tokens: Sequence[str], term: Tuple[str, ...], start: int = 0) -> int:
+    """Позиция первого вхождения термина начиная с start (правило как в match_term), либо -1."""
+    size = len(term)
+    if not size:
+        return -1
+    for pos in range(start, len(tokens) - size + 1):
+        if all(tokens[pos + i].startswith(term[i]) for i in range(size)):
+            return pos
+    return -1
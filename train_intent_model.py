@@ -0,0 +1,112 @@
+# train_intent_model.py
+# Обучение локального классификатора намерений (intent_model) по размеченным сообщениям.
+# Примеры - JSONL {"text": "...", "intent": "SEARCH|HELP|CHALLENGE|GENERAL"}: стартовый набор
+# data/intent_examples.jsonl и журнал ответов GigaChat, который пишет бот (INTENT_LOG_PATH).
+# Кросс-валидация дает точность относительно разметки (меток GigaChat), по ней же подбирается температура
+# для калибровки уверенности; затем печатается доля сообщений, на которые модель ответит сама при пороге
+# уверенности (INTENT_CONFIDENCE в config.py), и время одного предсказания.
+#
+# Запуск:
+#   python train_intent_model.py                                   # data/intent_examples.jsonl
+#   python train_intent_model.py data/intent_examples.jsonl intent_log.jsonl --threshold 0.8
+
+import math
+import random
+import sys
+import time
+from collections import Counter
+
+from intent_model import INTENTS, IntentModel, confidence, read_examples
+
+EXAMPLES_PATH = './data/intent_examples.jsonl'
+MODEL_PATH = './data/intent_model.json'
+FOLDS = 5
+TEMPERATURES = [1, 1.5, 2, 3, 4, 5, 6, 7, 8, 10, 12, 16, 20]
+
+
+def parse_args(argv):
+    paths, threshold, out = [], 0.8, MODEL_PATH
+    args = iter(argv)
+    for arg in args:
+        if arg == '--threshold':
+            threshold = float(next(args))
+        elif arg == '--out':
+            out = next(args)
+        else:
+            paths.append(arg)
+    return paths or [EXAMPLES_PATH], threshold, out
+
+
+def fit_temperature(scored) -> float:
+    """Температура с наименьшей логарифмической потерей на отложенных примерах (label, intents, scores)."""
+    def log_loss(temperature):
+        return -sum(math.log(max(confidence(scores, intents.index(label), temperature), 1e-12))
+                    for label, intents, scores in scored if label in intents)
+    return min(TEMPERATURES, key=log_loss)
+
+
+def cross_validate(examples, threshold: float) -> float:
+    """
+    Предсказания для каждого примера моделью, обученной без него (FOLDS частей).
+    Печатает точность и долю уверенных ответов, возвращает подобранную температуру.
+    """
+    shuffled = list(examples)
+    random.Random(1).shuffle(shuffled)
+    scored = []
+    for fold in range(FOLDS):
+        train = [example for i, example in enumerate(shuffled) if i % FOLDS != fold]
+        test = [example for i, example in enumerate(shuffled) if i % FOLDS == fold]
+        model = IntentModel.train(train)
+        scored.extend((label, model.intents, model.scores(text)) for text, label in test)
+    temperature = fit_temperature(scored)
+    predictions = []
+    for label, intents, scores in scored:
+        best = max(range(len(scores)), key=scores.__getitem__)
+        predictions.append((label, intents[best], confidence(scores, best, temperature)))
+
+    correct = sum(label == intent for label, intent, _ in predictions)
+    print(f"Кросс-валидация ({FOLDS} частей): точность {correct / len(predictions):.1%} на {len(predictions)} примерах")
+    for intent in INTENTS:
+        labeled = [(label, predicted) for label, predicted, _ in predictions if label == intent]
+        if labeled:
+            print(f"  {intent:>9}: {sum(label == predicted for label, predicted in labeled) / len(labeled):.1%} из {len(labeled)}")
+    confident = [(label, intent) for label, intent, probability in predictions if probability >= threshold]
+    if confident:
+        print(f"Уверенность >= {threshold}: модель отвечает сама в {len(confident) / len(predictions):.1%} случаев, "
+              f"точность {sum(label == intent for label, intent in confident) / len(confident):.1%}; "
+              f"остальные {len(predictions) - len(confident)} уходят в GigaChat")
+    else:
+        print(f"Уверенность >= {threshold}: ни одного сообщения, все уходят в GigaChat")
+    print(f"Температура калибровки: {temperature}")
+    return temperature
+
+
+def main():
+    paths, threshold, out = parse_args(sys.argv[1:])
+    # При повторах текста верна последняя метка (журнал дописывается, свежие метки - в конце)
+    examples = list({text.strip().lower(): (text, intent) for text, intent in read_examples(paths)}.values())
+    print(f"Примеров: {len(examples)} ({', '.join(f'{intent} {count}' for intent, count in Counter(i for _, i in examples).most_common())})")
+    if len(examples) < FOLDS * 2:
+        print("Слишком мало примеров для обучения.")
+        return
+    temperature = cross_validate(examples, threshold)
+
+    started = time.perf_counter()
+    model = IntentModel.train(examples)
+    model.temperature = temperature
+    print(f"Обучение: {(time.perf_counter() - started) * 1000:.1f} мс, {len(model)} n-грамм")
+
+    texts = [text for text, _ in examples]
+    started = time.perf_counter()
+    for _ in range(10):
+        for text in texts:
+            model.predict(text)
+    per_call = (time.perf_counter() - started) / (10 * len(texts)) * 1000
+    print(f"Предсказание: {per_call:.3f} мс на сообщение")
+
+    model.save(out)
+    print(f"Модель сохранена в {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# user_names.py
+# Имена пользователей для таблицы лидеров и уведомлений о бонусе за приглашение без запросов к Telegram.
+# Имя приходит в каждом обновлении (from_user): remember() сохраняет его в таблицу user_names, но пишет
+# в базу, только если имя изменилось или запись пора обновить. Чтение - из памяти, затем из базы.
+# bot.get_chat вызывается только в фоне: для тех, чьего имени нет или чье имя старше ttl
+# (пользователь давно не писал боту); ответ придет к следующему показу.
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Tuple
+
+import db_manager as db
+
+
+def display_name(first_name: str | None, username: str | None) -> str | None:
+    return first_name or username or None
+
+
+def update_user(update):
+    """Отправитель обновления (telebot User) или None."""
+    for event in (update.message, update.edited_message, update.callback_query):
+        if event is not None and event.from_user is not None:
+            return event.from_user
+    if update.poll_answer is not None:
+        return update.poll_answer.user
+    return None
+
+
+class UserNames:
+    """
+    fetch(user_id) -> (first_name, username) - запрос к Telegram (bot.get_chat), только в фоновом потоке.
+    ttl - через сколько секунд имя считается устаревшим; max_entries - сколько имен держать в памяти.
+    """
+
+    def __init__(self, fetch: Callable[[int], Tuple[str | None, str | None]], ttl: float = 24 * 3600,
+                 max_entries: int = 50_000):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._names = OrderedDict()  # user_id -> (first_name, username, updated_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-names')
+        self.counters = {'saved': 0, 'memory': 0, 'db': 0, 'missing': 0, 'refreshed': 0, 'refresh_errors': 0}
+
+    def _store(self, user_id: int, first_name: str | None, username: str | None, updated_at: float):
+        self._names[user_id] = (first_name, username, updated_at)
+        self._names.move_to_end(user_id)
+        while len(self._names) > self.max_entries:
+            self._names.popitem(last=False)
+
+    def remember(self, user_id: int, first_name: str | None, username: str | None):
+        """Имя из обновления. В базу - только новое имя или раз в половину ttl (чтобы запись не устарела)."""
+        now = time.time()
+        with self._lock:
+            cached = self._names.get(user_id)
+            if cached and cached[:2] == (first_name, username) and now - cached[2] < self.ttl / 2:
+                return
+            self._store(user_id, first_name, username, now)
+            self.counters['saved'] += 1
+        db.save_user_name(user_id, first_name, username, now)
+
+    def remember_update(self, update):
+        user = update_user(update)
+        if user is not None and not user.is_bot:
+            try:
+                self.remember(user.id, user.first_name, user.username)
+            except Exception as e:
+                logging.error(f"Не удалось сохранить имя пользователя {user.id}: {e}")
+
+    def names(self, user_ids: Iterable[int]) -> Dict[int, str | None]:
+        """Имена для показа (None - имени пока нет); недостающие и устаревшие обновляются в фоне."""
+        user_ids = list(user_ids)
+        now = time.time()
+        with self._lock:
+            found = {user_id: self._names[user_id] for user_id in user_ids if user_id in self._names}
+            self.counters['memory'] += len(found)
+        missing = [user_id for user_id in user_ids if user_id not in found]
+        if missing:
+            loaded = db.get_user_names(missing)
+            with self._lock:
+                for user_id, entry in loaded.items():
+                    self._store(user_id, *entry)
+                self.counters['db'] += len(loaded)
+                self.counters['missing'] += len(missing) - len(loaded)
+            found.update(loaded)
+        for user_id in user_ids:
+            entry = found.get(user_id)
+            if entry is None or now - entry[2] >= self.ttl:
+                self._refresh(user_id)
+        return {user_id: display_name(*found[user_id][:2]) if user_id in found else None for user_id in user_ids}
+
+    def name(self, user_id: int) -> str | None:
+        return self.names([user_id])[user_id]
+
+    def _refresh(self, user_id: int):
+        with self._lock:
+            if user_id in self._refreshing:
+                return
+            self._refreshing.add(user_id)
+        self._executor.submit(self._fetch, user_id)
+
+    def _fetch(self, user_id: int):
+        try:
+            first_name, username = self.fetch(user_id)
+            self.remember(user_id, first_name, username)
+            self.counters['refreshed'] += 1
+        except Exception as e:
+            # Пользователь мог заблокировать бота: не повторяем до истечения ttl, оставляем прежнее имя
+            logging.warning(f"Не удалось обновить имя пользователя {user_id}: {e}")
+            self.counters['refresh_errors'] += 1
+            with self._lock:
+                first_name, username, _ = self._names.get(user_id, (None, None, 0))
+                self._store(user_id, first_name, username, time.time())
+        finally:
+            with self._lock:
+                self._refreshing.discard(user_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, 'cached': len(self._names), 'refreshing': len(self._refreshing)}
@@ -0,0 +1,161 @@
+# vocabulary.py
+# Единый словарь бота: синонимы видов сырья, поисковые триггеры, "мусорные" слова
+# и триггеры помощи. Города сюда не входят: они берутся из данных (см. gazetteer). При импорте все термины компилируются в один
+# автомат Ахо-Корасик, и один линейный проход по сообщению находит всё сразу.
+#
+# Автомат работает по строке из основ слов (text_normalizer), поэтому словоформа не важна:
+# термин 'батарейк' найдется и в "батарейки", и в "батарейками".
+
+from collections import deque
+from typing import Iterable, List, NamedTuple, Sequence, Tuple
+
+from text_normalizer import normalize_term, normalize_token, split_words
+
+# Категория сырья -> термины, по которым она узнается в запросе, в колонке accepts и в ответах базы знаний.
+# Порядок важен: при нескольких совпадениях побеждает категория, стоящая выше.
+MATERIAL_SYNONYMS = {
+    'шины': ['шин', 'покрышк', 'колес'],
+    'бутылки': ['бутылк', 'пэт', 'пластик'],
+    'пластик': ['пластик', 'пэт', 'бутылк', 'hdpe', 'пнд'],
+    'батарейки': ['батарейк', 'аккумулятор'],
+    'бумага': ['бумаг', 'макулатур', 'картон', 'книг'],
+    'стекло': ['стекл', 'банк', 'стеклотар'],
+    'одежда': ['одежд', 'вещи', 'текстиль', 'футболк'],
+    'металл': ['металл', 'жестян', 'алюмин', 'чермет', 'цветмет'],
+    'крышки': ['крышк'],
+    'техника': ['техник', 'электроника', 'бытовая техника'],
+    'опасные отходы': ['опасные отходы', 'ртуть', 'градусник', 'лампочк', 'лампа'],
+    'зубные щетки': ['зубная щетка', 'зубные щетки'],
+}
+SEARCH_TRIGGERS = ['куда сдать', 'где принимают', 'пункты приема', 'пункты приёма', 'адреса', 'адрес', 'найди', 'найти', 'где', 'куда']
+JUNK_WORDS = ['а', 'в', 'и', 'с', 'к', 'по']
+HELP_TRIGGERS = ['помощь', 'помоги', 'инструкция', 'что ты умеешь', 'хелп', 'справка']
+# "Куда сдать батарейки в Кургане, открытые сейчас" - показать только работающие пункты
+OPEN_NOW_TRIGGERS = ['открыт сейчас', 'открытые сейчас', 'сейчас открыт', 'работает сейчас', 'сейчас работает']
+
+MATERIAL, SEARCH_TRIGGER, JUNK, HELP, OPEN_NOW = 'material', 'search_trigger', 'junk', 'help', 'open_now'
+
+
+class Match(NamedTuple):
+    kind: str
+    value: str      # категория сырья или сам термин
+    start: int      # номер первого слова
+    end: int        # номер слова после последнего
+    priority: int   # порядок термина в словаре (меньше - важнее)
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик над символами: add() шаблоны, build(), затем iter() по тексту."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+    def add(self, pattern: str, payload):
+        state = 0
+        for ch in pattern:
+            if ch not in self.goto[state]:
+                self.goto.append({}); self.fail.append(0); self.out.append([])
+                self.goto[state][ch] = len(self.goto) - 1
+            state = self.goto[state][ch]
+        self.out[state].append(payload)
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def iter(self, text: str):
+        """Пары (индекс последнего символа совпадения, payload) за один проход по тексту."""
+        state = 0
+        for pos, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for payload in self.out[state]:
+                yield pos, payload
+
+
+class Scan(NamedTuple):
+    words: List[str]
+    stems: List[str]
+    matches: List[Match]
+
+    def of_kind(self, kind: str) -> List[Match]:
+        return [m for m in self.matches if m.kind == kind]
+
+    def material_category(self, keep: Sequence[bool] | None = None) -> str | None:
+        """Самая приоритетная категория сырья (только среди слов, где keep[i] истинно)."""
+        found = [m for m in self.of_kind(MATERIAL) if keep is None or all(keep[m.start:m.end])]
+        return min(found, key=lambda m: m.priority).value if found else None
+
+    def is_help_request(self) -> bool:
+        """Сообщение целиком состоит из одного триггера помощи."""
+        return any(m.start == 0 and m.end == len(self.stems) for m in self.of_kind(HELP))
+
+
+class Vocabulary:
+    """
+    Термины хранятся как ' основа1 основа2': ведущий пробел привязывает совпадение к началу слова,
+    а последняя основа совпадает как префикс слова. Для whole_word-терминов дополнительно
+    требуется, чтобы после совпадения слово заканчивалось.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, str, bool]]):
+        self.automaton = AhoCorasick()
+        for priority, (kind, value, term, whole_word) in enumerate(entries):
+            term_stems = normalize_term(term)
+            if term_stems:
+                pattern = ' ' + ' '.join(term_stems)
+                self.automaton.add(pattern, (kind, value, whole_word, priority, len(pattern)))
+        self.automaton.build()
+
+    def scan_stems(self, stems: Sequence[str]) -> List[Match]:
+        text_parts, token_at = [' '], [0]
+        for index, stem in enumerate(stems):
+            text_parts.append(stem + ' ')
+            token_at.extend([index] * (len(stem) + 1))
+        text = ''.join(text_parts)
+
+        matches = []
+        for end_pos, (kind, value, whole_word, priority, length) in self.automaton.iter(text):
+            if whole_word and text[end_pos + 1] != ' ':
+                continue
+            matches.append(Match(kind, value, token_at[end_pos - length + 2], token_at[end_pos] + 1, priority))
+        return matches
+
+    def scan(self, text: str) -> Scan:
+        words = split_words(text)
+        stems = [normalize_token(word) for word in words]
+        return Scan(words, stems, self.scan_stems(stems))
+
+
+def default_entries():
+    for category, terms in MATERIAL_SYNONYMS.items():
+        for term in terms:
+            yield MATERIAL, category, term, False
+    for trigger in SEARCH_TRIGGERS:
+        yield SEARCH_TRIGGER, trigger, trigger, False
+    for word in JUNK_WORDS:
+        yield JUNK, word, word, True
+    for trigger in HELP_TRIGGERS:
+        yield HELP, trigger, trigger, True
+    for trigger in OPEN_NOW_TRIGGERS:
+        yield OPEN_NOW, trigger, trigger, False
+
+
+VOCABULARY = Vocabulary(default_entries())
+
+
+def scan(text: str) -> Scan:
+    """Один проход общего словаря по тексту."""
+    return VOCABULARY.scan(text)
@@ -0,0 +1,179 @@
+# work_hours.py
+# Разбор колонки work_hours ("с 8.00 до 17.00 Суббота и воскресенье выходной", "пн-пт 09:00-18:00; сб 09:00-13:00")
+# в недельное расписание: отсортированные интервалы в минутах от понедельника 00:00, хранящиеся в массивах.
+# Строка разбирается один раз при загрузке; "открыто ли сейчас" - один бинарный поиск по массиву.
+
+import re
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, List, Set, Tuple
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+ALL_DAYS = frozenset(range(7))
+
+# Статусы пункта для сортировки результатов (меньше - выше в выдаче)
+OPEN, OPENS_SOON, UNKNOWN, CLOSED = 0, 1, 2, 3
+OPENS_SOON_MINUTES = 60
+
+_DAY_PATTERNS = [
+    r'понедельник\w*|пн', r'вторник\w*|вт', r'сред[аеуы]|ср', r'четверг\w*|чт',
+    r'пятниц\w*|пт', r'суббот\w*|сб', r'воскресень\w*|вс',
+]
+_DAY = '|'.join(f'(?:{p})' for p in _DAY_PATTERNS)
+_TIME = r'\d{1,2}(?:[.:]\d{2})?'
+_TOKEN = re.compile(
+    rf'(?P<day>\b(?:{_DAY})\b)(?:\s*[-–—]\s*(?P<day_to>\b(?:{_DAY})\b))?'
+    rf'|(?P<daily>\bежедневно\b|\bбез выходных\b)'
+    rf'|(?P<round>\bкруглосуточно\b)'
+    rf'|(?P<closed>\bвыходн\w*)'
+    rf'|(?P<pause>\bперерыв\w*|\bобед\w*)'
+    rf'|(?:\bс\s*)?(?P<start>\b{_TIME})\s*(?:ч\.?\s*)?(?:до|[-–—])\s*(?P<end>{_TIME}\b)'
+)
+# Что может остаться между распознанными фрагментами, не делая строку "нераспознанной"
+_FILLER = re.compile(r'^[\s,.;:и()\-–—]*$')
+
+
+def _day_index(word: str) -> int:
+    return next(i for i, pattern in enumerate(_DAY_PATTERNS) if re.fullmatch(pattern, word))
+
+
+def _minutes(value: str) -> int:
+    hours, _, minutes = value.replace(':', '.').partition('.')
+    return int(hours) * 60 + int(minutes or 0)
+
+
+class WeeklySchedule:
+    """Непересекающиеся интервалы [starts[i], ends[i]) в минутах от понедельника 00:00."""
+
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, intervals: Iterable[Tuple[int, int]]):
+        merged = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = array('H', (start for start, _ in merged))
+        self.ends = array('H', (end for _, end in merged))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def is_open(self, minute: int) -> bool:
+        i = bisect_right(self.starts, minute) - 1
+        return i >= 0 and minute < self.ends[i]
+
+    def minutes_until_open(self, minute: int) -> int | None:
+        """0, если открыто; иначе сколько минут до ближайшего открытия (None - не работает никогда)."""
+        if not self.starts:
+            return None
+        i = bisect_right(self.starts, minute)
+        if i and minute < self.ends[i - 1]:
+            return 0
+        next_start = self.starts[i] if i < len(self.starts) else self.starts[0] + MINUTES_PER_WEEK
+        return next_start - minute
+
+    def status(self, minute: int, soon_minutes: int = OPENS_SOON_MINUTES) -> int:
+        wait = self.minutes_until_open(minute)
+        if wait == 0:
+            return OPEN
+        return OPENS_SOON if wait is not None and wait <= soon_minutes else CLOSED
+
+
+def _day_intervals(days: Set[int], ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Интервалы недели для дней days; ночные интервалы (22:00-02:00) переходят на следующий день."""
+    intervals = []
+    for day in days:
+        base = day * MINUTES_PER_DAY
+        for start, end in ranges:
+            if end <= start:
+                end += MINUTES_PER_DAY
+            start, end = base + start, base + end
+            if end > MINUTES_PER_WEEK:
+                intervals.append((0, end - MINUTES_PER_WEEK))
+                end = MINUTES_PER_WEEK
+            intervals.append((start, end))
+    return intervals
+
+
+def _subtract(intervals: List[Tuple[int, int]], holes: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    for hole_start, hole_end in holes:
+        result = []
+        for start, end in intervals:
+            if hole_end <= start or end <= hole_start:
+                result.append((start, end))
+                continue
+            if start < hole_start:
+                result.append((start, hole_start))
+            if hole_end < end:
+                result.append((hole_end, end))
+        intervals = result
+    return intervals
+
+
+@lru_cache(maxsize=4096)
+def parse_work_hours(text: str) -> WeeklySchedule | None:
+    """
+    Расписание из строки work_hours или None, если строку не удалось разобрать целиком.
+    Группа - дни и относящиеся к ним интервалы / "выходной" / "перерыв". Интервалы без дней
+    относятся ко всем дням, которые не упомянуты в других группах.
+    """
+    text = text.strip().lower()
+    if not text:
+        return None
+    groups = []  # [дни (None - "остальные"), интервалы, перерывы, 'closed' | None]
+    position, pause = 0, False
+    for token in _TOKEN.finditer(text):
+        if not _FILLER.match(text[position:token.start()]):
+            return None
+        position = token.end()
+        group = groups[-1] if groups else None
+        if token['day'] or token['daily']:
+            days = set(ALL_DAYS) if token['daily'] else {_day_index(token['day'])}
+            if token['day_to']:
+                first, last = _day_index(token['day']), _day_index(token['day_to'])
+                days = {day % 7 for day in range(first, last + 1 if last >= first else last + 8)}
+            # Дни подряд ("Суббота и воскресенье") копятся в одну группу, пока у нее нет времени
+            if group and group[0] is not None and not group[1] and not group[2] and group[3] is None:
+                group[0] |= days
+            else:
+                groups.append([days, [], [], None])
+            pause = False
+            continue
+        if group is None:
+            group = [None, [], [], None]
+            groups.append(group)
+        if token['round']:
+            group[1].append((0, MINUTES_PER_DAY))
+        elif token['closed']:
+            group[3] = 'closed'
+        elif token['pause']:
+            pause = True
+        else:
+            start, end = _minutes(token['start']), _minutes(token['end'])
+            if start > MINUTES_PER_DAY or end > MINUTES_PER_DAY:
+                return None
+            (group[2] if pause else group[1]).append((start, end))
+            pause = False
+    if not groups or not _FILLER.match(text[position:]):
+        return None
+
+    mentioned = set().union(*(g[0] for g in groups if g[0] is not None))
+    intervals = []
+    for days, ranges, pauses, closed in groups:
+        days = days if days is not None else ALL_DAYS - mentioned
+        if closed or not ranges:
+            continue
+        intervals.extend(_subtract(_day_intervals(days, ranges), _day_intervals(days, pauses)))
+    if not intervals and not any(g[3] for g in groups):
+        return None
+    return WeeklySchedule(intervals)
+
+
+def week_minute(moment: datetime) -> int:
+    """Минута недели (от понедельника 00:00) для момента в местном времени."""
+    return moment.weekday() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute